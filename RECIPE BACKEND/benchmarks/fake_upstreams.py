@@ -0,0 +1,250 @@
+"""
+Local stand-ins for Gemini, Pixabay, Pexels and Unsplash.
+
+One ASGI app serves all four under /gemini, /pixabay, /pexels and /unsplash,
+with per-provider latency distributions and error rates. Gemini answers with
+canned outputs shaped like the prompts in routers/, and can be told to return
+a share of them malformed (fenced, trailing commas, truncated or plain prose)
+to exercise the tolerant parsers.
+"""
+import re
+import json
+import math
+import random
+import socket
+import asyncio
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MEAL_TYPES = ["Breakfast", "Lunch", "Dinner"]
+MALFORMED_KINDS = ["fenced", "trailing_comma", "truncated", "prose"]
+
+_DISHES = ["Adobo", "Stir-Fry", "Curry", "Frittata", "Pasta Bake", "Tacos", "Risotto", "Soup", "Salad", "Skillet"]
+_MAINS = ["Chicken", "Tofu", "Beef", "Shrimp", "Mushroom", "Lentil", "Pork", "Salmon", "Vegetable", "Egg"]
+_INGREDIENTS = [
+    "2 cloves garlic, minced", "1 onion, diced", "2 tbsp olive oil", "1 cup rice", "salt to taste",
+    "1 lb chicken thighs", "2 tomatoes", "1 cup spinach", "1 tsp cumin", "2 eggs", "1 bell pepper",
+    "1/2 cup soy sauce", "1 cup coconut milk", "200g mushrooms", "1 carrot, grated",
+]
+
+
+class UpstreamProfile:
+    """Latency and failure behaviour of one stand-in provider."""
+
+    def __init__(self, median_ms: float, sigma: float = 0.5, error_rate: float = 0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Seconds, log-normally distributed around the median, like real API latencies."""
+        return self.median_ms / 1000 * math.exp(self.sigma * rng.gauss(0, 1))
+
+
+class FakeUpstreams:
+    """Holds the provider profiles and Gemini output settings, and builds the ASGI app."""
+
+    def __init__(
+        self,
+        gemini: UpstreamProfile,
+        images: UpstreamProfile,
+        malformed_rate: float = 0.0,
+        allergen_rate: float = 0.0,
+        image_miss_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.profiles = {"gemini": gemini, "pixabay": images, "pexels": images, "unsplash": images}
+        self.malformed_rate = malformed_rate
+        self.allergen_rate = allergen_rate
+        self.image_miss_rate = image_miss_rate
+        self.rng = random.Random(seed)
+        self._titles = itertools.count(1)
+        self.requests: Dict[str, int] = {name: 0 for name in self.profiles}
+        self.errors: Dict[str, int] = {name: 0 for name in self.profiles}
+        self.app = self._build_app()
+
+    # --- Canned Gemini outputs ---
+    def _title(self) -> str:
+        return f"{self.rng.choice(_MAINS)} {self.rng.choice(_DISHES)} #{next(self._titles)}"
+
+    def _ingredients(self) -> List[str]:
+        ingredients = self.rng.sample(_INGREDIENTS, 6)
+        if self.rng.random() < self.allergen_rate:
+            ingredients.append("2 tbsp peanut butter")
+        return ingredients
+
+    def _recipe(self) -> Dict[str, Any]:
+        title = self._title()
+        return {
+            "title": title,
+            "prepTime": self.rng.randint(10, 60),
+            "difficulty": self.rng.choice(["Easy", "Medium", "Hard"]),
+            "cuisineType": "Various",
+            "ingredients": self._ingredients(),
+            "instructions": ["Prep the ingredients.", "Cook everything together.", "Serve warm."],
+            "imageKeyword": title.split(" #")[0].lower(),
+        }
+
+    def _meals(self, days: List[str], meal_types: List[str]) -> List[Dict[str, Any]]:
+        return [{"day": day, "mealType": meal_type, "recipe": self._recipe()} for day in days for meal_type in meal_types]
+
+    def gemini_text(self, prompt: str) -> str:
+        """Well-formed output for whichever router prompt this is."""
+        if prompt.startswith("List common and popular recipes"):
+            return "\n\n".join(
+                f"Recipe# {number}\nRecipe Name: {self._title()}\nTime to Cook: {self.rng.randint(10, 90)} minutes\n"
+                f"Difficulty: {self.rng.choice(['Easy', 'Medium', 'Hard'])}\nImage Keyword: {self.rng.choice(_MAINS).lower()} dish"
+                for number in range(1, 6)
+            )
+        if prompt.startswith("Provide detailed information"):
+            return json.dumps({
+                "description": "A comforting home-style dish.",
+                "ingredients": self._ingredients(),
+                "instructions": ["Prep the ingredients.", "Cook everything together.", "Serve warm."],
+                "servings": "4 servings",
+            })
+        if prompt.startswith("Generate a creative and unique single recipe"):
+            recipe = self._recipe()
+            return json.dumps({
+                "name": recipe["title"], "ingredients": recipe["ingredients"], "instructions": recipe["instructions"],
+                "cookingTime": f"{recipe['prepTime']} minutes", "imageKeyword": recipe["imageKeyword"],
+            })
+        if prompt.startswith("Generate a complete 7-day meal plan"):
+            return json.dumps(self._meals(DAYS, MEAL_TYPES))
+        if prompt.startswith("Generate Breakfast, Lunch, and Dinner for"):
+            day = next((day for day in DAYS if f"for {day}" in prompt), "Monday")
+            return json.dumps(self._meals([day], MEAL_TYPES))
+        if prompt.startswith("Generate one"):
+            meal_type, day = re.match(r"Generate one (\w+) recipe for (\w+)", prompt).groups()
+            return json.dumps(self._meals([day], [meal_type])[0])
+        return "I can help with recipes."
+
+    def _malform(self, text: str) -> str:
+        kind = self.rng.choice(MALFORMED_KINDS)
+        if kind == "fenced":
+            return f"Here you go!\n```json\n{text}\n```"
+        if kind == "trailing_comma":
+            return text.replace("]", ",]", 1).replace("}", ",}", 1)
+        if kind == "truncated":
+            return text[: max(1, int(len(text) * self.rng.uniform(0.5, 0.95)))]
+        return "Sorry, I couldn't come up with anything this time."
+
+    def generate(self, prompt: str) -> str:
+        text = self.gemini_text(prompt)
+        return self._malform(text) if self.rng.random() < self.malformed_rate else text
+
+    # --- App ---
+    async def _behave(self, provider: str) -> Optional[JSONResponse]:
+        """Sleeps for a sampled latency, then maybe fails the call."""
+        self.requests[provider] += 1
+        profile = self.profiles[provider]
+        await asyncio.sleep(profile.sample_latency(self.rng))
+        if self.rng.random() < profile.error_rate:
+            self.errors[provider] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=self.rng.choice([500, 502, 503]))
+        return None
+
+    def _image_url(self, provider: str, keyword: str) -> Optional[str]:
+        if self.rng.random() < self.image_miss_rate:
+            return None
+        return f"https://images.example/{provider}/{keyword.replace(' ', '-')}.jpg"
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake upstream providers")
+
+        @app.post("/gemini/models/{model_method}")
+        async def gemini(model_method: str, request: Request):
+            failure = await self._behave("gemini")
+            if failure is not None:
+                return failure
+            body = await request.json()
+            prompt = body["contents"][0]["parts"][0]["text"]
+            text = self.generate(prompt)
+            # Roughly four characters per token, like Gemini's own estimate
+            usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4}
+            if model_method.endswith(":streamGenerateContent"):
+                return StreamingResponse(self._sse(text, usage), media_type="text/event-stream")
+            return {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage}
+
+        @app.get("/pixabay/")
+        async def pixabay(q: str = "food"):
+            failure = await self._behave("pixabay")
+            if failure is not None:
+                return failure
+            url = self._image_url("pixabay", q)
+            return {"hits": [{"webformatURL": url}] if url else []}
+
+        @app.get("/pexels/search")
+        async def pexels(query: str = "food"):
+            failure = await self._behave("pexels")
+            if failure is not None:
+                return failure
+            url = self._image_url("pexels", query)
+            return {"photos": [{"src": {"large": url}}] if url else []}
+
+        @app.get("/unsplash/search/photos")
+        async def unsplash(query: str = "food"):
+            failure = await self._behave("unsplash")
+            if failure is not None:
+                return failure
+            url = self._image_url("unsplash", query)
+            return {"results": [{"urls": {"regular": url}}] if url else []}
+
+        @app.get("/stats")
+        async def stats():
+            return PlainTextResponse(json.dumps({"requests": self.requests, "errors": self.errors}))
+
+        return app
+
+    async def _sse(self, text: str, usage: Dict[str, int]):
+        for start in range(0, len(text), 200):
+            chunk = {"candidates": [{"content": {"parts": [{"text": text[start:start + 200]}]}}], "usageMetadata": usage}
+            yield f"data: {json.dumps(chunk)}\r\n\r\n"
+            await asyncio.sleep(0.005)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class UpstreamServer:
+    """Runs the stand-ins on a local port in a background thread."""
+
+    def __init__(self, upstreams: FakeUpstreams, port: Optional[int] = None):
+        self.port = port or _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(uvicorn.Config(
+            upstreams.app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off",
+        ))
+        self._thread = threading.Thread(target=self._server.run, name="fake-upstreams", daemon=True)
+
+    def start(self) -> "UpstreamServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake upstream server did not start.")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+    def env(self) -> Dict[str, str]:
+        """Settings that point the app's providers at this server."""
+        return {
+            "GEMINI_BASE_URL": f"{self.base_url}/gemini",
+            "PIXABAY_BASE_URL": f"{self.base_url}/pixabay",
+            "PEXELS_BASE_URL": f"{self.base_url}/pexels",
+            "UNSPLASH_BASE_URL": f"{self.base_url}/unsplash",
+        }
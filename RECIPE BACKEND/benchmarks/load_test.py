@@ -0,0 +1,274 @@
+"""
+Latency, throughput and memory of the recipe endpoints against fake upstreams.
+
+Run from the backend directory:
+
+    python -m benchmarks.load_test [--scenarios recommend,mealplan] [--requests 100] [--concurrency 16]
+    python -m benchmarks.load_test --save-baseline     # record benchmarks/baseline.json
+    python -m benchmarks.load_test --compare           # fail if worse than the baseline
+
+Gemini, Pixabay, Pexels and Unsplash are replaced by the stand-ins in
+benchmarks/fake_upstreams.py, so no quota is spent. Their latency, error
+rate and share of malformed LLM output are set with the flags below. Each
+scenario sends its requests with at most --concurrency in flight and reports
+p50/p95/p99 latency, requests per second, status codes and the process's
+resident memory. --compare exits with status 1 when a scenario's p95 grows,
+or its throughput drops, by more than --tolerance against the baseline.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.fake_upstreams import FakeUpstreams, UpstreamProfile, UpstreamServer
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+PANTRY = [
+    "chicken", "rice", "garlic", "onion", "tomato", "egg", "spinach", "tofu", "beef",
+    "potato", "carrot", "mushroom", "cheese", "pasta", "bell pepper", "soy sauce",
+]
+MEAL_TYPES = ["breakfast", "lunch", "dinner"]
+BENCH_USER = "estanislao"
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _rss_mb() -> float:
+    """Current resident memory of this process, in MiB."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource  # Peak rather than current, but available on macOS too
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _saved_recipe(name: str) -> Dict[str, Any]:
+    return {
+        "recipe_name": name,
+        "description": "Benchmark recipe.",
+        "ingredients": ["1 cup rice", "2 eggs"],
+        "instructions": ["Cook.", "Serve."],
+        "servings": "2 servings",
+        "difficulty": "Easy",
+        "cook_time": "20 minutes",
+        "image_url": "https://images.example/bench.jpg",
+    }
+
+
+# --- Scenarios ---
+# Each one sends a single request for iteration `i`. Inputs repeat every so
+# often, like real traffic, so the caches and recipe index get exercised too.
+Scenario = Callable[[httpx.AsyncClient, int, random.Random], Awaitable[httpx.Response]]
+
+
+async def _recommend(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/recipes/recommend", json={"ingredients": rng.sample(PANTRY, 3), "allergies": []})
+
+
+async def _recipe_details(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/recipes/recipe-details", json={
+        "recipe_name": f"Benchmark Dish {i % 50}", "cook_time": "30 minutes",
+        "difficulty": "Easy", "image_url": "https://images.example/bench.jpg",
+    })
+
+
+async def _generate(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/api/generator/generate", json={"meal_type": rng.choice(MEAL_TYPES), "allergies": ["peanut"]})
+
+
+async def _mealplan(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/api/mealplan/generate-plan", json={"allergies": ["peanut"], "mode": "single"})
+
+
+async def _mealplan_sharded(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/api/mealplan/generate-plan", json={"allergies": ["peanut"], "mode": "sharded"})
+
+
+_save_ids = itertools.count(1)
+
+
+async def _save(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.post("/save/save-recipe", json={"username": BENCH_USER, **_saved_recipe(f"Saved Dish {next(_save_ids)}")})
+
+
+async def _save_bulk(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    recipes = [_saved_recipe(f"Saved Dish {next(_save_ids)}") for _ in range(21)]
+    return await client.post("/save/save-recipes", json={"username": BENCH_USER, "recipes": recipes})
+
+
+async def _saved_list(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    return await client.get(f"/save/saved-recipes/{BENCH_USER}", params={"limit": 50, "view": "summary"})
+
+
+async def _delete_bulk(client: httpx.AsyncClient, i: int, rng: random.Random) -> httpx.Response:
+    # Deletes recipes the save scenarios created, ten at a time, oldest first
+    names = [f"Saved Dish {i * 10 + offset}" for offset in range(1, 11)]
+    return await client.post("/save/delete-recipes", json={"username": BENCH_USER, "recipe_names": names})
+
+
+# name -> (scenario, share of --requests it sends). Meal plans fan out to 21 image lookups, so they send fewer.
+SCENARIOS: Dict[str, tuple] = {
+    "recommend": (_recommend, 1.0),
+    "recipe-details": (_recipe_details, 1.0),
+    "generate": (_generate, 1.0),
+    "mealplan": (_mealplan, 0.2),
+    "mealplan-sharded": (_mealplan_sharded, 0.2),
+    "save": (_save, 1.0),
+    "save-bulk": (_save_bulk, 0.5),
+    "saved-list": (_saved_list, 1.0),
+    "delete-bulk": (_delete_bulk, 0.5),
+}
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def _one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                code = str((await scenario(client, i, rng)).status_code)
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    rss_after = _rss_mb()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput": round(requests / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "statuses": dict(sorted(statuses.items())),
+        "rss_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+    }
+
+
+async def run_suite(app, names: List[str], requests: int, concurrency: int, seed: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for index, name in enumerate(names):
+            scenario, share = SCENARIOS[name]
+            results[name] = await run_scenario(client, scenario, max(1, int(requests * share)), concurrency, seed + index)
+            _print_result(name, results[name])
+    return results
+
+
+def _print_result(name: str, result: Dict[str, Any]) -> None:
+    statuses = " ".join(f"{code}:{count}" for code, count in result["statuses"].items())
+    print(f"{name:17} {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:8.1f}  p95 {result['p95_ms']:8.1f}  "
+          f"p99 {result['p99_ms']:8.1f} ms  rss {result['rss_mb']:6.1f} MiB (+{result['rss_growth_mb']})  [{statuses}]")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Describes every scenario whose p95 or throughput is worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']} -> {result['throughput']} req/s")
+    return regressions
+
+
+def _configure_app(server: UpstreamServer, keep_rate_limits: bool) -> None:
+    """Points the app at the stand-ins. Must run before main is imported, which reads these settings."""
+    os.environ.update(server.env())
+    for key in ("GEMINI_API_KEY", "PIXABAY_API_KEY", "PEXELS_API_KEY", "UNSPLASH_ACCESS_KEY"):
+        os.environ[key] = "benchmark-key"
+    if not keep_rate_limits:
+        # The real quotas would throttle the load test within seconds
+        for provider in ("GEMINI", "PIXABAY", "PEXELS", "UNSPLASH"):
+            os.environ[f"{provider}_RATE_LIMIT"] = "1000000/1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario, before its share")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--gemini-latency", type=float, default=300, help="median Gemini latency in ms")
+    parser.add_argument("--image-latency", type=float, default=80, help="median image-provider latency in ms")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of upstream latencies")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.02, help="share of Gemini calls that fail")
+    parser.add_argument("--image-error-rate", type=float, default=0.02, help="share of image calls that fail")
+    parser.add_argument("--malformed-rate", type=float, default=0.1, help="share of Gemini outputs that are malformed")
+    parser.add_argument("--allergen-rate", type=float, default=0.05, help="share of generated recipes containing peanut")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the app's provider rate limits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline file for --save-baseline/--compare")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="exit 1 if results regress against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression for --compare")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    upstreams = FakeUpstreams(
+        gemini=UpstreamProfile(args.gemini_latency, args.latency_sigma, args.gemini_error_rate),
+        images=UpstreamProfile(args.image_latency, args.latency_sigma, args.image_error_rate),
+        malformed_rate=args.malformed_rate,
+        allergen_rate=args.allergen_rate,
+        seed=args.seed,
+    )
+    server = UpstreamServer(upstreams).start()
+    _configure_app(server, args.keep_rate_limits)
+
+    from main import app
+    from services import passwords
+
+    print(f"fake upstreams on {server.base_url}: gemini ~{args.gemini_latency:.0f} ms, images ~{args.image_latency:.0f} ms, "
+          f"{args.malformed_rate:.0%} malformed; {args.concurrency} in flight")
+    try:
+        results = asyncio.run(run_suite(app, names, args.requests, args.concurrency, args.seed))
+    finally:
+        passwords.shutdown()
+        server.stop()
+    print(f"upstream calls: {upstreams.requests}, injected failures: {upstreams.errors}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"baseline written to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Login throughput and event-loop responsiveness under a login storm.
+
+Run from the backend directory:
+
+    python -m benchmarks.password_hashing [--logins 64] [--concurrency 32]
+
+Reports raw scrypt hashes per second on one core, end-to-end /auth/token
+logins per second (and per hashing worker), and the latency of a cheap
+endpoint served while the storm is running. Cost parameters and pool size
+come from the same PASSWORD_* settings the app uses.
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+from main import app
+from services import passwords
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_single_core(rounds: int) -> float:
+    stored_hash = passwords.hash_password_sync("benchmark-password")
+    started = time.perf_counter()
+    for _ in range(rounds):
+        passwords.verify_password_sync("benchmark-password", stored_hash)
+    return rounds / (time.perf_counter() - started)
+
+
+async def bench_login_storm(logins: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        storm_done = asyncio.Event()
+        probe_latencies = []
+
+        async def _login():
+            async with semaphore:
+                response = await client.post("/auth/token", data={"username": "estanislao", "password": "Rnjl@1027"})
+                response.raise_for_status()
+
+        async def _probe():
+            # A cheap endpoint standing in for the recipe routes during the storm
+            while not storm_done.is_set():
+                started = time.perf_counter()
+                await client.get("/")
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(_probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(_login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        storm_done.set()
+        await probe_task
+    return logins / elapsed, probe_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="single-core verifications")
+    parser.add_argument("--logins", type=int, default=64, help="logins in the storm")
+    parser.add_argument("--concurrency", type=int, default=32, help="logins in flight at once")
+    args = parser.parse_args()
+
+    print(f"scrypt n={passwords.PASSWORD_SCRYPT_N} r={passwords.PASSWORD_SCRYPT_R} p={passwords.PASSWORD_SCRYPT_P}, "
+          f"{passwords.PASSWORD_HASH_WORKERS} hashing workers, {os.cpu_count()} CPUs")
+
+    per_core = bench_single_core(args.rounds)
+    print(f"single core:   {per_core:8.1f} verifications/s")
+
+    throughput, latencies = asyncio.run(bench_login_storm(args.logins, args.concurrency))
+    cores = min(passwords.PASSWORD_HASH_WORKERS, os.cpu_count() or 1)
+    print(f"login storm:   {throughput:8.1f} logins/s ({throughput / cores:.1f} per core)")
+    if latencies:
+        print(f"GET / during storm: median {statistics.median(latencies) * 1000:.1f} ms, "
+              f"p99 {_percentile(latencies, 0.99) * 1000:.1f} ms over {len(latencies)} requests")
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
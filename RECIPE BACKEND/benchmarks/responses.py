@@ -0,0 +1,116 @@
+"""
+Bytes on the wire and CPU per request for the largest responses.
+
+Run from the backend directory:
+
+    python -m benchmarks.responses [--saved 100] [--rounds 200]
+
+Two bodies are measured: a 21-meal plan as /api/mealplan/generate-plan
+returns it, and a user's saved-recipes list with --saved full recipes.
+For each body it reports the CPU time to encode it three ways:
+- FastAPI's default path: jsonable_encoder, then the standard json module
+- orjson
+- a cached pre-encoded body
+It also reports body size and compression time for gzip, and for brotli
+when installed. A last pass times whole saved-list requests through the
+app, with and without compression.
+"""
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.fake_upstreams import DAYS, MEAL_TYPES, FakeUpstreams, UpstreamProfile
+from routers.mealplan import _format_meal
+from services import compression, serialization
+from services.saved_recipes import SavedRecipe
+
+
+def _meal_plan() -> list:
+    upstreams = FakeUpstreams(UpstreamProfile(0), UpstreamProfile(0))
+    return [_format_meal(meal, f"https://images.example/{index}.jpg")
+            for index, meal in enumerate(upstreams._meals(DAYS, MEAL_TYPES))]
+
+
+def _saved_list(count: int) -> dict:
+    rng = random.Random(0)
+    upstreams = FakeUpstreams(UpstreamProfile(0), UpstreamProfile(0))
+    recipes = [
+        SavedRecipe(
+            f"Saved Dish {index}", "A comforting home-style dish with a crisp finish.", upstreams._ingredients(),
+            ["Prep the ingredients.", "Cook everything together.", "Serve warm."],
+            "4 servings", rng.choice(["Easy", "Medium", "Hard"]), "30 minutes", f"https://images.example/{index}.jpg",
+        )
+        for index in range(count)
+    ]
+    return {"recipes": [recipe.to_dict("estanislao") for recipe in recipes], "next_cursor": None}
+
+
+def _per_call(fn, rounds: int) -> float:
+    """CPU microseconds per call."""
+    started = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return (time.process_time() - started) / rounds * 1e6
+
+
+def bench_body(label: str, content, rounds: int) -> None:
+    encoded = serialization.dumps(content)
+    cache = {"body": encoded}
+    print(f"{label}:")
+    print(f"  encode  jsonable_encoder+json {_per_call(lambda: JSONResponse(jsonable_encoder(content)).body, rounds):9.1f} us")
+    print(f"          orjson                {_per_call(lambda: serialization.dumps(content), rounds):9.1f} us")
+    print(f"          cached body           {_per_call(lambda: cache['body'], rounds):9.1f} us")
+    print(f"  bytes   identity {len(encoded):9d}")
+    for encoding in ("gzip", "br") if compression.BROTLI_AVAILABLE else ("gzip",):
+        compressed = compression.compress(encoded, encoding)
+        cost = _per_call(lambda: compression.compress(encoded, encoding), rounds)
+        print(f"          {encoding:8s} {len(compressed):9d} ({len(compressed) / len(encoded):5.1%}), {cost:.1f} us to compress")
+
+
+async def bench_saved_list(count: int, rounds: int) -> None:
+    from main import app
+    from routers.Save import saved_recipe_pages
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        body = _saved_list(count)["recipes"]
+        await client.post("/save/save-recipes", json={
+            "username": "estanislao", "recipes": [{k: v for k, v in recipe.items() if k != "username"} for recipe in body],
+        })
+        for label, headers, cached in (
+            ("uncompressed, encoded per request", {"accept-encoding": "identity"}, False),
+            ("uncompressed, cached body", {"accept-encoding": "identity"}, True),
+            ("gzip, cached body", {"accept-encoding": "gzip"}, True),
+        ):
+            sizes = set()
+            started = time.process_time()
+            for _ in range(rounds):
+                if not cached:
+                    saved_recipe_pages.clear()
+                response = await client.get("/save/saved-recipes/estanislao", headers=headers)
+                sizes.add(int(response.headers["content-length"]))
+            cost = (time.process_time() - started) / rounds * 1e3
+            print(f"  {label:36s} {cost:6.2f} ms CPU/request, {max(sizes)} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--saved", type=int, default=100, help="recipes in the saved list")
+    parser.add_argument("--rounds", type=int, default=200, help="repetitions per measurement")
+    args = parser.parse_args()
+
+    print(f"brotli {'available' if compression.BROTLI_AVAILABLE else 'not installed'}, "
+          f"gzip level {compression.COMPRESSION_GZIP_LEVEL}, brotli quality {compression.COMPRESSION_BROTLI_QUALITY}")
+    bench_body("21-meal plan", _meal_plan(), args.rounds)
+    bench_body(f"saved list ({args.saved} recipes)", _saved_list(args.saved), args.rounds)
+    print(f"GET /save/saved-recipes/{{username}} with {args.saved} recipes:")
+    asyncio.run(bench_saved_list(args.saved, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,95 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 import os
 import uvicorn
 from pathlib import Path  
+from contextlib import asynccontextmanager
 
 
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# --- Server Settings (overridable from the .env file) ---
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", 8000))
+# Worker processes. With more than one, the server runs without auto-reload
+# and state every worker must agree on lives in SQLite files under STATE_DIR,
+# unless the store's own *_PATH setting points elsewhere. Under gunicorn, set
+# WORKERS to the same count as -w:
+#   WORKERS=4 gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4
+WORKERS = int(os.getenv("WORKERS", 1))
+STATE_DIR = os.getenv("STATE_DIR", "state")
+
+# Store settings defaulted in multi-worker mode, and their files under STATE_DIR.
+# The recipe index (RECIPE_INDEX_PATH) and the prefetched image keywords
+# (IMAGE_PREFETCH_PATH) are not shared: each worker builds its own in memory
+# from the same snapshot, and the snapshot holds whatever the last worker to
+# shut down had. Both only speed up answers, so a worker missing another's
+# entries still answers correctly.
+SHARED_STATE_FILES = {
+    "USERS_PATH": "users.db",
+    "SAVED_RECIPES_PATH": "saved_recipes.db",
+    "RESPONSE_CACHE_PATH": "cache.db",
+    "IMAGE_CACHE_PATH": "cache.db",
+    "JOB_STORE_PATH": "jobs.db",
+}
+
+if WORKERS > 1:
+    # Set before the routers import their stores; worker processes inherit the environment
+    os.makedirs(STATE_DIR, exist_ok=True)
+    for setting, filename in SHARED_STATE_FILES.items():
+        if not os.getenv(setting):
+            os.environ[setting] = str(Path(STATE_DIR) / filename)
+
 
 from routers.Recipe import router as recipe_router
 from routers.auth import router as auth_router
-from routers.Save import router as save_router
+from routers.Save import router as save_router, saved_recipe_pages
 from routers.generator import router as generator_router
-from routers.mealplan import router as mealplan_router
+from routers.mealplan import router as mealplan_router, meal_plan_jobs
+from services import http_client, passwords, image_prefetch
+from services.images import image_cache
+from services.response_cache import recommend_cache, details_cache
+from services import ratelimit, breaker, metrics, serialization
+from services.compression import CompressionMiddleware
+from services import recipe_index, catalogue
+from services.users import verified_tokens
 
-HOST = os.getenv("HOST", "127.0.0.1")
-PORT = int(os.getenv("PORT", 8000))
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the shared outbound HTTP client, loads the local recipe index, maps
+    the recipe catalogue and starts image prefetching (warming the image
+    cache) on startup; stops the meal plan workers and prefetching, closes
+    the client's pooled connections, saves the snapshots, unmaps the
+    catalogue and stops the password hashing pool on shutdown.
+    """
+    await http_client.startup()
+    recipe_index.load_snapshot()
+    catalogue.startup()
+    image_prefetch.startup()
+    yield
+    await meal_plan_jobs.shutdown()
+    await image_prefetch.shutdown()
+    await http_client.shutdown()
+    recipe_index.save_snapshot()
+    catalogue.shutdown()
+    passwords.shutdown()
+
+class TimedORJSONResponse(ORJSONResponse):
+    """The default JSON response: encoded by orjson, timed as the "serialize" stage."""
+
+    def render(self, content) -> bytes:
+        return serialization.dumps(content)
 
 app = FastAPI(
     title="Recipe App API",
     description="API for managing recipes, users, and authentication.",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=TimedORJSONResponse,
 )
 
 # Configure CORS policy
@@ -41,6 +108,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Caches reported by /health/caches and /metrics
+CACHES = {
+    "images": image_cache,
+    "recommend": recommend_cache,
+    "recipe_details": details_cache,
+    "verified_tokens": verified_tokens,
+    "saved_recipe_pages": saved_recipe_pages,
+}
+
+def _upstream_samples():
+    """Breaker state and rate budget per provider, read when /metrics is scraped."""
+    yield "upstream_circuit_open", "gauge", "1 while the provider's circuit breaker is open or half-open.", [
+        ({"upstream": name}, int(status["state"] != breaker.CLOSED)) for name, status in breaker.status().items()]
+    yield "upstream_rate_limit_available", "gauge", "Calls left in the provider's rate budget.", [
+        ({"upstream": name}, usage["available"]) for name, usage in ratelimit.usage().items()]
+
+def _job_samples():
+    """Meal plan job queue depth and outcomes, read when /metrics is scraped."""
+    stats = meal_plan_jobs.stats()
+    yield "meal_plan_jobs_queued", "gauge", "Meal plan jobs waiting for a worker.", [({}, stats["queued"])]
+    yield "meal_plan_jobs_running", "gauge", "Meal plan jobs being generated.", [({}, stats["running"])]
+    yield "meal_plan_jobs_total", "counter", "Meal plan submissions by outcome; deduplicated ones attached to an existing job.", [
+        ({"outcome": outcome}, stats[outcome]) for outcome in ("submitted", "deduplicated", "succeeded", "failed", "rejected")]
+
+metrics.registry.register_collector(metrics.cache_collector(CACHES))
+metrics.registry.register_collector(_upstream_samples)
+metrics.registry.register_collector(_job_samples)
 
 @app.get("/", tags=["Root"])
 async def root():
@@ -62,6 +159,31 @@ async def check_env_vars():
         "mail_username_set": bool(os.getenv("MAIL_USERNAME")),
     }
 
+@app.get("/health/caches", tags=["Health Check"])
+async def cache_stats():
+    """
+    Hit/miss statistics for the in-process caches.
+    """
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+    stats["recipe_index"] = recipe_index.recipe_index.stats()
+    stats["recipe_catalogue"] = catalogue.stats()
+    stats["image_prefetch"] = image_prefetch.stats()
+    return stats
+
+@app.get("/health/upstreams", tags=["Health Check"])
+async def upstream_budgets():
+    """
+    Rate-limit budget usage and circuit-breaker state for each external provider.
+    """
+    return {"rate_limits": ratelimit.usage(), "circuit_breakers": breaker.status()}
+
+@app.get("/metrics", tags=["Health Check"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Request, upstream, cache and image-fallback metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
 app.include_router(recipe_router, prefix="/recipes", tags=["Recipes"])
 app.include_router(save_router, prefix="/save", tags=["Save"])
@@ -70,4 +192,5 @@ app.include_router(mealplan_router, prefix="/api/mealplan", tags=["Meal Plan Gen
 
 if __name__ == "__main__":
   
-    uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
\ No newline at end of file
+    # Auto-reload is for development and only works with a single process
+    uvicorn.run("main:app", host=HOST, port=PORT, reload=WORKERS == 1, workers=WORKERS)
\ No newline at end of file
@@ -1,11 +1,19 @@
-import re
 from fastapi import APIRouter, HTTPException
 from dotenv import load_dotenv
 import os
-import requests
-import json
+import math
+import httpx
 from pydantic import BaseModel
 from typing import List
+from services import gemini
+from services.errors import UpstreamUnavailable
+from services.images import resolve_images
+from services.cache import MISSING
+from services.parsing import extract_json_object, parse_key_value_records
+from services.response_cache import recommend_cache, recommend_key, details_cache, details_key
+from services.recipe_index import recipe_index
+from services import catalogue
+from services.allergens import get_matcher
 
 # --- Pydantic model for the incoming request body ---
 class RecommendRequest(BaseModel):
@@ -22,8 +30,14 @@ load_dotenv()
 
 router = APIRouter()
 
-# Default image URL if no images
-DEFAULT_IMAGE_URL = "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=800&q=80"
+# Labels in the recommend prompt's "Key: Value" format, mapped to result fields
+RECIPE_RECORD_FIELDS = {
+    "recipe#": "recipe_number",
+    "recipe name": "recipe_name",
+    "time to cook": "cook_time",
+    "difficulty": "difficulty",
+    "image keyword": "image_keyword",
+}
 
 # -------------------- RECOMMEND RECIPES --------------------
 @router.post("/recommend")
@@ -36,7 +50,28 @@ async def recommend_recipe(request: RecommendRequest):
     if not all([gemini_api_key, pixabay_api_key, pexels_api_key, unsplash_access_key]):
         raise HTTPException(status_code=400, detail="API keys are not set properly in the .env file")
 
-    gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={gemini_api_key}"
+    # Identical ingredient sets (ignoring order, casing and plurals) reuse an earlier answer
+    cache_key = recommend_key(request.ingredients, request.allergies)
+    cached_results = recommend_cache.get(cache_key)
+    if cached_results is not MISSING:
+        return {"results": cached_results}
+
+    # Common pantry combinations are answered from recipes the service already knows,
+    # first those seen since startup, then the prebuilt catalogue
+    indexed_recipes = recipe_index.recommend(request.ingredients, request.allergies)
+    if indexed_recipes is None:
+        indexed_recipes = catalogue.recommend(request.ingredients, request.allergies)
+    if indexed_recipes is not None:
+        return {"results": [
+            {
+                "recipe_number": str(number),
+                "recipe_name": recipe.name,
+                "cook_time": recipe.cook_time,
+                "difficulty": recipe.difficulty,
+                "image_url": recipe.image_url
+            }
+            for number, recipe in enumerate(indexed_recipes, start=1)
+        ]}
 
     ingredient_list = ", ".join(request.ingredients)
     
@@ -59,87 +94,38 @@ async def recommend_recipe(request: RecommendRequest):
         f"Do not include anything in Recipe Name Just the Recipe Name."
     )
 
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
-    headers = {"Content-Type": "application/json"}
-
     try:
-        gemini_response = requests.post(gemini_url, headers=headers, json=data)
-        gemini_response.raise_for_status()
-        gemini_result = gemini_response.json()
-
-        recipe_text = (
-            gemini_result.get("candidates", [{}])[0]
-            .get("content", {})
-            .get("parts", [{}])[0]
-            .get("text", "")
-        )
+        recipe_text = await gemini.generate_content(gemini_api_key, prompt, timeout=60)
         
-        recipes = recipe_text.strip().split("\n\n")
-        results = []
+        # Fields are matched by their label, so reordered or decorated lines still parse
+        parsed_recipes = parse_key_value_records(recipe_text, RECIPE_RECORD_FIELDS, required=["recipe_name"]).items
+
+        # Only names are generated here, so drop any whose name gives away a requested allergen
+        allergen_matcher = get_matcher(request.allergies)
+        unsafe = set(allergen_matcher.unsafe_indexes([[recipe["recipe_name"]] for recipe in parsed_recipes]))
+        parsed_recipes = [recipe for index, recipe in enumerate(parsed_recipes) if index not in unsafe]
+
+        # Look up every recipe's image at the same time instead of one by one
+        image_urls = await resolve_images([recipe.get("image_keyword") or recipe["recipe_name"] for recipe in parsed_recipes])
 
-        for recipe in recipes:
-            recipe_lines = recipe.strip().split("\n")
-            if len(recipe_lines) >= 5:
-                recipe_number = recipe_lines[0].replace("Recipe# ", "").strip()
-                recipe_name = recipe_lines[1].replace("Recipe Name: ", "").strip()
-                cook_time = recipe_lines[2].replace("Time to Cook: ", "").strip()
-                difficulty = recipe_lines[3].replace("Difficulty: ", "").strip()
-                image_keyword = recipe_lines[4].replace("Image Keyword: ", "").strip()
-
-                image_url = DEFAULT_IMAGE_URL
-
-
-                # --- Pixabay Search (Primary Choice) ---
-                pixabay_url = "https://pixabay.com/api/"
-                pixabay_params = {
-                    "key": pixabay_api_key,
-                    "q": image_keyword,
-                    "image_type": "photo",
-                    "safesearch": "true",
-                    "order": "popular",
-                    "per_page": 1
-                }
-                pixabay_response = requests.get(pixabay_url, params=pixabay_params)
-                if pixabay_response.status_code == 200:
-                    pixabay_data = pixabay_response.json()
-                    hits = pixabay_data.get("hits", [])
-                    if hits:
-                        image_url = hits[0].get("webformatURL", DEFAULT_IMAGE_URL)
-
-                # --- Pexels Search (Fallback) ---
-                if image_url == DEFAULT_IMAGE_URL:
-                    pexels_url = "https://api.pexels.com/v1/search"
-                    pexels_headers = {"Authorization": pexels_api_key}
-                    pexels_params = {"query": image_keyword, "per_page": 1}
-                    pexels_response = requests.get(pexels_url, headers=pexels_headers, params=pexels_params)
-                    if pexels_response.status_code == 200:
-                        pexels_data = pexels_response.json()
-                        photos = pexels_data.get("photos", [])
-                        if photos:
-                            image_url = photos[0].get("src", {}).get("medium", DEFAULT_IMAGE_URL)
-
-                # --- Unsplash Search (Final Fallback) ---
-                if image_url == DEFAULT_IMAGE_URL:
-                    unsplash_url = "https://api.unsplash.com/search/photos"
-                    unsplash_params = { "query": image_keyword, "per_page": 1 }
-                    unsplash_headers = { "Authorization": f"Client-ID {unsplash_access_key}" }
-                    unsplash_response = requests.get(unsplash_url, headers=unsplash_headers, params=unsplash_params)
-                    if unsplash_response.status_code == 200:
-                        results_unsplash = unsplash_response.json().get("results", [])
-                        if results_unsplash:
-                            image_url = results_unsplash[0].get("urls", {}).get("regular", DEFAULT_IMAGE_URL)
-
-                results.append({
-                    "recipe_number": recipe_number,
-                    "recipe_name": recipe_name,
-                    "cook_time": cook_time,
-                    "difficulty": difficulty,
-                    "image_url": image_url
-                })
+        results = []
+        for recipe, image_url in zip(parsed_recipes, image_urls):
+            results.append({
+                "recipe_number": recipe.get("recipe_number", str(len(results) + 1)),
+                "recipe_name": recipe["recipe_name"],
+                "cook_time": recipe.get("cook_time", ""),
+                "difficulty": recipe.get("difficulty", ""),
+                "image_url": image_url
+            })
+
+        if results:
+            recommend_cache.set(cache_key, results)
         
         return {"results": results}
 
-    except requests.RequestException as e:
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Request Error: {e}")
 
     except Exception as general_error:
@@ -147,7 +133,6 @@ async def recommend_recipe(request: RecommendRequest):
 
 
 # -------------------- GET DETAILED RECIPE INFO --------------------
-# This endpoint remains unchanged.
 @router.post("/recipe-details")
 async def get_recipe_details(details: RecipeDetailsRequest):
     gemini_api_key = os.getenv("GEMINI_API_KEY")
@@ -155,7 +140,14 @@ async def get_recipe_details(details: RecipeDetailsRequest):
     if not gemini_api_key:
         raise HTTPException(status_code=400, detail="Gemini API key is not set properly in the .env file")
 
-    gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={gemini_api_key}"
+    # Details only depend on the recipe name, so every user opening the same recipe shares one answer
+    cache_key = details_key(details.recipe_name)
+    cached_details = details_cache.get(cache_key)
+    if cached_details is not MISSING:
+        return {**details.dict(), **cached_details}
+    catalogue_details = catalogue.details(details.recipe_name)
+    if catalogue_details is not None:
+        return {**details.dict(), **catalogue_details}
 
     prompt = (
         f"Provide detailed information for the recipe '{details.recipe_name}'. Respond strictly in the following JSON format:\n\n"
@@ -167,31 +159,30 @@ async def get_recipe_details(details: RecipeDetailsRequest):
         "}\n"
     )
 
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
-    headers = {"Content-Type": "application/json"}
-
     try:
-        gemini_response = requests.post(gemini_url, headers=headers, json=data)
-        gemini_response.raise_for_status()
-        gemini_result = gemini_response.json()
-
-        recipe_details_text = gemini_result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-        json_match = re.search(r"\{.*\}", recipe_details_text, re.DOTALL)
+        recipe_details_text = await gemini.generate_content(gemini_api_key, prompt, timeout=60)
+        details_json = extract_json_object(recipe_details_text)
 
-        if not json_match:
+        if details_json is None:
             raise HTTPException(status_code=500, detail="Failed to locate JSON in Gemini response.")
 
-        details_json = json.loads(json_match.group())
-
-        return {
-            **details.dict(),
+        generated_details = {
             "description": details_json.get("description", "No description available."),
             "ingredients": details_json.get("ingredients", ["No ingredients listed."]),
             "instructions": details_json.get("instructions", ["No instructions provided."]),
             "servings": details_json.get("servings", "No servings information provided.")
         }
+        details_cache.set(cache_key, generated_details)
+        recipe_index.add(details.recipe_name, generated_details["ingredients"], details.cook_time, details.difficulty, details.image_url)
+
+        return {
+            **details.dict(),
+            **generated_details
+        }
 
-    except requests.RequestException as e:
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Request Error: {e}")
 
     except Exception as general_error:
@@ -1,6 +1,13 @@
-from fastapi import APIRouter, HTTPException, status
-from pydantic import BaseModel
-from typing import List
+import os
+import base64
+import hashlib
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+from services import serialization
+from services.cache import MISSING, TTLCache
+from services.recipe_index import recipe_index
+from services.saved_recipes import SavedRecipe, saved_recipe_store
 
 router = APIRouter()
 
@@ -17,22 +24,88 @@ class SaveRecipeRequest(BaseModel):
     cook_time: str
     image_url: str
 
-# --- In-Memory "Database" ---
-# This dictionary will store saved recipes.
-# The key is the lowercase username, and the value is a list of their saved recipes.
-IN_MEMORY_SAVED_RECIPES = {
-    "estanislao": [] 
-}
+# Largest batch accepted by the bulk endpoints; a full weekly meal plan is 21 recipes.
+SAVE_BATCH_MAX_SIZE = 100
+
+class SavedRecipeItem(BaseModel):
+    """One recipe in a bulk save; the username is given once for the whole batch."""
+    recipe_name: str
+    description: str
+    ingredients: List[str]
+    instructions: List[str]
+    servings: str
+    difficulty: str
+    cook_time: str
+    image_url: str
+
+class BulkSaveRecipesRequest(BaseModel):
+    username: str
+    recipes: List[SavedRecipeItem] = Field(..., min_length=1, max_length=SAVE_BATCH_MAX_SIZE)
+
+class BulkDeleteRecipesRequest(BaseModel):
+    username: str
+    recipe_names: List[str] = Field(..., min_length=1, max_length=SAVE_BATCH_MAX_SIZE)
+
+def _to_saved_recipe(item: Union[SaveRecipeRequest, SavedRecipeItem]) -> SavedRecipe:
+    return SavedRecipe(
+        recipe_name=item.recipe_name,
+        description=item.description,
+        ingredients=item.ingredients,
+        instructions=item.instructions,
+        servings=item.servings,
+        difficulty=item.difficulty,
+        cook_time=item.cook_time,
+        image_url=item.image_url,
+    )
+
+# --- Saved Recipe Store ---
+# Recipes are kept per lowercase username in services.saved_recipes, in memory
+# or in SQLite when SAVED_RECIPES_PATH is set.
 
 # --- Hardcoded User Check ---
 # For simplicity, we only allow the known hardcoded user to save recipes.
 VALID_USERS = ["estanislao"]
 
+# --- Pagination and Conditional Requests ---
+# Largest page a client may ask for with ?limit=.
+SAVED_RECIPES_MAX_PAGE_SIZE = 100
+
+# Encoded list pages, keyed by their ETag. The ETag changes whenever the
+# user's recipes do, so a cached page is never stale and needs no invalidation.
+SAVED_RECIPES_PAGE_CACHE_SIZE = int(os.getenv("SAVED_RECIPES_PAGE_CACHE_SIZE", 256))
+SAVED_RECIPES_PAGE_CACHE_TTL = float(os.getenv("SAVED_RECIPES_PAGE_CACHE_TTL", 300))
+saved_recipe_pages = TTLCache("saved_recipe_pages", SAVED_RECIPES_PAGE_CACHE_SIZE, SAVED_RECIPES_PAGE_CACHE_TTL)
+
+def _encode_cursor(recipe_id: int) -> str:
+    return base64.urlsafe_b64encode(str(recipe_id).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def _saved_recipes_etag(user_key: str, *representation) -> str:
+    """
+    Weak ETag for one page of a user's list. It only depends on the user's
+    version counter and the query, so it is computed without reading a recipe.
+    """
+    version = f"{saved_recipe_store.generation}:{saved_recipe_store.version(user_key)}"
+    digest = hashlib.sha1(repr((user_key, version, representation)).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as required for If-None-Match."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in (candidate.removeprefix("W/") for candidate in candidates)
+
 # --- API Endpoints ---
 
 @router.post("/save-recipe", status_code=status.HTTP_201_CREATED)
 async def save_recipe(request: SaveRecipeRequest):
-    """Saves a recipe to the in-memory dictionary for the user."""
+    """Saves a recipe to the user's saved recipe store."""
     
     user_key = request.username.lower()
 
@@ -40,26 +113,53 @@ async def save_recipe(request: SaveRecipeRequest):
     if user_key not in VALID_USERS:
         raise HTTPException(status_code=404, detail=f"User '{request.username}' not found or is not allowed to save recipes.")
 
-    # 2. Ensure the user has an entry in our in-memory DB
-    if user_key not in IN_MEMORY_SAVED_RECIPES:
-        IN_MEMORY_SAVED_RECIPES[user_key] = []
-
-    # 3. Check if the recipe is already saved to prevent duplicates
-    saved_recipes = IN_MEMORY_SAVED_RECIPES[user_key]
-    if any(recipe.recipe_name.lower() == request.recipe_name.lower() for recipe in saved_recipes):
-        # --- THIS IS THE CORRECTED LINE ---
+    # 2. Save the new recipe; the store rejects duplicates atomically, so concurrent saves can't both succeed
+    if not saved_recipe_store.add(user_key, _to_saved_recipe(request)):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Recipe '{request.recipe_name}' is already in your favorites.")
-
-    # 4. Save the new recipe
-    # We store the request model directly. No need for json.dumps.
-    IN_MEMORY_SAVED_RECIPES[user_key].append(request)
+    recipe_index.add(request.recipe_name, request.ingredients, request.cook_time, request.difficulty, request.image_url)
 
     return {"message": f"Recipe '{request.recipe_name}' saved successfully!"}
 
 
+@router.post("/save-recipes")
+async def save_recipes(request: BulkSaveRecipesRequest):
+    """
+    Saves many recipes (e.g. a whole meal plan) in one request. The batch is
+    applied atomically and each recipe gets its own result: "created", or
+    "conflict" if it was already saved or repeats an earlier recipe in the batch.
+    """
+
+    user_key = request.username.lower()
+
+    # 1. Check if the user is valid, once for the whole batch
+    if user_key not in VALID_USERS:
+        raise HTTPException(status_code=404, detail=f"User '{request.username}' not found or is not allowed to save recipes.")
+
+    # 2. Save every recipe in one step of the store
+    added = saved_recipe_store.add_many(user_key, [_to_saved_recipe(item) for item in request.recipes])
+    for item, created in zip(request.recipes, added):
+        if created:
+            recipe_index.add(item.recipe_name, item.ingredients, item.cook_time, item.difficulty, item.image_url)
+
+    results = [
+        {"recipe_name": item.recipe_name, "status": "created" if created else "conflict"}
+        for item, created in zip(request.recipes, added)
+    ]
+    return {"results": results, "created": sum(added), "conflicts": len(added) - sum(added)}
+
+
 @router.get("/saved-recipes/{username}")
-async def get_saved_recipes(username: str):
-    """Retrieves all saved recipes for a given user from the in-memory dictionary."""
+async def get_saved_recipes(
+    username: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=SAVED_RECIPES_MAX_PAGE_SIZE, description="Page size. Omit to get every recipe."),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page."),
+    view: Literal["full", "summary"] = Query("full", description="'summary' returns only name, image, cook time and difficulty."),
+):
+    """
+    Retrieves a user's saved recipes, oldest first. Supports cursor pagination,
+    a lightweight summary view, and If-None-Match: an unchanged list returns 304.
+    """
     
     user_key = username.lower()
 
@@ -67,11 +167,47 @@ async def get_saved_recipes(username: str):
     if user_key not in VALID_USERS:
         raise HTTPException(status_code=404, detail=f"User '{username}' not found.")
 
-    # 2. Return the user's saved recipes, or an empty list if none exist
-    recipes = IN_MEMORY_SAVED_RECIPES.get(user_key, [])
-    
-    # We can return the list of Pydantic models directly, FastAPI handles serialization.
-    return {"recipes": recipes}
+    # 2. Unchanged since the client's copy? Answer without reading or serializing any recipe
+    etag = _saved_recipes_etag(user_key, view, cursor, limit)
+    # The weak ETag is shared by the gzip and identity bodies, so caches must key on Accept-Encoding too
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # 3. Served this exact page before? Send the body encoded then
+    body = saved_recipe_pages.get(etag)
+    if body is MISSING:
+        # 4. Return the requested page of the user's saved recipes, or an empty list if none exist.
+        # One extra recipe is read to know whether there is a next page.
+        after_id = _decode_cursor(cursor) if cursor else 0
+        recipes = saved_recipe_store.page(user_key, after_id, None if limit is None else limit + 1)
+        next_cursor = None
+        if limit is not None and len(recipes) > limit:
+            recipes = recipes[:limit]
+            next_cursor = _encode_cursor(recipes[-1].id)
+
+        if view == "summary":
+            recipe_bodies = [recipe.to_summary() for recipe in recipes]
+        else:
+            recipe_bodies = [recipe.to_dict(user_key) for recipe in recipes]
+        body = serialization.dumps({"recipes": recipe_bodies, "next_cursor": next_cursor})
+        saved_recipe_pages.set(etag, body)
+    return Response(body, media_type=serialization.JSON_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/saved-recipes/{username}/{recipe_name}")
+async def get_saved_recipe(username: str, recipe_name: str):
+    """Retrieves one saved recipe in full, e.g. after listing the summary view."""
+
+    user_key = username.lower()
+
+    if user_key not in VALID_USERS:
+        raise HTTPException(status_code=404, detail=f"User '{username}' not found.")
+
+    recipe = saved_recipe_store.get(user_key, recipe_name)
+    if recipe is None:
+        raise HTTPException(status_code=404, detail=f"Recipe '{recipe_name}' not found in your favorites.")
+    return recipe.to_dict(user_key)
 
 
 @router.delete("/delete-recipe/{username}/{recipe_name}", status_code=status.HTTP_200_OK)
@@ -84,21 +220,31 @@ async def delete_saved_recipe(username: str, recipe_name: str):
     if user_key not in VALID_USERS:
         raise HTTPException(status_code=404, detail=f"User '{username}' not found.")
 
-    # 2. Check if the user has any saved recipes
-    if user_key not in IN_MEMORY_SAVED_RECIPES:
-        raise HTTPException(status_code=404, detail="User has no saved recipes.")
-
-    # 3. Find the recipe to delete
-    recipes = IN_MEMORY_SAVED_RECIPES[user_key]
-    recipe_to_delete = None
-    for recipe in recipes:
-        if recipe.recipe_name.lower() == recipe_name.lower():
-            recipe_to_delete = recipe
-            break
-    
-    # 4. If found, remove it. Otherwise, raise an error.
-    if recipe_to_delete:
-        recipes.remove(recipe_to_delete)
+    # 2. Remove the recipe by its normalized name. Otherwise, raise an error.
+    if saved_recipe_store.remove(user_key, recipe_name):
         return {"message": f"Recipe '{recipe_name}' was removed from your favorites."}
     else:
-        raise HTTPException(status_code=404, detail=f"Recipe '{recipe_name}' not found in your favorites.")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=f"Recipe '{recipe_name}' not found in your favorites.")
+
+
+@router.post("/delete-recipes")
+async def delete_saved_recipes(request: BulkDeleteRecipesRequest):
+    """
+    Deletes many saved recipes in one request, atomically. Each name gets
+    its own result: "deleted" or "not_found".
+    """
+
+    user_key = request.username.lower()
+
+    # 1. Check if the user is valid, once for the whole batch
+    if user_key not in VALID_USERS:
+        raise HTTPException(status_code=404, detail=f"User '{request.username}' not found.")
+
+    # 2. Remove every named recipe in one step of the store
+    removed = saved_recipe_store.remove_many(user_key, request.recipe_names)
+
+    results = [
+        {"recipe_name": recipe_name, "status": "deleted" if deleted else "not_found"}
+        for recipe_name, deleted in zip(request.recipe_names, removed)
+    ]
+    return {"results": results, "deleted": sum(removed), "not_found": len(removed) - sum(removed)}
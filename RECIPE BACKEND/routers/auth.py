@@ -1,4 +1,6 @@
 import os
+import time
+import hashlib
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
 
@@ -7,6 +9,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr, Field
+from services.cache import MISSING
+from services.users import UserConflict, build_user_directory, verified_tokens
+from services import passwords
 
 load_dotenv()
 
@@ -29,6 +34,7 @@ class User(BaseModel):
     email: EmailStr
 
 class UserInDB(User):
+    # scrypt hash from services.passwords, never the plaintext password
     password: str
 
 class UserCreate(BaseModel):
@@ -55,17 +61,19 @@ class PasswordResetConfirm(BaseModel):
     token: str
     new_password: str = Field(..., min_length=8)
 
-HARDCODED_USER_DB = {
-    "estanislao": UserInDB(
+# Hardcoded users, indexed by username and by email; kept in USERS_PATH when set
+user_directory = build_user_directory(UserInDB, [
+    UserInDB(
         username="Estanislao",
         full_name="Estanislao RNJL",
         email="estanislao@example.com",
-        password="Rnjl@1027"
+        password="scrypt$16384$8$1$jKUcqwUCFqTuKoEwwRGY6g$xPDv44aOTs2ZjIuvvo75fOwgmmEm/3+dAbTKrcujDNM"
     )
-}
+])
 
-def verify_password(plain_password: str, stored_password: str) -> bool:
-    return plain_password == stored_password
+async def verify_password(plain_password: str, stored_password: str) -> bool:
+    """Checks a password against its stored hash on the hashing worker pool."""
+    return await passwords.verify_password(plain_password, stored_password)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
@@ -77,25 +85,25 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_user_by_email(email: str) -> UserInDB | None:
-    for user in HARDCODED_USER_DB.values():
-        if user.email.lower() == email.lower():
-            return user
-    return None
+    return user_directory.get_by_email(email)
 
 async def get_user_by_username(username: str) -> UserInDB | None:
-    if username.lower() in HARDCODED_USER_DB:
-        return HARDCODED_USER_DB[username.lower()]
-    return None
+    return user_directory.get_by_username(username)
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     user = await get_user_by_username(form_data.username)
-    if not user or not verify_password(form_data.password, user.password):
+    if not user or not await verify_password(form_data.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
+
+    # Upgrade the stored hash if the hashing cost settings changed since it was made
+    if passwords.needs_rehash(user.password):
+        user.password = await passwords.hash_password(form_data.password)
+        user_directory.save(user)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -142,7 +150,8 @@ async def reset_password(data: PasswordResetConfirm):
     user = await get_user_by_email(email)
     if not user: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
-    user.password = data.new_password
+    user.password = await passwords.hash_password(data.new_password)
+    user_directory.save(user)
         
     return {"message": "Your password has been reset successfully."}
 
@@ -152,12 +161,18 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> UserIn
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("username")
-        if username is None: raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    # Tokens already verified in this session skip signature checking until they expire
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    username = verified_tokens.get(token_key)
+    if username is MISSING:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("username")
+            if username is None: raise credentials_exception
+        except JWTError:
+            raise credentials_exception
+        if "exp" in payload:
+            verified_tokens.set(token_key, username, ttl=payload["exp"] - time.time())
     user = await get_user_by_username(username)
     if user is None: raise credentials_exception
     return user
@@ -171,20 +186,19 @@ async def update_user_me(update_data: ProfileUpdate, current_user: UserInDB = De
     if update_data.new_password:
         if not update_data.current_password:
             raise HTTPException(status_code=400, detail="Current password is required to set a new password")
-        if not verify_password(update_data.current_password, current_user.password):
+        if not await verify_password(update_data.current_password, current_user.password):
             raise HTTPException(status_code=400, detail="Incorrect current password")
-        current_user.password = update_data.new_password
 
-    username_changed = update_data.username.lower() != current_user.username.lower()
-    
+    # Moves the username and email index entries together; refuses ones another user has
+    try:
+        user_directory.update(current_user, username=update_data.username, email=update_data.email)
+    except UserConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    if update_data.new_password:
+        current_user.password = await passwords.hash_password(update_data.new_password)
     current_user.full_name = update_data.full_name
-    current_user.email = update_data.email
-    
-    if username_changed:
-        old_key = current_user.username.lower()
-        current_user.username = update_data.username
-        new_key = update_data.username.lower()
-        HARDCODED_USER_DB[new_key] = HARDCODED_USER_DB.pop(old_key)
+    user_directory.save(current_user)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -1,11 +1,17 @@
-import re
 import os
 import json
-import requests
+import math
+import httpx
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from typing import List, Optional  # <-- Import Optional
 from dotenv import load_dotenv
+from services import gemini
+from services.errors import UpstreamUnavailable
+from services.images import find_image
+from services.parsing import extract_json_object
+from services.recipe_index import recipe_index
+from services.allergens import ALLERGEN_MAX_REGENERATIONS, get_matcher
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -13,9 +19,6 @@ load_dotenv()
 # Create a new router instance
 router = APIRouter()
 
-# Default image URL if no image can be found
-DEFAULT_IMAGE_URL = "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=800&q=80"
-
 # --- Pydantic Models for Request and Response ---
 class GenerateRecipeRequest(BaseModel):
     """Defines the structure of the incoming request from the frontend."""
@@ -42,8 +45,6 @@ async def generate_recipe(request: GenerateRecipeRequest):
     if not all([gemini_api_key, pixabay_api_key, pexels_api_key, unsplash_access_key]):
         raise HTTPException(status_code=500, detail="One or more API keys are not set in the .env file.")
 
-    gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={gemini_api_key}"
-
     allergy_list = ", ".join(request.allergies) if request.allergies else "None"
     
     # --- NEW: Conditionally add instruction to avoid the previous recipe ---
@@ -69,68 +70,43 @@ async def generate_recipe(request: GenerateRecipeRequest):
         "}\n"
     )
 
-    data = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": 0.9,
-            "topP": 1,
-            "topK": 1,
-            "maxOutputTokens": 2048,
-        }
+    generation_config = {
+        "temperature": 0.9,
+        "topP": 1,
+        "topK": 1,
+        "maxOutputTokens": 2048,
     }
-    
-    headers = {"Content-Type": "application/json"}
 
     try:
-        # --- 1. Generate Recipe with Gemini ---
-        gemini_response = requests.post(gemini_url, headers=headers, json=data, timeout=45)
-        gemini_response.raise_for_status()
-        gemini_result = gemini_response.json()
+        # --- 1. Generate Recipe with Gemini, regenerating it if it still contains an allergen ---
+        allergen_matcher = get_matcher(request.allergies)
+        for _ in range(ALLERGEN_MAX_REGENERATIONS + 1):
+            response_text = await gemini.generate_content(gemini_api_key, prompt, generation_config, timeout=45)
+
+            recipe_data = extract_json_object(response_text)
+            if recipe_data is None:
+                raise HTTPException(status_code=500, detail="Failed to parse valid JSON from Gemini response.")
+
+            ingredients = recipe_data.get("ingredients")
+            found_allergens = allergen_matcher.violations(
+                [recipe_data.get("name", ""), *(ingredients if isinstance(ingredients, list) else [ingredients])]
+            )
+            if not found_allergens:
+                break
+            prompt += (
+                f"\nThe recipe '{recipe_data.get('name')}' contained {', '.join(found_allergens)}. "
+                "Generate a different recipe without them."
+            )
+        else:
+            raise HTTPException(status_code=500, detail=f"Could not generate a recipe free of: {', '.join(found_allergens)}.")
 
-        response_text = gemini_result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-        
-        json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-        if not json_match:
-            raise HTTPException(status_code=500, detail="Failed to parse valid JSON from Gemini response.")
-
-        recipe_data = json.loads(json_match.group())
         image_keyword = recipe_data.get("imageKeyword", recipe_data.get("name", "food"))
 
         # --- The rest of the function remains the same ---
         # (Image searching and final response construction)
         
         # --- 2. Find an Image for the Recipe ---
-        image_url = DEFAULT_IMAGE_URL
-        # (Pixabay Search...)
-        pixabay_url = "https://pixabay.com/api/"
-        pixabay_params = {"key": pixabay_api_key, "q": image_keyword, "image_type": "photo", "safesearch": "true", "per_page": 1}
-        pixabay_res = requests.get(pixabay_url, params=pixabay_params)
-        if pixabay_res.status_code == 200:
-            hits = pixabay_res.json().get("hits", [])
-            if hits:
-                image_url = hits[0].get("webformatURL", DEFAULT_IMAGE_URL)
-
-        # (Pexels Search...)
-        if image_url == DEFAULT_IMAGE_URL:
-            pexels_url = "https://api.pexels.com/v1/search"
-            pexels_headers = {"Authorization": pexels_api_key}
-            pexels_params = {"query": image_keyword, "per_page": 1}
-            pexels_res = requests.get(pexels_url, headers=pexels_headers, params=pexels_params)
-            if pexels_res.status_code == 200:
-                photos = pexels_res.json().get("photos", [])
-                if photos:
-                    image_url = photos[0].get("src", {}).get("large", DEFAULT_IMAGE_URL)
-        
-        # (Unsplash Search...)
-        if image_url == DEFAULT_IMAGE_URL:
-            unsplash_url = "https://api.unsplash.com/search/photos"
-            unsplash_headers = {"Authorization": f"Client-ID {unsplash_access_key}"}
-            unsplash_params = {"query": image_keyword, "per_page": 1}
-            unsplash_res = requests.get(unsplash_url, headers=unsplash_headers, params=unsplash_params)
-            if unsplash_res.status_code == 200:
-                results_unsplash = unsplash_res.json().get("results", [])
-                if results_unsplash:
-                    image_url = results_unsplash[0].get("urls", {}).get("regular", DEFAULT_IMAGE_URL)
+        image_url = await find_image(image_keyword)
 
         # --- 3. Construct the Final Response ---
         final_response = {
@@ -140,10 +116,13 @@ async def generate_recipe(request: GenerateRecipeRequest):
             "cookingTime": recipe_data.get("cookingTime"),
             "image": image_url
         }
+        recipe_index.add(final_response["name"], final_response["ingredients"], final_response["cookingTime"], image_url=image_url)
         
         return final_response
 
-    except requests.RequestException as e:
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"An error occurred with an external API: {e}")
     except (json.JSONDecodeError, KeyError, IndexError):
         raise HTTPException(status_code=500, detail="Could not parse the response from the recipe generation service.")
@@ -1,12 +1,26 @@
 import re
 import os
 import json
-import requests
+import math
+import time
+import httpx
 import uuid
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import hashlib
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict
+from typing import Any, AsyncIterator, Callable, List, Dict, Literal, Optional, Tuple
 from dotenv import load_dotenv
+from services import gemini, metrics
+from services.errors import UpstreamUnavailable
+from services.ratelimit import PRIORITY_BULK, upstream_priority
+from services.images import DEFAULT_IMAGE_URL, IMAGE_DEADLINE_SECONDS, IMAGE_FANOUT_LIMIT, find_image, resolve_images
+from services.parsing import JsonArrayStreamParser, extract_json_object, parse_json_array
+from services.ingredients import normalize_name
+from services.recipe_index import recipe_index
+from services.allergens import ALLERGEN_MAX_REGENERATIONS, get_matcher
+from services.jobs import FAILED, Job, JobError, JobQueue, JobQueueFull
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -14,13 +28,14 @@ load_dotenv()
 # Create a new router instance
 router = APIRouter()
 
-# Default image URL if no image can be found
-DEFAULT_IMAGE_URL = "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=800&q=80"
-
 # --- Pydantic Models ---
 class GenerateMealPlanRequest(BaseModel):
     """Defines the structure of the incoming request for generating a full meal plan."""
     allergies: List[str] = Field(default=[], description="A list of allergies to avoid.")
+    mode: Literal["single", "sharded"] = Field(
+        "single",
+        description="'single' asks for all 21 meals in one prompt; 'sharded' generates each day in parallel.",
+    )
     # You can add more preferences here in the future, e.g.,
     # diet: Optional[str] = Field(None, example="Vegetarian")
     # cuisine_preference: Optional[str] = Field(None, example="Mediterranean")
@@ -48,65 +63,18 @@ def get_api_keys():
         raise HTTPException(status_code=500, detail="One or more API keys (GEMINI, PIXABAY, PEXELS, UNPLASH) are not set in the .env file.")
     return keys
 
-# --- Helper Function for Image Searching ---
-def _get_image_for_recipe(keyword: str, keys: ApiKeys) -> str:
-    """
-    Searches for an image across multiple services (Pixabay, Pexels, Unsplash)
-    using a given keyword and returns the first URL found.
-    """
-    # 1. Try Pixabay
-    try:
-        pixabay_params = {"key": keys.pixabay_api_key, "q": keyword, "image_type": "photo", "safesearch": "true", "per_page": 3}
-        pixabay_res = requests.get("https://pixabay.com/api/", params=pixabay_params, timeout=5)
-        if pixabay_res.status_code == 200:
-            hits = pixabay_res.json().get("hits", [])
-            if hits:
-                return hits[0].get("webformatURL", DEFAULT_IMAGE_URL)
-    except requests.RequestException:
-        pass # Ignore error and try next service
-
-    # 2. Try Pexels
-    try:
-        pexels_headers = {"Authorization": keys.pexels_api_key}
-        pexels_params = {"query": keyword, "per_page": 1}
-        pexels_res = requests.get("https://api.pexels.com/v1/search", headers=pexels_headers, params=pexels_params, timeout=5)
-        if pexels_res.status_code == 200:
-            photos = pexels_res.json().get("photos", [])
-            if photos:
-                return photos[0].get("src", {}).get("large", DEFAULT_IMAGE_URL)
-    except requests.RequestException:
-        pass # Ignore error and try next service
-
-    # 3. Try Unsplash
-    try:
-        unsplash_headers = {"Authorization": f"Client-ID {keys.unsplash_access_key}"}
-        unsplash_params = {"query": keyword, "per_page": 1}
-        unsplash_res = requests.get("https://api.unsplash.com/search/photos", headers=unsplash_headers, params=unsplash_params, timeout=5)
-        if unsplash_res.status_code == 200:
-            results = unsplash_res.json().get("results", [])
-            if results:
-                return results[0].get("urls", {}).get("regular", DEFAULT_IMAGE_URL)
-    except requests.RequestException:
-        pass # Ignore error
-
-    # 4. Fallback to default
-    return DEFAULT_IMAGE_URL
-
-
-# --- API Endpoint to Generate a Full Weekly Plan ---
-@router.post("/generate-plan")
-async def generate_full_meal_plan(
-    request: GenerateMealPlanRequest,
-    api_keys: ApiKeys = Depends(get_api_keys)
-):
-    """
-    Generates a complete 7-day meal plan (Breakfast, Lunch, Dinner) based on user preferences.
-    It calls the Gemini API to get structured recipe data, then fetches images for each meal.
-    """
-    gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_keys.gemini_api_key}"
-    headers = {"Content-Type": "application/json"}
+# --- Helpers shared by the plan endpoints ---
+MEAL_PLAN_GENERATION_CONFIG = {
+    "temperature": 0.8, # Slightly lower temp for more predictable structure
+    "topP": 1,
+    "topK": 1,
+    "maxOutputTokens": 8192,
+    "responseMimeType": "application/json", # Ask Gemini to output raw JSON
+}
 
-    allergy_info = ", ".join(request.allergies) if request.allergies else "None"
+def _build_meal_plan_prompt(allergies: List[str]) -> str:
+    """Builds the Gemini prompt asking for a full 21-meal plan as a JSON array."""
+    allergy_info = ", ".join(allergies) if allergies else "None"
 
     # A detailed prompt asking for a structured JSON array
     prompt = (
@@ -138,66 +106,292 @@ async def generate_full_meal_plan(
         '  }\n'
         "]"
     )
+    return prompt
+
+def _recipe_texts(recipe_data: Dict) -> List[str]:
+    """The title and ingredient lines of a generated recipe, for allergen checks."""
+    ingredients = recipe_data.get("ingredients")
+    return [recipe_data.get("title", ""), *(ingredients if isinstance(ingredients, list) else [ingredients])]
+
+def _image_keyword(recipe_data: Dict) -> str:
+    return recipe_data.get("imageKeyword", recipe_data.get("title", "delicious food"))
+
+def _format_meal(meal: Dict, image_url: str) -> Dict:
+    """Formats one generated meal and its image to match the frontend state."""
+    recipe_data = meal["recipe"]
+
+    # Format the recipe object to match the frontend state
+    formatted_recipe = {
+        "id": f"recipe-{uuid.uuid4()}",
+        "title": recipe_data.get("title", "Unnamed Recipe"),
+        "image": image_url,
+        "prepTime": recipe_data.get("prepTime", 30),
+        "difficulty": recipe_data.get("difficulty", "Medium"),
+        "cuisineType": recipe_data.get("cuisineType", "Various"),
+        "ingredients": recipe_data.get("ingredients", []),
+        "instructions": recipe_data.get("instructions", []),
+    }
 
-    data = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": 0.8, # Slightly lower temp for more predictable structure
-            "topP": 1,
-            "topK": 1,
-            "maxOutputTokens": 8192,
-            "responseMimeType": "application/json", # Ask Gemini to output raw JSON
-        }
+    # Format the final meal object
+    return {
+        "id": f"meal-{uuid.uuid4()}",
+        "day": meal.get("day"),
+        "mealType": meal.get("mealType"),
+        "recipe": formatted_recipe
     }
 
+def _index_meal(formatted_meal: Dict) -> None:
+    """Adds a formatted meal's recipe to the local index that /recipes/recommend answers from."""
+    recipe = formatted_meal["recipe"]
+    recipe_index.add(recipe["title"], recipe["ingredients"], f"{recipe['prepTime']} minutes", recipe["difficulty"], recipe["image"])
+
+# --- Sharded Generation ---
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MEAL_TYPES = ["Breakfast", "Lunch", "Dinner"]
+
+# How many day shards may be generated by Gemini at the same time.
+MEAL_PLAN_SHARD_CONCURRENCY = int(os.getenv("MEAL_PLAN_SHARD_CONCURRENCY", 7))
+# How many times a single failed shard (or duplicate meal) is regenerated before giving up.
+MEAL_PLAN_SHARD_RETRIES = int(os.getenv("MEAL_PLAN_SHARD_RETRIES", 2))
+
+MEAL_SHARD_GENERATION_CONFIG = {
+    **MEAL_PLAN_GENERATION_CONFIG,
+    "temperature": 0.9, # A little more variety, since shards can't see each other
+    "maxOutputTokens": 2048,
+}
+
+_RECIPE_JSON_FORMAT = (
+    '    "recipe": {\n'
+    '      "title": "Creative and appealing name of the recipe",\n'
+    '      "prepTime": 20,\n'
+    '      "difficulty": "Easy",\n'
+    '      "cuisineType": "e.g., American",\n'
+    '      "ingredients": ["Quantity Unit Ingredient Name", "e.g., 2 large Eggs"],\n'
+    '      "instructions": ["Step-by-step instruction 1.", "Step-by-step instruction 2."],\n'
+    '      "imageKeyword": "a short, descriptive phrase for an image search"\n'
+    '    }\n'
+)
+
+def _avoid_titles_instruction(avoid_titles: List[str]) -> str:
+    if not avoid_titles:
+        return ""
+    return f"Do NOT use any of these recipes, which are already in the plan: {', '.join(avoid_titles)}.\n"
+
+def _build_day_prompt(day: str, allergies: List[str], avoid_titles: List[str]) -> str:
+    """Builds the prompt for one day shard: Breakfast, Lunch and Dinner as a JSON array."""
+    allergy_info = ", ".join(allergies) if allergies else "None"
+    return (
+        f"Generate Breakfast, Lunch, and Dinner for {day} as part of a varied weekly meal plan. "
+        f"The three recipes must be different and suitable for a home cook.\n"
+        f"CRITICAL: The recipes MUST NOT contain any of the following allergens: {allergy_info}.\n"
+        f"{_avoid_titles_instruction(avoid_titles)}\n"
+        "Provide the response STRICTLY as a valid JSON array of exactly 3 objects, with no text before or after it. "
+        "prepTime is an integer in minutes and difficulty is one of \"Easy\", \"Medium\" or \"Hard\".\n"
+        "[\n"
+        "  {\n"
+        f'    "day": "{day}",\n'
+        '    "mealType": "Breakfast",\n'
+        + _RECIPE_JSON_FORMAT +
+        "  },\n"
+        "  ... Lunch, then Dinner ...\n"
+        "]"
+    )
+
+def _build_single_meal_prompt(day: str, meal_type: str, allergies: List[str], avoid_titles: List[str]) -> str:
+    """Builds the prompt used to regenerate one meal that collided with another shard or contained an allergen."""
+    allergy_info = ", ".join(allergies) if allergies else "None"
+    return (
+        f"Generate one {meal_type} recipe for {day} for a home cook.\n"
+        f"CRITICAL: The recipe MUST NOT contain any of the following allergens: {allergy_info}.\n"
+        f"{_avoid_titles_instruction(avoid_titles)}\n"
+        "Provide the response STRICTLY as a single valid JSON object, with no text before or after it.\n"
+        "{\n"
+        f'    "day": "{day}",\n'
+        f'    "mealType": "{meal_type}",\n'
+        + _RECIPE_JSON_FORMAT +
+        "}"
+    )
+
+async def _generate_with_retries(api_key: str, prompt: str, parse: Callable[[str], Any]) -> Any:
+    """Calls Gemini for one shard and parses it, regenerating only this shard on failure."""
+    last_error: Exception = ValueError("Shard was never generated.")
+    for _ in range(MEAL_PLAN_SHARD_RETRIES + 1):
+        try:
+            response_text = await gemini.generate_content(api_key, prompt, MEAL_SHARD_GENERATION_CONFIG, timeout=45)
+            return parse(response_text)
+        except (httpx.HTTPError, json.JSONDecodeError, KeyError, IndexError, TypeError, ValueError) as e:
+            last_error = e
+    raise last_error
+
+async def _generate_day(day: str, allergies: List[str], api_key: str) -> List[Dict]:
+    def _parse(response_text: str) -> List[Dict]:
+        meals = [meal for meal in parse_json_array(response_text).items if isinstance(meal, dict) and meal.get("recipe")]
+        if len(meals) < len(MEAL_TYPES):
+            raise ValueError(f"Expected {len(MEAL_TYPES)} meals for {day}, got {len(meals)}.")
+        # Pin day and meal type, so a shard can never land in the wrong slot
+        for meal, meal_type in zip(meals, MEAL_TYPES):
+            meal["day"] = day
+            meal["mealType"] = meal_type
+        return meals[:len(MEAL_TYPES)]
+
+    return await _generate_with_retries(api_key, _build_day_prompt(day, allergies, []), _parse)
+
+async def _regenerate_meal(meal: Dict, allergies: List[str], avoid_titles: List[str], api_key: str) -> Dict:
+    def _parse(response_text: str) -> Dict:
+        generated = extract_json_object(response_text)
+        if not generated or not generated.get("recipe"):
+            raise ValueError("Regenerated meal has no recipe.")
+        return {**generated, "day": meal["day"], "mealType": meal["mealType"]}
+
+    prompt = _build_single_meal_prompt(meal["day"], meal["mealType"], allergies, avoid_titles)
+    return await _generate_with_retries(api_key, prompt, _parse)
+
+def _find_duplicate_meals(meals: List[Dict]) -> List[int]:
+    """Indexes of meals whose title already appeared earlier in the plan."""
+    seen = set()
+    duplicates = []
+    for index, meal in enumerate(meals):
+        title = normalize_name(meal["recipe"].get("title", ""))
+        if title in seen:
+            duplicates.append(index)
+        seen.add(title)
+    return duplicates
+
+def _find_unsafe_meals(meals: List[Dict], allergies: List[str]) -> List[int]:
+    """Indexes of meals containing a requested allergen, checked for the whole plan in one pass."""
+    return get_matcher(allergies).unsafe_indexes([_recipe_texts(meal["recipe"]) for meal in meals])
+
+async def _replace_offending_meals(
+    meals: List[Dict],
+    allergies: List[str],
+    api_key: str,
+    find_offending: Callable[[List[Dict]], List[int]],
+    rounds: int,
+) -> List[Dict]:
+    """
+    Regenerates only the meals `find_offending` flags, for up to `rounds`
+    rounds, then drops any meal that still contains a requested allergen.
+    """
+    semaphore = asyncio.Semaphore(MEAL_PLAN_SHARD_CONCURRENCY)
+
+    async def _bounded(coro):
+        async with semaphore:
+            return await coro
+
+    for _ in range(rounds):
+        offending = find_offending(meals)
+        if not offending:
+            break
+        titles = sorted({meal["recipe"].get("title", "") for meal in meals})
+        replacements = await asyncio.gather(
+            *(_bounded(_regenerate_meal(meals[index], allergies, titles, api_key)) for index in offending)
+        )
+        for index, replacement in zip(offending, replacements):
+            meals[index] = replacement
+
+    unsafe = set(_find_unsafe_meals(meals, allergies))
+    if unsafe:
+        print(f"Dropped {len(unsafe)} meals that still contained requested allergens.")
+    return [meal for index, meal in enumerate(meals) if index not in unsafe]
+
+async def _generate_sharded_plan(allergies: List[str], api_key: str) -> List[Dict]:
+    """
+    Generates the week as seven independent day shards, in parallel up to
+    MEAL_PLAN_SHARD_CONCURRENCY, then regenerates only the meals whose title
+    repeats one from another shard or that contain a requested allergen.
+    Returns meals in the same shape and order as the single-prompt plan.
+    """
+    semaphore = asyncio.Semaphore(MEAL_PLAN_SHARD_CONCURRENCY)
+
+    async def _bounded(coro):
+        async with semaphore:
+            return await coro
+
+    days = await asyncio.gather(*(_bounded(_generate_day(day, allergies, api_key)) for day in DAYS))
+    meals = [meal for day_meals in days for meal in day_meals]
+
+    def _offending(plan: List[Dict]) -> List[int]:
+        return sorted(set(_find_duplicate_meals(plan)) | set(_find_unsafe_meals(plan, allergies)))
+
+    return await _replace_offending_meals(meals, allergies, api_key, _offending, MEAL_PLAN_SHARD_RETRIES + 1)
+
+async def _format_with_images(meals: List[Dict], on_meal: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Fetches every meal's image concurrently, bounded by a fan-out limit and a
+    total deadline, and formats the meals for the frontend in plan order.
+    `on_meal` is called with each formatted meal as soon as its image is ready.
+    """
+    keywords = [_image_keyword(meal["recipe"]) for meal in meals]
+    formatted: List[Optional[Dict]] = [None] * len(meals)
+
+    def _ready(index: int, image_url: str) -> None:
+        if formatted[index] is None:
+            formatted[index] = _format_meal(meals[index], image_url)
+            if on_meal is not None:
+                on_meal(formatted[index])
+
+    async def _lookup(keyword: str) -> str:
+        image_url = await find_image(keyword)
+        for index, meal_keyword in enumerate(keywords):
+            if meal_keyword == keyword:
+                _ready(index, image_url)
+        return image_url
+
+    # Meals whose lookup failed or missed the deadline get their fallback image here
+    for index, image_url in enumerate(await resolve_images(keywords, lookup=_lookup)):
+        _ready(index, image_url)
+    return formatted
+
+async def _generate_meal_plan(
+    request: GenerateMealPlanRequest,
+    api_keys: ApiKeys,
+    on_meal: Optional[Callable[[Dict], None]] = None,
+) -> List[Dict]:
+    """
+    Generates a complete 7-day meal plan (Breakfast, Lunch, Dinner) based on user preferences.
+    It calls the Gemini API to get structured recipe data, then fetches images for each meal.
+    With mode="sharded" each day is generated separately and in parallel.
+    Raises HTTPException on failure.
+    """
+    # Bulk work: queue behind interactive single-recipe calls for upstream budgets
+    upstream_priority.set(PRIORITY_BULK)
+
     try:
         # 1. Generate Meal Plan content from Gemini
-        gemini_response = requests.post(gemini_url, headers=headers, json=data, timeout=60)
-        gemini_response.raise_for_status()
-        gemini_result = gemini_response.json()
-
-        response_text = gemini_result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-
-        # The response should be a clean JSON string because we set responseMimeType
-        generated_plan = json.loads(response_text)
-
-        if not isinstance(generated_plan, list):
-             raise HTTPException(status_code=500, detail="Gemini response was not a valid list.")
-
-        # 2. Process the generated plan: Fetch images and format for frontend
-        final_meal_plan = []
-        for meal in generated_plan:
-            recipe_data = meal.get("recipe", {})
-            if not recipe_data:
-                continue
-
-            # Fetch an image using the helper function
-            image_keyword = recipe_data.get("imageKeyword", recipe_data.get("title", "delicious food"))
-            image_url = _get_image_for_recipe(image_keyword, api_keys)
-
-            # Format the recipe object to match the frontend state
-            formatted_recipe = {
-                "id": f"recipe-{uuid.uuid4()}",
-                "title": recipe_data.get("title", "Unnamed Recipe"),
-                "image": image_url,
-                "prepTime": recipe_data.get("prepTime", 30),
-                "difficulty": recipe_data.get("difficulty", "Medium"),
-                "cuisineType": recipe_data.get("cuisineType", "Various"),
-                "ingredients": recipe_data.get("ingredients", []),
-                "instructions": recipe_data.get("instructions", []),
-            }
-
-            # Format the final meal object
-            final_meal_plan.append({
-                "id": f"meal-{uuid.uuid4()}",
-                "day": meal.get("day"),
-                "mealType": meal.get("mealType"),
-                "recipe": formatted_recipe
-            })
+        if request.mode == "sharded":
+            generated_plan = await _generate_sharded_plan(request.allergies, api_keys.gemini_api_key)
+        else:
+            prompt = _build_meal_plan_prompt(request.allergies)
+            response_text = await gemini.generate_content(api_keys.gemini_api_key, prompt, MEAL_PLAN_GENERATION_CONFIG, timeout=60)
+
+            # Keep every complete meal even if the output was cut off or has a malformed entry
+            parsed_plan = parse_json_array(response_text)
+            if not parsed_plan.items:
+                raise HTTPException(status_code=500, detail="Gemini response was not a valid list.")
+            if parsed_plan.partial:
+                print(f"Recovered {len(parsed_plan.items)} meals from a partial Gemini meal plan.")
+            generated_plan = parsed_plan.items
+
+        meals = [meal for meal in generated_plan if isinstance(meal, dict) and meal.get("recipe")]
+        if request.mode != "sharded":
+            # Regenerate only the meals that slipped a requested allergen through
+            meals = await _replace_offending_meals(
+                meals, request.allergies, api_keys.gemini_api_key,
+                lambda plan: _find_unsafe_meals(plan, request.allergies), ALLERGEN_MAX_REGENERATIONS,
+            )
+
+        # 2. Fetch every meal's image and format the plan for the frontend
+        final_meal_plan = await _format_with_images(meals, on_meal)
+        for formatted_meal in final_meal_plan:
+            _index_meal(formatted_meal)
 
         return final_meal_plan
 
-    except requests.RequestException as e:
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"An error occurred with an external API: {e}")
     except (json.JSONDecodeError, KeyError, IndexError) as e:
         # This will catch errors if Gemini doesn't return the expected structure
@@ -205,4 +399,247 @@ async def generate_full_meal_plan(
         print(f"Received text: {response_text if 'response_text' in locals() else 'N/A'}")
         raise HTTPException(status_code=500, detail="Could not parse the response from the recipe generation service.")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+# --- Background Jobs ---
+# Plans submitted with POST /jobs are generated by a pool of in-process
+# workers. Identical requests (same mode and allergies) share one job while it
+# is queued or running, so a client retrying after a proxy timeout attaches to
+# the plan being generated; asking again once it has finished gives a new plan.
+# With an Idempotency-Key header, only requests with the same key share a job,
+# and a retry with that key gets the finished job back while it is kept.
+MEAL_PLAN_JOB_WORKERS = int(os.getenv("MEAL_PLAN_JOB_WORKERS", 4))
+# Plans that may wait for a worker before new submissions are turned away with a 503.
+MEAL_PLAN_JOB_QUEUE_SIZE = int(os.getenv("MEAL_PLAN_JOB_QUEUE_SIZE", 100))
+# Longest a status poll may wait for the job to change, in seconds.
+MEAL_PLAN_JOB_MAX_WAIT = 30
+
+meal_plan_jobs = JobQueue("meal_plans", MEAL_PLAN_JOB_WORKERS, MEAL_PLAN_JOB_QUEUE_SIZE)
+
+def _meal_plan_fingerprint(request: GenerateMealPlanRequest, idempotency_key: Optional[str] = None) -> str:
+    """
+    Requests that would produce the same kind of plan, ignoring allergy case,
+    order and repeats. With an idempotency key, only requests with that key match.
+    """
+    allergies = sorted({normalize_name(allergy) for allergy in request.allergies} - {""})
+    return hashlib.sha256(json.dumps([request.mode, allergies, idempotency_key]).encode()).hexdigest()
+
+def _submit_meal_plan_job(
+    request: GenerateMealPlanRequest,
+    api_keys: ApiKeys,
+    idempotency_key: Optional[str] = None,
+) -> Tuple[Job, bool]:
+    """Queues the plan, or attaches to an identical one. Raises HTTPException(503) when the queue is full."""
+    async def _run(job: Job) -> List[Dict]:
+        try:
+            return await _generate_meal_plan(request, api_keys, on_meal=job.publish)
+        except HTTPException as e:
+            retry_after = (e.headers or {}).get("Retry-After")
+            raise JobError(e.status_code, e.detail, float(retry_after) if retry_after else None)
+
+    try:
+        return meal_plan_jobs.submit(
+            _meal_plan_fingerprint(request, idempotency_key), _run, idempotent=idempotency_key is not None
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+# --- API Endpoint to Generate a Full Weekly Plan ---
+@router.post("/generate-plan")
+async def generate_full_meal_plan(
+    request: GenerateMealPlanRequest,
+    api_keys: ApiKeys = Depends(get_api_keys)
+):
+    """
+    Generates a complete 7-day meal plan (Breakfast, Lunch, Dinner) based on user preferences.
+    It calls the Gemini API to get structured recipe data, then fetches images for each meal.
+    With mode="sharded" each day is generated separately and in parallel.
+
+    Use POST /jobs instead to get a job ID back immediately and have the plan
+    survive a dropped connection.
+    """
+    return await _generate_meal_plan(request, api_keys)
+
+# --- API Endpoints for Meal Plan Jobs ---
+@router.post("/jobs", status_code=202)
+async def submit_meal_plan_job(
+    request: GenerateMealPlanRequest,
+    http_request: Request,
+    response: Response,
+    api_keys: ApiKeys = Depends(get_api_keys),
+    idempotency_key: Optional[str] = Header(None, max_length=128, description="Retries with the same key get the same job, even once it has finished."),
+):
+    """
+    Queues a meal plan and returns its job ID straight away. An identical
+    request already queued or running returns that job instead, with
+    "deduplicated": true. With an Idempotency-Key, only requests with the same
+    key match, and a finished job is returned too. Follow the job with
+    GET /jobs/{job_id} or GET /jobs/{job_id}/events.
+    """
+    job, created = _submit_meal_plan_job(request, api_keys, idempotency_key)
+    status_url = str(http_request.url_for("get_meal_plan_job", job_id=job.id))
+    response.headers["Location"] = status_url
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": status_url,
+        "events_url": str(http_request.url_for("stream_meal_plan_job", job_id=job.id)),
+    }
+
+def _get_job_or_404(job_id: str) -> Job:
+    job = meal_plan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Meal plan job '{job_id}' not found or expired.")
+    return job
+
+@router.get("/jobs/{job_id}")
+async def get_meal_plan_job(
+    job_id: str,
+    after: int = Query(0, ge=0, description="Number of partial meals already received; only later ones are returned."),
+    wait: float = Query(0, ge=0, le=MEAL_PLAN_JOB_MAX_WAIT, description="Seconds to wait for progress before answering (long polling)."),
+):
+    """
+    The job's status, the meals finished since `after` (in "partial") and,
+    once it has succeeded, the full plan in "result". With `wait`, the
+    response is held until a new meal is ready or the job finishes.
+    """
+    job = _get_job_or_404(job_id)
+    deadline = time.monotonic() + wait
+    while not job.done and len(job.partial) <= after:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await job.wait_for_change(job.version, remaining):
+            break
+    return job.to_dict(after)
+
+@router.get("/jobs/{job_id}/events")
+async def stream_meal_plan_job(job_id: str):
+    """
+    Follows a job as newline-delimited JSON, with the same events as
+    /generate-plan/stream. Meals already finished are sent first, so
+    subscribing late (or again after a disconnect) loses nothing.
+    """
+    job = _get_job_or_404(job_id)
+    return StreamingResponse(_job_events(job), media_type="application/x-ndjson")
+
+async def _job_events(job: Job) -> AsyncIterator[str]:
+    sent = 0
+    while True:
+        version = job.version
+        for meal in job.partial[sent:]:
+            yield json.dumps({"event": "meal", "meal": meal}) + "\n"
+        sent = len(job.partial)
+        if job.done:
+            break
+        await job.wait_for_change(version)
+    if job.status == FAILED:
+        yield json.dumps({"event": "error", "detail": job.error["detail"]}) + "\n"
+    yield json.dumps({"event": "done", "count": sent}) + "\n"
+
+
+# --- API Endpoint to Stream a Full Weekly Plan ---
+@router.post("/generate-plan/stream")
+async def stream_full_meal_plan(
+    request: GenerateMealPlanRequest,
+    api_keys: ApiKeys = Depends(get_api_keys)
+):
+    """
+    Streaming variant of /generate-plan. Responds with newline-delimited JSON
+    events while Gemini is still generating:
+
+    - {"event": "meal", "meal": {...}} for each meal, with its image, as soon as it is ready
+    - {"event": "error", "detail": "..."} if generation fails part-way
+    - {"event": "done", "count": N} once the plan is complete
+    """
+    prompt = _build_meal_plan_prompt(request.allergies)
+    return StreamingResponse(
+        _stream_meal_plan_events(prompt, request.allergies, api_keys),
+        media_type="application/x-ndjson",
+    )
+
+async def _stream_meal_plan_events(prompt: str, allergies: List[str], api_keys: ApiKeys) -> AsyncIterator[str]:
+    """
+    Parses the streamed plan incrementally and emits each meal once its image
+    is resolved. A meal containing a requested allergen, or repeating the
+    title of a meal already emitted, is regenerated on its own first; one
+    that still does, or whose regeneration fails, is skipped. Image lookups
+    share one fan-out limit per stream, and each meal waits at most
+    IMAGE_DEADLINE_SECONDS for its image, including the wait for a free
+    lookup slot.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    image_tasks = set()
+    image_semaphore = asyncio.Semaphore(IMAGE_FANOUT_LIMIT)
+    allergen_matcher = get_matcher(allergies)
+    # Normalized title -> title of every meal emitted or about to be
+    seen_titles: Dict[str, str] = {}
+
+    async def _lookup_image(keyword: str) -> str:
+        async with image_semaphore:
+            return await find_image(keyword) or DEFAULT_IMAGE_URL
+
+    async def _emit_meal(meal: Dict) -> None:
+        for _ in range(ALLERGEN_MAX_REGENERATIONS):
+            title = meal["recipe"].get("title", "")
+            duplicate = normalize_name(title) in seen_titles
+            if not duplicate and not allergen_matcher.violations(_recipe_texts(meal["recipe"])):
+                break
+            avoid_titles = sorted(set(seen_titles.values()) | {title})
+            try:
+                meal = await _regenerate_meal(meal, allergies, avoid_titles, api_keys.gemini_api_key)
+            except Exception as e:
+                # Only this meal is lost; the rest of the plan keeps streaming
+                print(f"Skipped a streamed meal that could not be regenerated: {e}")
+                return
+        title = meal["recipe"].get("title", "")
+        if allergen_matcher.violations(_recipe_texts(meal["recipe"])):
+            print(f"Skipped a streamed meal that still contained requested allergens: {title}")
+            return
+        if normalize_name(title) in seen_titles:
+            print(f"Skipped a streamed meal that still repeated an earlier title: {title}")
+            return
+        # Claimed before the image lookup, so a later meal with the same title is regenerated
+        seen_titles[normalize_name(title)] = title
+        try:
+            image_url = await asyncio.wait_for(_lookup_image(_image_keyword(meal["recipe"])), IMAGE_DEADLINE_SECONDS)
+        except asyncio.TimeoutError:
+            metrics.image_fallbacks.inc("deadline")
+            image_url = DEFAULT_IMAGE_URL
+        except Exception:
+            metrics.image_fallbacks.inc("error")
+            image_url = DEFAULT_IMAGE_URL
+        formatted_meal = _format_meal(meal, image_url)
+        _index_meal(formatted_meal)
+        await events.put({"event": "meal", "meal": formatted_meal})
+
+    async def _generate() -> None:
+        upstream_priority.set(PRIORITY_BULK)
+        parser = JsonArrayStreamParser()
+        try:
+            async for chunk in gemini.stream_content(api_keys.gemini_api_key, prompt, MEAL_PLAN_GENERATION_CONFIG, timeout=60):
+                for meal in parser.feed(chunk):
+                    if isinstance(meal, dict) and meal.get("recipe"):
+                        image_tasks.add(asyncio.create_task(_emit_meal(meal)))
+            await asyncio.gather(*image_tasks)
+        except UpstreamUnavailable as e:
+            await events.put({"event": "error", "detail": str(e)})
+        except httpx.HTTPError as e:
+            await events.put({"event": "error", "detail": f"An error occurred with an external API: {e}"})
+        except Exception as e:
+            await events.put({"event": "error", "detail": f"An unexpected error occurred: {e}"})
+        finally:
+            await events.put(None)
+
+    generator_task = asyncio.create_task(_generate())
+    count = 0
+    try:
+        while (event := await events.get()) is not None:
+            if event["event"] == "meal":
+                count += 1
+            yield json.dumps(event) + "\n"
+        yield json.dumps({"event": "done", "count": count}) + "\n"
+    finally:
+        # The client may disconnect early; stop generating on its behalf.
+        generator_task.cancel()
+        for task in image_tasks:
+            task.cancel()
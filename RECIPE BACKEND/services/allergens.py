@@ -0,0 +1,249 @@
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from services.ingredients import normalize_ingredient
+
+# How many times a generated recipe that still contains a requested allergen
+# is regenerated before it is dropped.
+ALLERGEN_MAX_REGENERATIONS = int(os.getenv("ALLERGEN_MAX_REGENERATIONS", 2))
+
+# --- Allergen Taxonomy ---
+# Ingredient words and phrases that belong to each allergen category. Phrases
+# are normalized like ingredients, so plurals and casing don't matter.
+ALLERGEN_CATEGORIES: Dict[str, List[str]] = {
+    "dairy": [
+        "milk", "cheese", "butter", "cream", "yogurt", "yoghurt", "ghee", "whey", "casein", "buttermilk",
+        "parmesan", "mozzarella", "cheddar", "feta", "ricotta", "mascarpone", "brie", "gouda", "paneer",
+        "halloumi", "pecorino", "gruyere", "queso", "cream cheese", "sour cream", "half and half",
+        "ice cream", "condensed milk", "evaporated milk", "custard", "bechamel", "alfredo", "pesto",
+    ],
+    "egg": ["egg", "egg white", "egg yolk", "mayonnaise", "mayo", "meringue", "aioli", "custard", "egg noodle"],
+    "peanut": ["peanut", "groundnut", "peanut butter", "peanut oil", "satay"],
+    "tree nut": [
+        "nut", "almond", "walnut", "cashew", "pecan", "pistachio", "hazelnut", "macadamia", "brazil nut",
+        "pine nut", "chestnut", "praline", "marzipan", "nutella", "pesto", "almond milk", "almond flour",
+        "almond butter", "cashew milk", "cashew butter",
+    ],
+    "fish": [
+        "fish", "salmon", "tuna", "cod", "haddock", "halibut", "tilapia", "trout", "sardine", "anchovy",
+        "mackerel", "snapper", "sea bass", "catfish", "swordfish", "herring", "pollock", "mahi mahi",
+        "fish sauce", "worcestershire sauce", "caesar dressing", "bonito", "dashi",
+    ],
+    "shellfish": [
+        "shellfish", "shrimp", "prawn", "crab", "lobster", "crayfish", "crawfish", "scallop", "clam",
+        "mussel", "oyster", "squid", "calamari", "octopus", "oyster sauce",
+    ],
+    "soy": ["soy", "soya", "soybean", "tofu", "tempeh", "edamame", "miso", "soy sauce", "tamari", "soy milk"],
+    "gluten": [
+        "wheat", "flour", "bread", "breadcrumb", "panko", "pasta", "spaghetti", "noodle", "egg noodle",
+        "macaroni", "couscous", "barley", "rye", "semolina", "bulgur", "farro", "seitan", "pita", "bagel",
+        "croissant", "cracker", "crouton", "soy sauce", "beer", "malt", "orzo", "lasagna", "penne",
+        "fettuccine", "linguine", "ramen", "udon", "pancake", "waffle", "tortilla", "pie crust",
+        "pizza dough", "puff pastry", "biscuit",
+    ],
+    "sesame": ["sesame", "sesame oil", "sesame seed", "tahini", "hummus", "halva"],
+}
+
+# Phrases that contain an allergen word but are not that allergen. The
+# longest phrase wins, so "coconut milk" stops "milk" from matching.
+NON_ALLERGEN_PHRASES = [
+    "coconut milk", "coconut cream", "rice milk", "oat milk", "cocoa butter", "apple butter",
+    "butter bean", "cream of tartar", "water chestnut", "rice flour", "corn flour", "coconut flour",
+    "rice noodle", "corn tortilla", "vegan butter", "vegan cheese",
+]
+
+# Names users give their allergies, mapped to taxonomy categories. Anything
+# that is neither a category nor listed here is matched as the literal ingredient.
+ALLERGY_SYNONYMS: Dict[str, List[str]] = {
+    "milk": ["dairy"],
+    "lactose": ["dairy"],
+    "dairy product": ["dairy"],
+    "nut": ["tree nut", "peanut"],
+    "tree nut": ["tree nut"],
+    "groundnut": ["peanut"],
+    "seafood": ["fish", "shellfish"],
+    "crustacean": ["shellfish"],
+    "mollusc": ["shellfish"],
+    "wheat": ["gluten"],
+    "celiac": ["gluten"],
+    "coeliac": ["gluten"],
+    "soya": ["soy"],
+    "soybean": ["soy"],
+    "sesame seed": ["sesame"],
+}
+
+# One bit per category; a recipe's allergens are summarized as an int bitset.
+CATEGORY_BITS: Dict[str, int] = {category: 1 << position for position, category in enumerate(ALLERGEN_CATEGORIES)}
+_SEPARATOR = None
+
+
+@lru_cache(maxsize=8192)
+def _phrase(text: str) -> Tuple[str, ...]:
+    """Normalized words of an ingredient line. Cached, since lines like "salt" repeat across recipes."""
+    return tuple(normalize_ingredient(text).split())
+
+
+def _taxonomy_patterns() -> Dict[Tuple[str, ...], int]:
+    patterns: Dict[Tuple[str, ...], int] = {_phrase(phrase): 0 for phrase in NON_ALLERGEN_PHRASES}
+    for category, phrases in ALLERGEN_CATEGORIES.items():
+        for phrase in phrases:
+            patterns[_phrase(phrase)] = patterns.get(_phrase(phrase), 0) | CATEGORY_BITS[category]
+    return patterns
+
+
+_TAXONOMY_PATTERNS = _taxonomy_patterns()
+_SYNONYMS = {_phrase(name): categories for name, categories in ALLERGY_SYNONYMS.items()}
+_CATEGORIES_BY_PHRASE = {_phrase(category): [category] for category in ALLERGEN_CATEGORIES}
+
+
+class _WordAutomaton:
+    """
+    Aho-Corasick automaton over words rather than characters, so "egg" never
+    matches inside "eggplant". Finds every pattern occurrence in one pass.
+    """
+
+    def __init__(self, patterns: Sequence[Tuple[str, ...]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self.lengths = [len(pattern) for pattern in patterns]
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for word in pattern:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][word] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(pattern_id)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(word, 0) if state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, words: Sequence[Optional[str]]) -> List[Tuple[int, int]]:
+        """Returns (start, pattern_id) for every occurrence. None words never match and reset the scan."""
+        matches = []
+        state = 0
+        for position, word in enumerate(words):
+            if word is _SEPARATOR:
+                state = 0
+                continue
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            for pattern_id in self._output[state]:
+                matches.append((position - self.lengths[pattern_id] + 1, pattern_id))
+        return matches
+
+
+class AllergenMatcher:
+    """
+    Precompiled check for one set of allergies. Allergies naming a category
+    ("dairy", "seafood", "milk") match every ingredient in it, using the
+    synonym and taxonomy tables; any other allergy matches that ingredient
+    literally ("cilantro"). Matching is word-based, plural-insensitive and
+    prefers the longest phrase, so "peanut butter" is a peanut, not dairy.
+    """
+
+    def __init__(self, allergies: Iterable[str]):
+        self.allergies: List[str] = []
+        self.category_mask = 0
+        self.custom_terms: List[Tuple[str, ...]] = []
+        self._allergy_bits: List[Tuple[str, int]] = []
+
+        patterns = list(_TAXONOMY_PATTERNS)
+        masks = list(_TAXONOMY_PATTERNS.values())
+        self._custom_from = len(patterns)
+        next_bit = 1 << len(CATEGORY_BITS)
+        for allergy in allergies:
+            phrase = _phrase(allergy)
+            if not phrase:
+                continue
+            categories = _CATEGORIES_BY_PHRASE.get(phrase) or _SYNONYMS.get(phrase)
+            if categories:
+                bits = 0
+                for category in categories:
+                    bits |= CATEGORY_BITS[category]
+                self.category_mask |= bits
+            else:
+                bits = next_bit
+                next_bit <<= 1
+                patterns.append(phrase)
+                masks.append(bits)
+                self.custom_terms.append(phrase)
+            self.allergies.append(allergy)
+            self._allergy_bits.append((allergy, bits))
+
+        self.mask = self.category_mask
+        for _, bits in self._allergy_bits:
+            self.mask |= bits
+        self._masks = masks
+        self._automaton = _WordAutomaton(patterns)
+
+    def scan(self, texts: Iterable[str]) -> int:
+        """
+        Bitset of the categories (and literal allergies) found in the texts.
+        Overlapping taxonomy phrases resolve to the leftmost longest one;
+        literal allergies always count wherever they appear.
+        """
+        words: List[Optional[str]] = []
+        for text in texts:
+            if isinstance(text, str):
+                words.extend(_phrase(text))
+                words.append(_SEPARATOR)
+
+        found = 0
+        taxonomy_matches = []
+        for start, pattern_id in self._automaton.find(words):
+            if pattern_id >= self._custom_from:
+                found |= self._masks[pattern_id]
+            else:
+                taxonomy_matches.append((start, -self._automaton.lengths[pattern_id], pattern_id))
+
+        covered_until = 0
+        for start, negative_length, pattern_id in sorted(taxonomy_matches):
+            if start >= covered_until:
+                found |= self._masks[pattern_id]
+                covered_until = start - negative_length
+        return found
+
+    def violations(self, texts: Iterable[str]) -> List[str]:
+        """The requested allergies present in the texts (e.g. a recipe's title and ingredients)."""
+        if not self.mask:
+            return []
+        found = self.scan(texts)
+        return [allergy for allergy, bits in self._allergy_bits if found & bits]
+
+    def unsafe_indexes(self, recipes: Sequence[Iterable[str]]) -> List[int]:
+        """Positions of the recipes (each given as its texts) that contain a requested allergy."""
+        if not self.mask:
+            return []
+        return [index for index, texts in enumerate(recipes) if self.scan(texts) & self.mask]
+
+
+@lru_cache(maxsize=256)
+def _cached_matcher(allergies: FrozenSet[str]) -> AllergenMatcher:
+    return AllergenMatcher(sorted(allergies))
+
+
+def get_matcher(allergies: Iterable[str]) -> AllergenMatcher:
+    """Returns the compiled matcher for these allergies, reusing it across requests."""
+    return _cached_matcher(frozenset(allergy for allergy in allergies if allergy and allergy.strip()))
+
+
+# Categories only, for summarizing recipes independently of any request.
+taxonomy_matcher = get_matcher([])
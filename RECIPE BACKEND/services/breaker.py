@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from services.errors import UpstreamUnavailable
+
+# --- Breaker Settings (overridable from the .env file) ---
+# Consecutive failures that open a provider's circuit.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+# Seconds an open circuit waits before probing the provider again.
+BREAKER_RECOVERY_SECONDS = float(os.getenv("BREAKER_RECOVERY_SECONDS", 30))
+# Adaptive timeout = this percentile of recent successful latencies x the multiplier.
+BREAKER_TIMEOUT_PERCENTILE = float(os.getenv("BREAKER_TIMEOUT_PERCENTILE", 0.99))
+BREAKER_TIMEOUT_MULTIPLIER = float(os.getenv("BREAKER_TIMEOUT_MULTIPLIER", 2.0))
+# Successful calls needed before the adaptive timeout replaces the maximum.
+BREAKER_MIN_SAMPLES = int(os.getenv("BREAKER_MIN_SAMPLES", 20))
+BREAKER_LATENCY_WINDOW = int(os.getenv("BREAKER_LATENCY_WINDOW", 200))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(provider, retry_after, f"{provider} is temporarily unavailable; retry in {retry_after:.0f}s.")
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker for one external provider.
+
+    After BREAKER_FAILURE_THRESHOLD consecutive failures the circuit opens and
+    calls fail instantly. With a `probe`, a background task checks the
+    provider every BREAKER_RECOVERY_SECONDS and closes the circuit once it
+    answers; without one, a single live call is let through (half-open)
+    after the recovery time. Successful latencies feed an adaptive timeout
+    clamped between `min_timeout` and `max_timeout`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_timeout: float,
+        max_timeout: float,
+        probe: Optional[Callable[[], Awaitable[Any]]] = None,
+    ):
+        self.name = name
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._half_open_busy = False
+        self._latencies: deque = deque(maxlen=BREAKER_LATENCY_WINDOW)
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def allow_request(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.probe is not None or time.monotonic() - self.opened_at < BREAKER_RECOVERY_SECONDS:
+                return False
+            self.state = HALF_OPEN
+        if self._half_open_busy:
+            return False
+        self._half_open_busy = True
+        return True
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_RECOVERY_SECONDS - time.monotonic())
+
+    def record_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self.failures = 0
+        self._half_open_busy = False
+        self.state = CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._half_open_busy = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= BREAKER_FAILURE_THRESHOLD):
+            self._open()
+
+    def release(self) -> None:
+        """Called when a call was abandoned (e.g. a cancelled hedge) without an outcome."""
+        self._half_open_busy = False
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.create_task(self._probe_until_recovered())
+
+    async def _probe_until_recovered(self) -> None:
+        while self.state == OPEN:
+            await asyncio.sleep(BREAKER_RECOVERY_SECONDS)
+            self.state = HALF_OPEN
+            self._half_open_busy = True
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self.probe(), self.max_timeout)
+            except Exception:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._half_open_busy = False
+                continue
+            self.record_success(time.monotonic() - started)
+
+    def timeout(self) -> float:
+        """Adaptive timeout from recent latency percentiles; the maximum until there is enough data."""
+        if len(self._latencies) < BREAKER_MIN_SAMPLES:
+            return self.max_timeout
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * BREAKER_TIMEOUT_PERCENTILE))
+        return min(self.max_timeout, max(self.min_timeout, ordered[index] * BREAKER_TIMEOUT_MULTIPLIER))
+
+    async def call(self, fn: Callable[[float], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Runs fn(timeout) through the breaker. Raises CircuitOpenError without
+        calling fn while the circuit is open; timeouts count as failures.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+        timeout = self.timeout() if timeout is None else timeout
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "timeout": round(self.timeout(), 3),
+        }
+
+
+# One breaker per provider, shared by every router.
+BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(
+    name: str,
+    min_timeout: float,
+    max_timeout: float,
+    probe: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> CircuitBreaker:
+    """Returns the provider's breaker, creating it with these settings on first use."""
+    breaker = BREAKERS.get(name)
+    if breaker is None:
+        breaker = BREAKERS[name] = CircuitBreaker(name, min_timeout, max_timeout, probe)
+    return breaker
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.status() for name, breaker in BREAKERS.items()}
@@ -0,0 +1,250 @@
+import json
+import uuid
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Returned by TTLCache.get when a key is not cached. A cached value may itself
+# be None (used for "nothing found" entries), so None cannot mean "miss".
+MISSING = object()
+
+# Seconds a change is kept in the invalidation log for other processes to pick
+# up. A process that hasn't looked for longer than this drops its memory tier.
+INVALIDATION_RETENTION = 3600
+# Old log entries are pruned once every this many writes.
+INVALIDATION_PRUNE_EVERY = 1000
+
+
+class SqliteCacheStore:
+    """
+    Optional on-disk tier for TTLCache. Entries are JSON-encoded and kept in a
+    single SQLite file so they survive restarts without any external service.
+    Several caches can share one file by using different namespaces.
+
+    The file can also be shared by several worker processes. Every write is
+    logged in cache_invalidations in the same transaction, and `invalidations`
+    returns the keys other processes changed since the last call, so each
+    process can drop stale copies from its memory tier.
+    """
+
+    def __init__(self, path: str, namespace: str):
+        self.path = path
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " origin TEXT NOT NULL,"
+            " changed_at REAL NOT NULL)"
+        )
+        self._origin = uuid.uuid4().hex
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations").fetchone()[0]
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._checked_at = time.time()
+        self._writes = 0
+
+    def get(self, key: str) -> Tuple[Any, float]:
+        """Returns (value, expires_at), or (MISSING, 0) if absent or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return MISSING, 0
+            if row[1] <= time.time():
+                self._conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                )
+                return MISSING, 0
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        self._write(
+            key,
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), expires_at),
+        )
+
+    def delete(self, key: str) -> None:
+        self._write(key, "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def _write(self, key: str, sql: str, params: tuple) -> None:
+        """Runs the change and logs it for other processes in one transaction."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(sql, params)
+                self._conn.execute(
+                    "INSERT INTO cache_invalidations (namespace, key, origin, changed_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, self._origin, now),
+                )
+                self._writes += 1
+                if self._writes % INVALIDATION_PRUNE_EVERY == 0:
+                    self._conn.execute("DELETE FROM cache_invalidations WHERE changed_at < ?", (now - INVALIDATION_RETENTION,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def invalidations(self) -> Optional[List[str]]:
+        """
+        Keys in this namespace that other connections changed since the last
+        call, or None if this process may have missed changes and should drop
+        everything it holds. Costs one PRAGMA when nothing was written.
+        """
+        now = time.time()
+        with self._lock:
+            stale = now - self._checked_at > INVALIDATION_RETENTION / 2
+            self._checked_at = now
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version and not stale:
+                return []
+            self._data_version = data_version
+            rows = self._conn.execute(
+                "SELECT seq, key, origin FROM cache_invalidations WHERE seq > ? AND namespace = ? ORDER BY seq",
+                (self._last_seq, self.namespace),
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1][0]
+        if stale:
+            return None
+        return [key for _, key, origin in rows if origin != self._origin]
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+                (self.namespace, time.time()),
+            )
+        return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache with a per-entry time-to-live and an optional
+    SQLite tier. Lookups check memory first, then disk; disk hits are promoted
+    back into memory. Values must be JSON-serializable when a disk tier is used.
+    When worker processes share the disk tier, each lookup first drops memory
+    entries another process has since replaced or deleted.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float, disk_path: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = SqliteCacheStore(disk_path, name) if disk_path else None
+        self._stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "evictions": 0}
+
+    def get(self, key: str) -> Any:
+        """Returns the cached value, or MISSING."""
+        if self._disk is not None:
+            self._apply_invalidations()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self._disk is not None:
+            value, expires_at = self._disk.get(key)
+            if value is not MISSING:
+                with self._lock:
+                    self._store(key, value, expires_at)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return MISSING
+
+    def peek(self, key: str) -> Tuple[Any, float]:
+        """
+        Returns (value, expires_at), or (MISSING, 0), without counting a lookup
+        or refreshing the entry's LRU position. For background maintenance.
+        """
+        if self._disk is not None:
+            self._apply_invalidations()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry
+        if self._disk is not None:
+            return self._disk.get(key)
+        return MISSING, 0
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self._disk is not None:
+            self._disk.set(key, value, expires_at)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _apply_invalidations(self) -> None:
+        keys = self._disk.invalidations()
+        with self._lock:
+            if keys is None:
+                self._entries.clear()
+            for key in keys or ():
+                self._entries.pop(key, None)
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        if self._disk is not None:
+            stats["disk_size"] = self._disk.count()
+        return stats
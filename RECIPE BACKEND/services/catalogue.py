@@ -0,0 +1,511 @@
+"""
+Read-only binary catalogue of recipes the service has already seen.
+
+The catalogue is compiled offline from the recipe index snapshot, the
+on-disk response cache and the image cache:
+
+    python -m services.catalogue [--output recipes.cat] [--fresh]
+
+and memory-mapped by every worker on startup, so several uvicorn workers
+share one copy in the page cache and opening it costs nothing however many
+recipes it holds. /recipes/recipe-details and /recipes/recommend answer
+catalogue hits without calling Gemini.
+
+Layout (little-endian): a fixed header, then six sections.
+  string offsets  u32[strings + 1] into the string data; string 0 is ""
+  string data     UTF-8 bytes of every distinct string, stored once
+  recipes         u32[recipes * RECORD_SIZE], sorted by normalized name
+  lists           u32 string ids (ingredient lines, steps) and term ids
+  terms           u32[terms * 3]: string id, first posting, posting count;
+                  sorted by term
+  postings        u32 recipe positions for each term
+"""
+import os
+import sys
+import mmap
+import math
+import time
+import json
+import struct
+import sqlite3
+import argparse
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from services.allergens import get_matcher, taxonomy_matcher
+from services.images import DEFAULT_IMAGE_URL
+from services.ingredients import ingredient_terms, normalize_name
+from services.recipe_index import (
+    BM25_B, BM25_K1, RECIPE_INDEX_MAX_RESULTS, RECIPE_INDEX_MIN_COVERAGE, RECIPE_INDEX_MIN_RESULTS,
+    IndexedRecipe, RecipeIndex,
+)
+
+# --- Catalogue Settings (overridable from the .env file) ---
+# Catalogue file memory-mapped on startup. Leave unset to serve without one.
+RECIPE_CATALOGUE_PATH = os.getenv("RECIPE_CATALOGUE_PATH") or None
+
+MAGIC = b"RCAT"
+FORMAT_VERSION = 1
+# magic, version, recipes, recipes with terms, terms, total terms, then (offset, length) of each section
+HEADER = struct.Struct("<4sIIIIQ" + "QQ" * 6)
+
+# Fields of one fixed-width recipe record; string fields hold string ids.
+(KEY, NAME, COOK_TIME, DIFFICULTY, IMAGE_URL, DESCRIPTION, SERVINGS, ALLERGENS,
+ INGREDIENTS, INGREDIENT_COUNT, STEPS, STEP_COUNT, TERMS, TERM_COUNT) = range(14)
+RECORD_SIZE = 14
+TERM_SIZE = 3
+
+
+class Catalogue:
+    """
+    A memory-mapped catalogue file. Lookups binary-search the sorted record
+    and term tables and decode only the strings they return, so nothing is
+    unpacked up front.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise ValueError("Recipe catalogues can only be memory-mapped on little-endian hosts.")
+        self.path = path
+        with open(path, "rb") as catalogue_file:
+            self._map = mmap.mmap(catalogue_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+        try:
+            header = HEADER.unpack_from(self._map)
+            magic, version, self.recipe_count, self.indexed_count, self.term_count, self.total_terms = header[:6]
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a recipe catalogue.")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"Unsupported recipe catalogue version: {version}")
+            sections = [self._section(offset, length) for offset, length in zip(header[6::2], header[7::2])]
+            self._string_offsets = self._cast(sections[0])
+            self._string_data = sections[1]
+            self._records = self._cast(sections[2])
+            self._lists = self._cast(sections[3])
+            self._terms = self._cast(sections[4])
+            self._postings = self._cast(sections[5])
+        except Exception:
+            self.close()
+            raise
+        self.hits = 0
+        self.misses = 0
+
+    def _section(self, offset: int, length: int) -> memoryview:
+        if offset + length > len(self._map):
+            raise ValueError(f"{self.path} is truncated.")
+        view = memoryview(self._map)[offset:offset + length]
+        self._views.append(view)
+        return view
+
+    def _cast(self, view: memoryview) -> memoryview:
+        cast = view.cast("I")
+        self._views.append(cast)
+        return cast
+
+    def close(self) -> None:
+        # Views into the map must be released before it can be closed
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __len__(self) -> int:
+        return self.recipe_count
+
+    def string(self, string_id: int) -> str:
+        return str(self._string_data[self._string_offsets[string_id]:self._string_offsets[string_id + 1]], "utf-8")
+
+    def _field(self, position: int, field: int) -> int:
+        return self._records[position * RECORD_SIZE + field]
+
+    def _list(self, position: int, start_field: int) -> memoryview:
+        start = self._field(position, start_field)
+        return self._lists[start:start + self._field(position, start_field + 1)]
+
+    def _strings(self, position: int, start_field: int) -> List[str]:
+        return [self.string(string_id) for string_id in self._list(position, start_field)]
+
+    def find(self, key: str) -> int:
+        """Position of the recipe with this normalized name, or -1."""
+        low, high = 0, self.recipe_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(self._field(middle, KEY)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.recipe_count and self.string(self._field(low, KEY)) == key:
+            return low
+        return -1
+
+    def _term_position(self, term: str) -> int:
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(self._terms[middle * TERM_SIZE]) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.string(self._terms[low * TERM_SIZE]) == term:
+            return low
+        return -1
+
+    def _term_ids(self, terms: Iterable[str]) -> Optional[Set[int]]:
+        """Term ids for a set of terms, or None if any of them is in no recipe."""
+        ids = set()
+        for term in terms:
+            term_id = self._term_position(term)
+            if term_id < 0:
+                return None
+            ids.add(term_id)
+        return ids
+
+    def recipe(self, position: int) -> IndexedRecipe:
+        terms = {self.string(self._terms[term_id * TERM_SIZE]) for term_id in self._list(position, TERMS)}
+        return IndexedRecipe(
+            self.string(self._field(position, NAME)), self.string(self._field(position, COOK_TIME)),
+            self.string(self._field(position, DIFFICULTY)), self.string(self._field(position, IMAGE_URL)),
+            terms, self._field(position, ALLERGENS),
+        )
+
+    def details(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Description, ingredients, instructions and servings for a recipe, in
+        the /recipe-details shape, or None unless the catalogue has all of them.
+        """
+        position = self.find(normalize_name(name or ""))
+        if position < 0 or not self._field(position, DESCRIPTION) or not self._field(position, STEP_COUNT):
+            return None
+        return {
+            "description": self.string(self._field(position, DESCRIPTION)),
+            "ingredients": self._strings(position, INGREDIENTS),
+            "instructions": self._strings(position, STEPS),
+            "servings": self.string(self._field(position, SERVINGS)),
+        }
+
+    def search(
+        self,
+        ingredients: List[str],
+        allergies: List[str] = (),
+        min_coverage: float = 0.0,
+        limit: int = RECIPE_INDEX_MAX_RESULTS,
+    ) -> List[IndexedRecipe]:
+        """The same BM25 ranking and allergen filtering as RecipeIndex.search, over the mapped tables."""
+        wanted_terms = [terms for terms in (set(ingredient_terms(ingredient)) for ingredient in ingredients) if terms]
+        if not wanted_terms or not self.indexed_count:
+            return []
+        # An ingredient with a term no recipe uses can't be covered; None keeps it in the denominator
+        wanted = [self._term_ids(terms) for terms in wanted_terms]
+        query_ids = {term_id for term_id in map(self._term_position, set().union(*wanted_terms)) if term_id >= 0}
+        if not query_ids:
+            return []
+        matcher = get_matcher(allergies)
+        avoided = [(set(terms), self._term_ids(terms)) for terms in matcher.custom_terms]
+
+        candidates: Set[int] = set()
+        for term_id in query_ids:
+            start, count = self._terms[term_id * TERM_SIZE + 1], self._terms[term_id * TERM_SIZE + 2]
+            candidates.update(self._postings[start:start + count])
+
+        average_length = self.total_terms / self.indexed_count
+        idf = {}
+        for term_id in query_ids:
+            df = self._terms[term_id * TERM_SIZE + 2]
+            idf[term_id] = math.log(1 + (self.indexed_count - df + 0.5) / (df + 0.5))
+        scored = []
+        for position in candidates:
+            recipe_ids = set(self._list(position, TERMS))
+            coverage = sum(1 for ids in wanted if ids is not None and ids <= recipe_ids) / len(wanted)
+            if coverage < min_coverage:
+                continue
+            if self._field(position, ALLERGENS) & matcher.category_mask:
+                continue
+            if avoided:
+                name_terms = set(ingredient_terms(self.string(self._field(position, NAME))))
+                if any((ids is not None and ids <= recipe_ids) or terms <= name_terms for terms, ids in avoided):
+                    continue
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(recipe_ids) / average_length)
+            score = sum(idf[term_id] * (BM25_K1 + 1) / (1 + length_norm) for term_id in query_ids & recipe_ids)
+            scored.append((score, position))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.recipe(position) for _, position in scored[:limit]]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Every recipe as CatalogueBuilder.add keyword arguments, for rebuilding."""
+        for position in range(self.recipe_count):
+            recipe = self.recipe(position)
+            yield {
+                "name": recipe.name, "cook_time": recipe.cook_time, "difficulty": recipe.difficulty,
+                "image_url": recipe.image_url, "description": self.string(self._field(position, DESCRIPTION)),
+                "ingredients": self._strings(position, INGREDIENTS), "instructions": self._strings(position, STEPS),
+                "servings": self.string(self._field(position, SERVINGS)),
+                "terms": recipe.terms, "allergens": recipe.allergens,
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "recipes": self.recipe_count,
+            "terms": self.term_count,
+            "bytes": len(self._map),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CatalogueBuilder:
+    """
+    Collects recipes from the service's stores and writes them as a
+    catalogue file. Adding a recipe again fills in or replaces its fields
+    with the non-empty ones given, so later sources refine earlier ones.
+    """
+
+    FIELDS = ("name", "cook_time", "difficulty", "image_url", "description", "ingredients", "instructions", "servings")
+
+    def __init__(self):
+        self.recipes: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.recipes)
+
+    def add(self, name: str, terms: Iterable[str] = (), allergens: int = 0, **fields: Any) -> None:
+        key = normalize_name(name or "")
+        if not key:
+            return
+        recipe = self.recipes.setdefault(key, {"name": name, "terms": set(), "allergens": 0})
+        for field in self.FIELDS[1:]:
+            value = fields.get(field)
+            if field in ("ingredients", "instructions"):
+                value = [value] if isinstance(value, str) else value or []
+                value = [item for item in value if isinstance(item, str) and item.strip()]
+            elif value is not None:
+                value = str(value)
+            if value:
+                recipe[field] = value
+        if terms:
+            recipe["terms"] = set(terms)
+            recipe["allergens"] = allergens
+
+    def update(self, key: str, **fields: Any) -> bool:
+        """Adds fields to a recipe already collected, by normalized name. Returns whether it was found."""
+        recipe = self.recipes.get(key)
+        if recipe is not None:
+            self.add(recipe["name"], **fields)
+        return recipe is not None
+
+    def _finish(self, recipe: Dict[str, Any]) -> None:
+        # Ingredient lines, when known, are the source of truth for terms and allergens
+        ingredients = recipe.get("ingredients") or []
+        if ingredients:
+            recipe["terms"] = {term for ingredient in ingredients for term in ingredient_terms(ingredient)}
+            recipe["allergens"] = taxonomy_matcher.scan([recipe["name"], *ingredients])
+
+    def write(self, path: str) -> int:
+        """
+        Writes the catalogue, replacing `path` atomically so workers that
+        already mapped the old file keep reading it. Recipes with neither
+        ingredient terms nor a description are left out. Returns the number written.
+        """
+        for recipe in self.recipes.values():
+            self._finish(recipe)
+        keys = sorted(key for key, recipe in self.recipes.items() if recipe["terms"] or recipe.get("description"))
+        vocabulary = sorted(set().union(*(self.recipes[key]["terms"] for key in keys)) if keys else ())
+        term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+
+        string_ids: Dict[str, int] = {}
+        string_offsets = array("I", [0])
+        string_data = bytearray()
+
+        def intern(text: str) -> int:
+            string_id = string_ids.get(text)
+            if string_id is None:
+                string_id = string_ids[text] = len(string_ids)
+                string_data.extend(text.encode("utf-8"))
+                string_offsets.append(len(string_data))
+            return string_id
+
+        intern("")
+        records = array("I")
+        lists = array("I")
+        postings: List[List[int]] = [[] for _ in vocabulary]
+        total_terms = indexed = 0
+        for position, key in enumerate(keys):
+            recipe = self.recipes[key]
+            ingredient_ids = [intern(line) for line in recipe.get("ingredients", [])]
+            step_ids = [intern(step) for step in recipe.get("instructions", [])]
+            recipe_terms = sorted(term_ids[term] for term in recipe["terms"])
+            for term_id in recipe_terms:
+                postings[term_id].append(position)
+            total_terms += len(recipe_terms)
+            indexed += bool(recipe_terms)
+            records.extend([
+                intern(key), intern(recipe["name"]), intern(recipe.get("cook_time", "")),
+                intern(recipe.get("difficulty", "")), intern(recipe.get("image_url", "")),
+                intern(recipe.get("description", "")), intern(recipe.get("servings", "")), recipe["allergens"],
+                len(lists), len(ingredient_ids), len(lists) + len(ingredient_ids), len(step_ids),
+                len(lists) + len(ingredient_ids) + len(step_ids), len(recipe_terms),
+            ])
+            lists.extend(ingredient_ids + step_ids + recipe_terms)
+
+        terms = array("I")
+        flat_postings = array("I")
+        for term, term_postings in zip(vocabulary, postings):
+            terms.extend([intern(term), len(flat_postings), len(term_postings)])
+            flat_postings.extend(term_postings)
+
+        sections = [string_offsets, bytes(string_data), records, lists, terms, flat_postings]
+        if sys.byteorder != "little":
+            for section in sections:
+                if isinstance(section, array):
+                    section.byteswap()
+        blobs = [section.tobytes() if isinstance(section, array) else section for section in sections]
+
+        offset = HEADER.size
+        layout = []
+        for blob in blobs:
+            offset += -offset % 8
+            layout += [offset, len(blob)]
+            offset += len(blob)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(keys), indexed, len(vocabulary), total_terms, *layout)
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as catalogue_file:
+            catalogue_file.write(header)
+            for blob, blob_offset in zip(blobs, layout[::2]):
+                catalogue_file.write(b"\0" * (blob_offset - catalogue_file.tell()))
+                catalogue_file.write(blob)
+        os.replace(temporary_path, path)
+        return len(keys)
+
+
+def _cache_entries(path: str, namespace: str) -> Iterator[tuple]:
+    """
+    (key, value) pairs from a cache SQLite tier, expired ones included:
+    recipes and image URLs don't go stale when their cache entry does.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for key, value in conn.execute("SELECT key, value FROM cache_entries WHERE namespace = ?", (namespace,)):
+            yield key, json.loads(value)
+    finally:
+        conn.close()
+
+
+def build(
+    output: str,
+    index_path: Optional[str] = None,
+    response_cache_path: Optional[str] = None,
+    image_cache_path: Optional[str] = None,
+    base_path: Optional[str] = None,
+) -> int:
+    """
+    Compiles a catalogue from, in order: an earlier catalogue, the recipe
+    index snapshot (names, display fields, ingredient terms), cached recipe
+    details and, for recipes showing the default image, cached image URLs.
+    Returns the number of recipes written.
+    """
+    builder = CatalogueBuilder()
+    if base_path:
+        base = Catalogue(base_path)
+        try:
+            for recipe in base:
+                builder.add(**recipe)
+        finally:
+            base.close()
+    if index_path:
+        index = RecipeIndex()
+        index.load(index_path)
+        for recipe in index.recipes.values():
+            builder.add(
+                recipe.name, terms=recipe.terms, allergens=recipe.allergens,
+                cook_time=recipe.cook_time, difficulty=recipe.difficulty, image_url=recipe.image_url,
+            )
+    if response_cache_path:
+        for key, details in _cache_entries(response_cache_path, "recipe_details"):
+            if isinstance(details, dict):
+                builder.update(key, **{field: details.get(field) for field in ("description", "ingredients", "instructions", "servings")})
+    if image_cache_path:
+        images = {key: url for key, url in _cache_entries(image_cache_path, "images") if url}
+        for recipe in builder.recipes.values():
+            if recipe.get("image_url", DEFAULT_IMAGE_URL) == DEFAULT_IMAGE_URL:
+                image_url = images.get(normalize_name(recipe["name"]))
+                if image_url:
+                    recipe["image_url"] = image_url
+    return builder.write(output)
+
+
+# --- Serving ---
+_catalogue: Optional[Catalogue] = None
+
+
+def details(name: str) -> Optional[Dict[str, Any]]:
+    """Catalogue answer for /recipe-details, or None."""
+    if _catalogue is None:
+        return None
+    found = _catalogue.details(name)
+    if found is None:
+        _catalogue.misses += 1
+    else:
+        _catalogue.hits += 1
+    return found
+
+
+def recommend(ingredients: List[str], allergies: List[str]) -> Optional[List[IndexedRecipe]]:
+    """Catalogue answer for /recommend, under the same thresholds as RecipeIndex.recommend, or None."""
+    if _catalogue is None:
+        return None
+    matches = _catalogue.search(ingredients, allergies, min_coverage=RECIPE_INDEX_MIN_COVERAGE)
+    if len(matches) < RECIPE_INDEX_MIN_RESULTS:
+        _catalogue.misses += 1
+        return None
+    _catalogue.hits += 1
+    return matches
+
+
+def startup() -> None:
+    """Maps RECIPE_CATALOGUE_PATH, if set and present. Called from the app's lifespan hook."""
+    global _catalogue
+    if RECIPE_CATALOGUE_PATH and os.path.exists(RECIPE_CATALOGUE_PATH):
+        try:
+            _catalogue = Catalogue(RECIPE_CATALOGUE_PATH)
+            print(f"Mapped {len(_catalogue)} recipes from the recipe catalogue.")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not open the recipe catalogue: {e}")
+
+
+def shutdown() -> None:
+    global _catalogue
+    if _catalogue is not None:
+        _catalogue.close()
+        _catalogue = None
+
+
+def stats() -> Dict[str, Any]:
+    return _catalogue.stats() if _catalogue is not None else {"recipes": 0}
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=os.getenv("RECIPE_CATALOGUE_PATH"), help="catalogue file to write (default: RECIPE_CATALOGUE_PATH)")
+    parser.add_argument("--index", default=os.getenv("RECIPE_INDEX_PATH"), help="recipe index snapshot (default: RECIPE_INDEX_PATH)")
+    parser.add_argument("--response-cache", default=os.getenv("RESPONSE_CACHE_PATH"), help="response cache SQLite file (default: RESPONSE_CACHE_PATH)")
+    parser.add_argument("--image-cache", default=os.getenv("IMAGE_CACHE_PATH"), help="image cache SQLite file (default: IMAGE_CACHE_PATH)")
+    parser.add_argument("--fresh", action="store_true", help="don't carry over recipes from the existing catalogue")
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("--output is required when RECIPE_CATALOGUE_PATH is not set")
+
+    base_path = args.output if not args.fresh and os.path.exists(args.output) else None
+    started = time.perf_counter()
+    count = build(args.output, args.index, args.response_cache, args.image_cache, base_path)
+    print(f"Wrote {count} recipes to {args.output} ({os.path.getsize(args.output)} bytes) "
+          f"in {time.perf_counter() - started:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
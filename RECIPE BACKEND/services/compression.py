@@ -0,0 +1,132 @@
+import os
+import gzip
+from typing import List, Optional, Tuple
+
+from services import metrics
+
+# Brotli is only offered when the optional `brotli` package is installed.
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# --- Compression Settings (overridable from the .env file) ---
+# Bodies smaller than this many bytes are sent as they are; below about a
+# kilobyte the headers and CPU cost outweigh what compression saves.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# gzip level 1-9 and brotli quality 0-11. The defaults favour speed, since
+# bodies are compressed on every request.
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 5))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The best encoding the client accepts: "br", then "gzip", or None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    with metrics.stage("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _add_vary(vary: Optional[bytes]) -> bytes:
+    """The Vary header value with Accept-Encoding added, unless it is already listed."""
+    if not vary:
+        return b"Accept-Encoding"
+    if b"accept-encoding" in (part.strip().lower() for part in vary.split(b",")):
+        return vary
+    return vary + b", Accept-Encoding"
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete JSON and text responses of at least
+    COMPRESSION_MIN_SIZE bytes with brotli or gzip, whichever the client
+    prefers. Streaming responses (NDJSON and server-sent events) are passed
+    through untouched, so each event still reaches the client as soon as it
+    is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = _header(scope["headers"], b"accept-encoding")
+        encoding = choose_encoding(accept_encoding.decode("latin-1")) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def _send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the response is complete
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            held, start = start, None
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not self._compressible(held, body):
+                await send(held)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            metrics.compression_input_bytes.inc(encoding, amount=len(body))
+            metrics.compression_output_bytes.inc(encoding, amount=len(compressed))
+            headers = [(key, value) for key, value in held["headers"] if key.lower() not in (b"content-length", b"vary")]
+            vary = _header(held["headers"], b"vary")
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", _add_vary(vary)),
+            ]
+            await send({**held, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, _send)
+
+    @staticmethod
+    def _compressible(start, body: bytes) -> bool:
+        if len(body) < COMPRESSION_MIN_SIZE or start["status"] in (204, 304):
+            return False
+        headers = start.get("headers", [])
+        if _header(headers, b"content-encoding") is not None:
+            return False
+        content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
@@ -0,0 +1,11 @@
+class UpstreamUnavailable(Exception):
+    """
+    An external provider can't be called right now. Routers turn this into an
+    HTTP error with `status_code` and a Retry-After header.
+    """
+    status_code = 503
+
+    def __init__(self, provider: str, retry_after: float, message: str):
+        super().__init__(message)
+        self.provider = provider
+        self.retry_after = retry_after
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+from services import http_client, metrics
+from services.singleflight import SingleFlight
+from services.ratelimit import get_limiter
+from services.breaker import OPEN, CircuitOpenError, get_breaker
+
+# --- Gemini Settings (overridable from the .env file) ---
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+# How long a call may queue for Gemini's rate budget before giving up with RateLimitExceeded.
+GEMINI_RATE_LIMIT_MAX_WAIT = float(os.getenv("GEMINI_RATE_LIMIT_MAX_WAIT", 20))
+
+# Gemini's breaker only trips on failures: callers pass their own timeout, because
+# latency depends heavily on how much they ask it to generate.
+gemini_breaker = get_breaker("gemini", min_timeout=1, max_timeout=60)
+
+# Identical prompts in flight at the same time share one Gemini call.
+gemini_flights = SingleFlight("gemini")
+
+
+def gemini_url(api_key: str, method: str = "generateContent") -> str:
+    return f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:{method}?key={api_key}"
+
+
+def extract_text(gemini_result: Dict[str, Any]) -> str:
+    """Pulls the generated text out of a generateContent response body."""
+    return gemini_result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+
+def _fail_fast_if_open() -> None:
+    """Skips queueing for rate budget when the circuit is open and not yet due a retry."""
+    if gemini_breaker.state == OPEN and gemini_breaker.retry_after() > 0:
+        raise CircuitOpenError("gemini", gemini_breaker.retry_after())
+
+
+def _request_body(prompt: str, generation_config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    data: Dict[str, Any] = {"contents": [{"parts": [{"text": prompt}]}]}
+    if generation_config:
+        data["generationConfig"] = generation_config
+    return data
+
+
+async def generate_content(
+    api_key: str,
+    prompt: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+    timeout: float = 60,
+) -> str:
+    """
+    Sends the prompt to Gemini and returns the generated text. Raises
+    httpx.HTTPError when the call fails, RateLimitExceeded when Gemini's
+    budget stays exhausted, or CircuitOpenError while Gemini is failing.
+    Concurrent identical requests are coalesced into a single upstream call,
+    which queues for the budget by request priority.
+    """
+    data = _request_body(prompt, generation_config)
+    flight_key = hashlib.sha256(json.dumps([GEMINI_MODEL, data], sort_keys=True).encode()).hexdigest()
+
+    async def _post(call_timeout: float) -> str:
+        response = await http_client.post(
+            gemini_url(api_key),
+            upstream="gemini",
+            headers={"Content-Type": "application/json"},
+            json=data,
+            timeout=call_timeout,
+        )
+        response.raise_for_status()
+        result = response.json()
+        metrics.record_gemini_usage(result.get("usageMetadata"))
+        return extract_text(result)
+
+    async def _call() -> str:
+        _fail_fast_if_open()
+        await get_limiter("gemini").acquire(max_wait=GEMINI_RATE_LIMIT_MAX_WAIT)
+        return await gemini_breaker.call(_post, timeout=timeout)
+
+    with metrics.stage("gemini"):
+        return await gemini_flights.do(flight_key, _call)
+
+
+async def stream_content(
+    api_key: str,
+    prompt: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+    timeout: float = 60,
+) -> AsyncIterator[str]:
+    """
+    Sends the prompt to Gemini's streaming endpoint and yields the generated
+    text chunk by chunk as it arrives. Raises the same errors as generate_content.
+    """
+    _fail_fast_if_open()
+    await get_limiter("gemini").acquire(max_wait=GEMINI_RATE_LIMIT_MAX_WAIT)
+    if not gemini_breaker.allow_request():
+        raise CircuitOpenError("gemini", gemini_breaker.retry_after())
+    started = time.monotonic()
+    try:
+        async for text in _stream_chunks(api_key, prompt, generation_config, timeout):
+            yield text
+    except (GeneratorExit, asyncio.CancelledError):
+        gemini_breaker.release()
+        raise
+    except Exception:
+        gemini_breaker.record_failure()
+        raise
+    gemini_breaker.record_success(time.monotonic() - started)
+
+
+async def _stream_chunks(
+    api_key: str,
+    prompt: str,
+    generation_config: Optional[Dict[str, Any]],
+    timeout: float,
+) -> AsyncIterator[str]:
+    async with http_client.stream(
+        "POST",
+        gemini_url(api_key, "streamGenerateContent") + "&alt=sse",
+        upstream="gemini",
+        headers={"Content-Type": "application/json"},
+        json=_request_body(prompt, generation_config),
+        timeout=timeout,
+    ) as response:
+        response.raise_for_status()
+        # Every chunk repeats the running usage totals, so only the last one is counted
+        usage = None
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = json.loads(line[len("data:"):])
+            usage = chunk.get("usageMetadata", usage)
+            text = extract_text(chunk)
+            if text:
+                yield text
+        metrics.record_gemini_usage(usage)
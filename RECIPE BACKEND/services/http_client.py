@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from services import metrics
+
+# HTTP/2 is only available when the optional `h2` package is installed.
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# --- Client Settings (overridable from the .env file) ---
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 200))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 50))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_PER_HOST_CONNECTIONS = int(os.getenv("HTTP_PER_HOST_CONNECTIONS", 32))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+
+# --- Module State ---
+# One pooled client for the lifetime of the app, created in main.py's lifespan.
+_client: Optional[httpx.AsyncClient] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=HTTP2_AVAILABLE)
+
+
+async def startup() -> None:
+    """Creates the shared client. Called once from the app's lifespan hook."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+
+
+async def shutdown() -> None:
+    """Closes the shared client and every pooled connection."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _host_slots.clear()
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client. Falls back to creating it lazily so routers
+    still work when the app is mounted without the lifespan hook (e.g. in scripts).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def _slot_for(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        slot = _host_slots[host] = asyncio.Semaphore(HTTP_PER_HOST_CONNECTIONS)
+    return slot
+
+
+@asynccontextmanager
+async def _measured(upstream: Optional[str], url: str) -> AsyncIterator[Dict[str, str]]:
+    """
+    Records one outbound call in the upstream metrics, labelled with the
+    provider name (or the host) and the status code, or the error's type
+    when no response arrived. The caller fills in "status".
+    """
+    upstream = upstream or urlsplit(url).netloc
+    outcome = {"status": "error"}
+    metrics.upstream_requests_in_flight.inc(upstream)
+    started = time.perf_counter()
+    try:
+        yield outcome
+    except Exception as e:
+        if outcome["status"] == "error":
+            outcome["status"] = type(e).__name__
+        raise
+    finally:
+        metrics.upstream_requests_in_flight.dec(upstream)
+        metrics.upstream_request_duration.observe(time.perf_counter() - started, upstream, outcome["status"])
+
+
+async def request(method: str, url: str, upstream: Optional[str] = None, **kwargs) -> httpx.Response:
+    """
+    Sends a request through the shared client, capped per host so one slow
+    upstream cannot take every pooled connection. `upstream` names the
+    provider in metrics and defaults to the URL's host.
+    """
+    async with _slot_for(url):
+        async with _measured(upstream, url) as outcome:
+            response = await get_client().request(method, url, **kwargs)
+            outcome["status"] = str(response.status_code)
+            return response
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, upstream: Optional[str] = None, **kwargs) -> AsyncIterator[httpx.Response]:
+    """
+    Streams a response through the shared client, holding a per-host slot
+    until the body is consumed. The call is measured until the stream closes.
+    """
+    async with _slot_for(url):
+        async with _measured(upstream, url) as outcome:
+            async with get_client().stream(method, url, **kwargs) as response:
+                outcome["status"] = str(response.status_code)
+                yield response
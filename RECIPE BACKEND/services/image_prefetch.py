@@ -0,0 +1,161 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from services import metrics
+from services.cache import MISSING
+from services.images import IMAGE_PROVIDERS, image_cache, image_keywords, refresh_image
+from services.ratelimit import PRIORITY_BULK, upstream_priority
+
+# --- Prefetch Settings (overridable from the .env file) ---
+IMAGE_PREFETCH_ENABLED = os.getenv("IMAGE_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Seconds between prefetch rounds.
+IMAGE_PREFETCH_INTERVAL = float(os.getenv("IMAGE_PREFETCH_INTERVAL", 30))
+# Most keywords resolved in one round; they are looked up one at a time.
+IMAGE_PREFETCH_BATCH = int(os.getenv("IMAGE_PREFETCH_BATCH", 10))
+# Only this many of the most popular keywords are kept warm.
+IMAGE_PREFETCH_TOP = int(os.getenv("IMAGE_PREFETCH_TOP", 500))
+# Cached images expiring within this many seconds are refreshed ahead of time.
+IMAGE_PREFETCH_REFRESH_AHEAD = float(os.getenv("IMAGE_PREFETCH_REFRESH_AHEAD", 24 * 3600))
+# A round only runs while at most this many API requests are being served...
+IMAGE_PREFETCH_MAX_IN_FLIGHT = int(os.getenv("IMAGE_PREFETCH_MAX_IN_FLIGHT", 2))
+# ...and every enabled provider has at least this share of its rate budget left.
+IMAGE_PREFETCH_MIN_BUDGET = float(os.getenv("IMAGE_PREFETCH_MIN_BUDGET", 0.5))
+# Gzipped snapshot of popular keywords and their images, loaded on startup to
+# warm the cache and saved on shutdown. Leave unset to start cold. With several
+# worker processes each tracks its own keywords, and the last one to shut down
+# writes the snapshot.
+IMAGE_PREFETCH_PATH = os.getenv("IMAGE_PREFETCH_PATH") or None
+
+SNAPSHOT_VERSION = 1
+
+_task: Optional[asyncio.Task] = None
+_stats = {"rounds": 0, "prefetched": 0, "skipped_busy": 0, "skipped_budget": 0, "warmed": 0}
+
+
+def _is_idle() -> bool:
+    return metrics.http_requests_in_flight.value() <= IMAGE_PREFETCH_MAX_IN_FLIGHT
+
+
+def _has_budget() -> bool:
+    """Leaves live traffic the bulk of every quota, including the smaller fallback ones."""
+    for provider in IMAGE_PROVIDERS:
+        limiter = provider.limiter
+        if provider.enabled and limiter is not None and limiter.available() < limiter.capacity * IMAGE_PREFETCH_MIN_BUDGET:
+            return False
+    return True
+
+
+def due_keywords(limit: int) -> List[str]:
+    """
+    Popular keywords, most popular first, whose image isn't cached or expires
+    within IMAGE_PREFETCH_REFRESH_AHEAD. Cached "no image found" answers are
+    left to expire, so keywords without images aren't searched every round.
+    """
+    refresh_before = time.time() + IMAGE_PREFETCH_REFRESH_AHEAD
+    due = []
+    for keyword, _ in image_keywords.top(IMAGE_PREFETCH_TOP):
+        value, expires_at = image_cache.peek(keyword)
+        if value is MISSING or (value is not None and expires_at < refresh_before):
+            due.append(keyword)
+            if len(due) >= limit:
+                break
+    return due
+
+
+async def prefetch_round(limit: int = IMAGE_PREFETCH_BATCH) -> int:
+    """
+    Resolves up to `limit` due keywords, one at a time, stopping as soon as
+    the API gets busy or a provider's budget runs low. Returns how many were resolved.
+    """
+    _stats["rounds"] += 1
+    prefetched = 0
+    for keyword in due_keywords(limit):
+        if not _is_idle():
+            _stats["skipped_busy"] += 1
+            break
+        if not _has_budget():
+            _stats["skipped_budget"] += 1
+            break
+        await refresh_image(keyword)
+        prefetched += 1
+    _stats["prefetched"] += prefetched
+    return prefetched
+
+
+async def _run() -> None:
+    # Prefetching is bulk work: it never takes the share of a budget reserved for live requests
+    upstream_priority.set(PRIORITY_BULK)
+    while True:
+        await asyncio.sleep(IMAGE_PREFETCH_INTERVAL)
+        try:
+            await prefetch_round()
+        except Exception as e:
+            print(f"Image prefetch round failed: {e}")
+
+
+def save_snapshot(path: str, count: int = IMAGE_PREFETCH_TOP) -> None:
+    """
+    Writes the `count` most popular keywords with their decayed counts and
+    cached images (URL and expiry) as gzipped JSON, replaced atomically.
+    """
+    entries = []
+    for keyword, score in image_keywords.top(count):
+        value, expires_at = image_cache.peek(keyword)
+        entries.append([keyword, score] + ([value, expires_at] if value is not MISSING else []))
+    snapshot = {"version": SNAPSHOT_VERSION, "saved_at": time.time(), "keywords": entries}
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path: str) -> int:
+    """
+    Restores keyword popularity from a snapshot and puts every image that
+    hasn't expired back in the cache. Returns how many images were warmed.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported image prefetch snapshot version: {snapshot.get('version')}")
+
+    image_keywords.load(((entry[0], entry[1]) for entry in snapshot["keywords"]), at=snapshot["saved_at"])
+    now = time.time()
+    warmed = 0
+    for entry in snapshot["keywords"]:
+        if len(entry) == 4 and entry[3] > now:
+            image_cache.set(entry[0], entry[2], ttl=entry[3] - now)
+            warmed += 1
+    _stats["warmed"] += warmed
+    return warmed
+
+
+def startup() -> None:
+    """Warms the image cache from IMAGE_PREFETCH_PATH and starts prefetching. Called from the app's lifespan hook."""
+    global _task
+    if IMAGE_PREFETCH_PATH and os.path.exists(IMAGE_PREFETCH_PATH):
+        try:
+            print(f"Warmed {load_snapshot(IMAGE_PREFETCH_PATH)} images from the prefetch snapshot.")
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"Could not load the image prefetch snapshot: {e}")
+    if IMAGE_PREFETCH_ENABLED and (_task is None or _task.done()):
+        _task = asyncio.create_task(_run(), name="image-prefetch")
+
+
+async def shutdown() -> None:
+    """Stops prefetching and saves the snapshot to IMAGE_PREFETCH_PATH, if set."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+    if IMAGE_PREFETCH_PATH:
+        save_snapshot(IMAGE_PREFETCH_PATH)
+
+
+def stats() -> Dict[str, Any]:
+    return {**_stats, "tracked_keywords": len(image_keywords)}
@@ -0,0 +1,318 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import http_client, metrics
+from services.cache import MISSING, TTLCache
+from services.singleflight import SingleFlight
+from services import ratelimit
+from services.breaker import CLOSED, CircuitBreaker, get_breaker
+from services.popularity import PopularityTracker
+from services.ingredients import normalize_name
+
+# Default image URL if no image can be found
+DEFAULT_IMAGE_URL = "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=800&q=80"
+
+# --- Fan-out Settings (overridable from the .env file) ---
+# How many keyword lookups may run at the same time for one request.
+IMAGE_FANOUT_LIMIT = int(os.getenv("IMAGE_FANOUT_LIMIT", 8))
+# Total time budget, in seconds, for resolving every image of one request.
+IMAGE_DEADLINE_SECONDS = float(os.getenv("IMAGE_DEADLINE_SECONDS", 8))
+
+# --- Provider Settings (overridable from the .env file) ---
+# Per-provider request timeout bounds, in seconds. Within them the timeout adapts
+# to each provider's observed latency (see services/breaker.py).
+IMAGE_PROVIDER_TIMEOUT = float(os.getenv("IMAGE_PROVIDER_TIMEOUT", 5))
+IMAGE_PROVIDER_MIN_TIMEOUT = float(os.getenv("IMAGE_PROVIDER_MIN_TIMEOUT", 1))
+# Keyword used to check whether an unhealthy provider has recovered.
+IMAGE_PROBE_KEYWORD = os.getenv("IMAGE_PROBE_KEYWORD", "food")
+# How long a provider gets on its own before the next one is fired alongside it.
+# Set to 0 to race every provider at once.
+IMAGE_HEDGE_DELAY = float(os.getenv("IMAGE_HEDGE_DELAY", 0.3))
+
+# --- Cache Settings (overridable from the .env file) ---
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 4096))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", 7 * 24 * 3600))
+# How long a "no image found" answer is remembered before the providers are asked again.
+IMAGE_NEGATIVE_CACHE_TTL = float(os.getenv("IMAGE_NEGATIVE_CACHE_TTL", 3600))
+# SQLite file for the on-disk tier. Leave unset to keep the cache in memory only.
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH") or None
+
+# Provider endpoints, overridable to point at stand-in servers (see benchmarks/).
+PIXABAY_BASE_URL = os.getenv("PIXABAY_BASE_URL", "https://pixabay.com/api")
+PEXELS_BASE_URL = os.getenv("PEXELS_BASE_URL", "https://api.pexels.com/v1")
+UNSPLASH_BASE_URL = os.getenv("UNSPLASH_BASE_URL", "https://api.unsplash.com")
+
+# --- Popularity Settings (overridable from the .env file) ---
+# A keyword's lookups count half as much after this many seconds.
+IMAGE_KEYWORD_HALF_LIFE = float(os.getenv("IMAGE_KEYWORD_HALF_LIFE", 24 * 3600))
+IMAGE_KEYWORDS_TRACKED = int(os.getenv("IMAGE_KEYWORDS_TRACKED", 5000))
+
+# Keyword -> image URL (or None when no provider had a result).
+image_cache = TTLCache("images", IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL, disk_path=IMAGE_CACHE_PATH)
+# Concurrent cache misses for the same keyword share one provider search.
+image_flights = SingleFlight("images")
+# How often and how recently each normalized keyword is looked up, for prefetching.
+image_keywords = PopularityTracker("image_keywords", IMAGE_KEYWORD_HALF_LIFE, IMAGE_KEYWORDS_TRACKED)
+
+
+# --- Image Providers ---
+class ImageProvider:
+    """
+    Base class for an image search backend. Subclasses implement `search`,
+    which returns an image URL for the keyword or None when nothing was found,
+    and raises when the provider itself failed. Calls go through `guarded_search`,
+    which applies the provider's circuit breaker and adaptive timeout.
+    """
+    name = "provider"
+    api_key_env = ""
+
+    @property
+    def limiter(self) -> Optional[ratelimit.TokenBucket]:
+        return ratelimit.get_limiter(self.name)
+
+    def has_budget(self) -> bool:
+        """Takes one call from this provider's rate budget, if it has any left."""
+        limiter = self.limiter
+        return limiter is None or limiter.try_acquire()
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv(self.api_key_env)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return get_breaker(self.name, IMAGE_PROVIDER_MIN_TIMEOUT, IMAGE_PROVIDER_TIMEOUT, probe=self._probe)
+
+    def is_healthy(self) -> bool:
+        return self.breaker.state == CLOSED
+
+    async def _probe(self) -> None:
+        if not self.has_budget():
+            raise ratelimit.RateLimitExceeded(self.name, 0)
+        await self.search(IMAGE_PROBE_KEYWORD, IMAGE_PROVIDER_TIMEOUT)
+
+    async def guarded_search(self, keyword: str) -> Optional[str]:
+        return await self.breaker.call(lambda timeout: self.search(keyword, timeout))
+
+    async def search(self, keyword: str, timeout: float = IMAGE_PROVIDER_TIMEOUT) -> Optional[str]:
+        raise NotImplementedError
+
+
+class PixabayProvider(ImageProvider):
+    name = "pixabay"
+    api_key_env = "PIXABAY_API_KEY"
+
+    async def search(self, keyword: str, timeout: float = IMAGE_PROVIDER_TIMEOUT) -> Optional[str]:
+        params = {"key": self.api_key, "q": keyword, "image_type": "photo", "safesearch": "true", "order": "popular", "per_page": 3}
+        response = await http_client.get(f"{PIXABAY_BASE_URL}/", upstream=self.name, params=params, timeout=timeout)
+        response.raise_for_status()
+        hits = response.json().get("hits", [])
+        return hits[0].get("webformatURL") if hits else None
+
+
+class PexelsProvider(ImageProvider):
+    name = "pexels"
+    api_key_env = "PEXELS_API_KEY"
+
+    async def search(self, keyword: str, timeout: float = IMAGE_PROVIDER_TIMEOUT) -> Optional[str]:
+        headers = {"Authorization": self.api_key}
+        params = {"query": keyword, "per_page": 1}
+        response = await http_client.get(f"{PEXELS_BASE_URL}/search", upstream=self.name, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()
+        photos = response.json().get("photos", [])
+        return photos[0].get("src", {}).get("large") if photos else None
+
+
+class UnsplashProvider(ImageProvider):
+    name = "unsplash"
+    api_key_env = "UNSPLASH_ACCESS_KEY"
+
+    async def search(self, keyword: str, timeout: float = IMAGE_PROVIDER_TIMEOUT) -> Optional[str]:
+        headers = {"Authorization": f"Client-ID {self.api_key}"}
+        params = {"query": keyword, "per_page": 1}
+        response = await http_client.get(f"{UNSPLASH_BASE_URL}/search/photos", upstream=self.name, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()
+        results = response.json().get("results", [])
+        return results[0].get("urls", {}).get("regular") if results else None
+
+
+# Providers in order of preference. Extra providers can be added with register_provider().
+IMAGE_PROVIDERS: List[ImageProvider] = [PixabayProvider(), PexelsProvider(), UnsplashProvider()]
+
+
+def register_provider(provider: ImageProvider, rank: Optional[int] = None) -> None:
+    """Adds an image provider at the given rank (0 is most preferred), or last."""
+    if rank is None:
+        IMAGE_PROVIDERS.append(provider)
+    else:
+        IMAGE_PROVIDERS.insert(rank, provider)
+
+
+async def find_image(
+    keyword: str,
+    providers: Optional[List[ImageProvider]] = None,
+    hedge_delay: Optional[float] = None,
+) -> str:
+    """
+    Returns an image URL for the keyword, served from the image cache when
+    possible. On a miss the providers are queried with _search_providers and
+    the answer is cached; concurrent misses for the same keyword share that
+    one search. Falls back to DEFAULT_IMAGE_URL. Every lookup counts towards
+    the keyword's popularity in image_keywords.
+    """
+    cache_key = normalize_name(keyword)
+    if providers is not None or not cache_key:
+        image_url, _ = await _search_providers(keyword, providers or IMAGE_PROVIDERS, hedge_delay)
+        return image_url or DEFAULT_IMAGE_URL
+
+    image_keywords.record(cache_key)
+    cached = image_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached or DEFAULT_IMAGE_URL
+
+    image_url = await image_flights.do(cache_key, lambda: _search_and_cache(keyword, cache_key, hedge_delay))
+    return image_url or DEFAULT_IMAGE_URL
+
+
+async def refresh_image(keyword: str) -> Optional[str]:
+    """
+    Searches the providers and re-caches the answer even when a cached one
+    hasn't expired yet. Shares the search with any live lookup of the same
+    keyword. Used by the prefetcher.
+    """
+    cache_key = normalize_name(keyword)
+    return await image_flights.do(cache_key, lambda: _search_and_cache(keyword, cache_key, None))
+
+
+async def _search_and_cache(keyword: str, cache_key: str, hedge_delay: Optional[float]) -> Optional[str]:
+    """
+    Searches the providers and caches the answer. "No image found" is cached
+    for a shorter time, but only when every provider actually answered rather
+    than erroring out.
+    """
+    image_url, had_errors = await _search_providers(keyword, IMAGE_PROVIDERS, hedge_delay)
+    if image_url:
+        image_cache.set(cache_key, image_url)
+    elif not had_errors:
+        image_cache.set(cache_key, None, ttl=IMAGE_NEGATIVE_CACHE_TTL)
+    return image_url
+
+
+async def _search_providers(
+    keyword: str,
+    providers: List[ImageProvider],
+    hedge_delay: Optional[float] = None,
+) -> Tuple[Optional[str], bool]:
+    """
+    Searches the providers using hedged requests and returns (url, had_errors).
+
+    The top-ranked provider starts first. Each following provider is fired
+    once the previous one fails or `hedge_delay` passes without an answer, so
+    a slow provider never holds up the others. The first successful answer
+    wins (the best-ranked one when several finish together) and every request
+    still in flight is cancelled. Providers whose circuit is open or whose
+    rate budget is exhausted are skipped instantly rather than waited on.
+    """
+    candidates = [provider for provider in providers if provider.enabled]
+    delay = IMAGE_HEDGE_DELAY if hedge_delay is None else hedge_delay
+
+    ranks: Dict[asyncio.Task, int] = {}
+    pending = set()
+    next_rank = 0
+    had_errors = False
+
+    def _launch_next() -> None:
+        nonlocal next_rank, had_errors
+        while next_rank < len(candidates):
+            rank = next_rank
+            next_rank += 1
+            provider = candidates[rank]
+            if provider.is_healthy() and provider.has_budget():
+                task = asyncio.create_task(provider.guarded_search(keyword))
+                ranks[task] = rank
+                pending.add(task)
+                return
+            # Unhealthy or out of quota: route around this provider, and don't cache the miss.
+            had_errors = True
+
+    try:
+        _launch_next()
+        while pending:
+            has_more = next_rank < len(candidates)
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=delay if has_more else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                # Hedge delay elapsed without an answer: fire the next provider too.
+                _launch_next()
+                continue
+
+            pending.difference_update(done)
+            for task in sorted(done, key=ranks.get):
+                if task.exception() is not None:
+                    had_errors = True
+                elif task.result():
+                    metrics.image_searches.inc(candidates[ranks[task]].name)
+                    return task.result(), had_errors
+
+            # Every finished provider failed; try the next one straight away.
+            if has_more:
+                _launch_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    metrics.image_searches.inc("default")
+    return None, had_errors
+
+
+async def resolve_images(
+    keywords: List[str],
+    lookup: Optional[Callable[[str], Awaitable[str]]] = None,
+    limit: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> List[str]:
+    """
+    Resolves an image URL for every keyword concurrently and returns them in
+    the same order. `lookup` defaults to find_image. At most `limit` lookups run at once, identical keywords are
+    looked up only once, and any lookup that fails or is still pending when the
+    `deadline` expires falls back to DEFAULT_IMAGE_URL.
+    """
+    if not keywords:
+        return []
+
+    lookup = lookup or find_image
+    semaphore = asyncio.Semaphore(limit or IMAGE_FANOUT_LIMIT)
+
+    async def _lookup_one(keyword: str) -> str:
+        async with semaphore:
+            try:
+                return await lookup(keyword) or DEFAULT_IMAGE_URL
+            except Exception:
+                metrics.image_fallbacks.inc("error")
+                return DEFAULT_IMAGE_URL
+
+    tasks: Dict[str, asyncio.Task] = {}
+    for keyword in keywords:
+        if keyword not in tasks:
+            tasks[keyword] = asyncio.create_task(_lookup_one(keyword))
+
+    timeout = IMAGE_DEADLINE_SECONDS if deadline is None else deadline
+    with metrics.stage("images"):
+        _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        metrics.image_fallbacks.inc("deadline", amount=len(pending))
+
+    return [
+        DEFAULT_IMAGE_URL if task in pending else task.result()
+        for task in (tasks[keyword] for keyword in keywords)
+    ]
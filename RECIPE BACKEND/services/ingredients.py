@@ -0,0 +1,72 @@
+import re
+from typing import Iterable, List
+
+# Plurals the suffix rules below would get wrong.
+IRREGULAR_PLURALS = {
+    "leaves": "leaf",
+    "loaves": "loaf",
+    "halves": "half",
+    "knives": "knife",
+    "geese": "goose",
+    "mice": "mouse",
+    "teeth": "tooth",
+    "feet": "foot",
+}
+
+# Words that end in "s" but are not plurals.
+SINGULAR_S_WORDS = {"molasses", "brussels", "grits", "oats", "series", "species", "hummus"}
+
+# Quantities, units and preparation words in generated ingredient lines
+# ("2 cups chopped onions") that say nothing about what the ingredient is.
+MEASUREMENT_WORDS = {
+    "cup", "tablespoon", "tbsp", "teaspoon", "tsp", "g", "gram", "kg", "kilogram", "ml", "l", "liter",
+    "litre", "oz", "ounce", "lb", "pound", "pinch", "dash", "handful", "clove", "slice", "piece", "can",
+    "jar", "package", "bunch", "sprig", "stalk", "large", "medium", "small", "whole", "fresh", "chopped",
+    "minced", "diced", "sliced", "grated", "shredded", "peeled", "cooked", "optional", "to", "taste",
+    "of", "and", "or", "for", "a", "an", "the", "about", "plus", "more", "extra", "serving",
+}
+
+
+def singularize(word: str) -> str:
+    """Turns a plural English food word into its singular form ("tomatoes" -> "tomato")."""
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word in SINGULAR_S_WORDS or len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_name(text: str) -> str:
+    """
+    Lower-cases the text and collapses punctuation and whitespace, so
+    "Chicken  Stir-Fry!" and "chicken stir fry" compare equal.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def normalize_ingredient(ingredient: str) -> str:
+    """Normalizes an ingredient name: lower-cased, punctuation-free and singular."""
+    return " ".join(singularize(word) for word in normalize_name(ingredient).split())
+
+
+def canonical_ingredients(ingredients: Iterable[str]) -> List[str]:
+    """Normalized, de-duplicated and sorted ingredient list, so order and casing don't matter."""
+    return sorted({normalized for normalized in map(normalize_ingredient, ingredients) if normalized})
+
+
+def ingredient_terms(ingredient: str) -> List[str]:
+    """
+    Words that identify an ingredient line, without quantities, units or
+    preparation notes: "3 cloves garlic, minced" -> ["garlic"].
+    """
+    name = re.split(r"[,(]", ingredient, maxsplit=1)[0]
+    words = normalize_ingredient(name).split()
+    return [word for word in words if word not in MEASUREMENT_WORDS and not word[0].isdigit()]
@@ -0,0 +1,427 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# --- Job Settings (overridable from the .env file) ---
+# How long a finished job's status and result stay available for polling, in seconds.
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 900))
+# A repeat submission this soon after an identical job succeeded gets that job back
+# instead of a new one. Off by default, so asking again for a plan gives a new plan;
+# repeats arriving while the job is still queued or running always attach to it, and
+# idempotent submissions (with a client key) reuse a succeeded job while it is kept.
+JOB_DEDUP_WINDOW = float(os.getenv("JOB_DEDUP_WINDOW", 0))
+# Finished jobs kept at most, oldest dropped first, whatever their age.
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", 1000))
+# SQLite file every job's status is mirrored to, so any worker process can
+# answer polls for a job another one is running. Leave unset with one worker.
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH") or None
+# How often a poller following another worker's job re-reads it, in seconds.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.25))
+# An unfinished job in the shared store that has not changed for this many
+# seconds is no longer reused by other workers, e.g. because the worker running
+# it crashed. Running jobs change with every partial result.
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 300))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobError(Exception):
+    """Raised by a job function to fail the job with an HTTP status and detail for pollers."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class JobQueueFull(Exception):
+    """Raised by submit when the queue already holds its maximum of waiting jobs."""
+
+
+class Job:
+    """
+    One unit of background work. The job function may `publish` partial
+    results while it runs; every change bumps `version` and wakes anyone in
+    `wait_for_change`, so pollers and subscribers never miss an update.
+    """
+
+    def __init__(self, fingerprint: str, fn: Callable[["Job"], Awaitable[Any]]):
+        self.id = uuid.uuid4().hex
+        self.fingerprint = fingerprint
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.partial: List[Any] = []
+        self.result: Any = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.attached = 0
+        self.version = 0
+        self._fn: Optional[Callable[["Job"], Awaitable[Any]]] = fn
+        self._changed = asyncio.Event()
+        self._store: Optional["SqliteJobStore"] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def publish(self, item: Any) -> None:
+        """Adds a partial result that pollers can pick up before the job finishes."""
+        self.partial.append(item)
+        self._notify()
+
+    def _notify(self) -> None:
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if self._store is not None:
+            self._store.put(self)
+
+    def _start(self) -> None:
+        self.status = RUNNING
+        self.started_at = time.time()
+        self._notify()
+
+    def _succeed(self, result: Any) -> None:
+        self.status = SUCCEEDED
+        self.result = result
+        self.finished_at = time.time()
+        self._fn = None
+        self._notify()
+
+    def _fail(self, status_code: int, detail: str, retry_after: Optional[float] = None) -> None:
+        self.status = FAILED
+        self.error = {"status_code": status_code, "detail": detail, "retry_after": retry_after}
+        self.finished_at = time.time()
+        self._fn = None
+        self._notify()
+
+    async def wait_for_change(self, version: int, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the job has changed since `version`, or `timeout` passes.
+        Returns whether it changed.
+        """
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait(self) -> "Job":
+        """Waits for the job to finish. Cancelling the wait does not cancel the job."""
+        while not self.done:
+            await self.wait_for_change(self.version)
+        return self
+
+    def to_dict(self, after: int = 0) -> Dict[str, Any]:
+        """Status for pollers, with the partial results published after the first `after`."""
+        status = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "partial_count": len(self.partial),
+            "partial": self.partial[after:],
+        }
+        if self.status == SUCCEEDED:
+            status["result"] = self.result
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class SqliteJobStore:
+    """
+    Latest status of every job, in a SQLite file (WAL mode) shared by the
+    worker processes. The worker running a job writes it on every change;
+    the others only read it. Several queues can share one file by name.
+    Submissions are de-duplicated across workers with `claim`.
+    """
+
+    def __init__(self, path: str, namespace: str):
+        self.path = path
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if columns and "fingerprint" not in columns:
+            # Statuses are short-lived, so a table from before fingerprints were stored is just recreated
+            self._conn.execute("DROP TABLE jobs")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " namespace TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " PRIMARY KEY (namespace, id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (namespace, fingerprint)")
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            self._put(job)
+
+    def _put(self, job: Job) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs (namespace, id, fingerprint, status, version, data, updated_at, finished_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.namespace, job.id, job.fingerprint, job.status, job.version,
+             json.dumps(job.to_dict(), separators=(",", ":")), time.time(), job.finished_at),
+        )
+
+    def claim(self, job: Job, reuse_window: float, create: bool = True) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        (version, status) of a reusable job with the same fingerprint, from
+        any worker: unfinished and changed within JOB_STALE_AFTER, or
+        succeeded within the last `reuse_window` seconds. Otherwise stores
+        `job`, unless `create` is false, and returns None. Both happen in one
+        transaction, so two workers never both create a job for the same fingerprint.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT version, data FROM jobs WHERE namespace = ? AND fingerprint = ?"
+                    " AND ((finished_at IS NULL AND updated_at > ?) OR (status = ? AND finished_at > ?))"
+                    " ORDER BY updated_at DESC LIMIT 1",
+                    (self.namespace, job.fingerprint, now - JOB_STALE_AFTER, SUCCEEDED, now - reuse_window),
+                ).fetchone()
+                if row is None and create:
+                    self._put(job)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def get(self, job_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(version, status) as written by `put`, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, data FROM jobs WHERE namespace = ? AND id = ?", (self.namespace, job_id)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def purge(self, finished_before: float) -> int:
+        """Deletes jobs finished before `finished_before`, and unfinished ones abandoned since then."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE namespace = ? AND COALESCE(finished_at, updated_at) < ?",
+                (self.namespace, finished_before),
+            )
+        return cursor.rowcount
+
+
+class SharedJob(Job):
+    """
+    A job another worker process is running, read from the shared job store.
+    Pollers use it like a local Job; `wait_for_change` re-reads the store
+    every JOB_POLL_INTERVAL instead of being woken.
+    """
+
+    def __init__(self, store: SqliteJobStore, version: int, status: Dict[str, Any]):
+        self._store_reader = store
+        self.fingerprint = ""
+        self.attached = 0
+        self._fn = None
+        self._store = None
+        self._load(version, status)
+
+    def _load(self, version: int, status: Dict[str, Any]) -> None:
+        self.id = status["job_id"]
+        self.status = status["status"]
+        self.created_at = status["created_at"]
+        self.started_at = status["started_at"]
+        self.finished_at = status["finished_at"]
+        self.partial = status["partial"]
+        self.result = status.get("result")
+        self.error = status.get("error")
+        self.version = version
+
+    async def wait_for_change(self, version: int, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.version == version:
+            remaining = JOB_POLL_INTERVAL if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+            row = self._store_reader.get(self.id)
+            if row is None:
+                # Purged by its worker; report it rather than poll forever
+                self.status = FAILED
+                self.error = {"status_code": 404, "detail": "The job expired before it was read.", "retry_after": None}
+                self.version += 1
+            else:
+                self._load(*row)
+        return True
+
+
+class JobQueue:
+    """
+    In-process job queue worked by a fixed pool of asyncio workers, so no
+    external broker is needed. Jobs are de-duplicated by fingerprint: a
+    submission matching a queued or running job, or one that succeeded within
+    JOB_DEDUP_WINDOW, attaches to it instead of starting another. An
+    idempotent submission, whose fingerprint includes a client-chosen key,
+    also reuses a succeeded job for as long as it is kept. Finished jobs are
+    kept for JOB_RESULT_TTL. Workers start with the first submission.
+
+    With a store path, every job's status is also mirrored to SQLite, so
+    `get` finds jobs submitted to other worker processes too, and a
+    submission attaches to an equivalent job another process is running.
+    Each process runs only the jobs submitted to it.
+    """
+
+    # Seconds between purges of the shared store.
+    STORE_PURGE_INTERVAL = 60
+
+    def __init__(self, name: str, workers: int, max_queued: int, store_path: Optional[str] = JOB_STORE_PATH):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self._store = SqliteJobStore(store_path, name) if store_path else None
+        self._store_purged_at = 0.0
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._by_fingerprint: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "rejected": 0}
+
+    def submit(self, fingerprint: str, fn: Callable[[Job], Awaitable[Any]], idempotent: bool = False) -> Tuple[Job, bool]:
+        """
+        Queues `fn(job)` unless an equivalent job can be reused. Returns the
+        job and whether it was newly created. Raises JobQueueFull.
+        """
+        self._purge()
+        reuse_window = JOB_RESULT_TTL if idempotent else JOB_DEDUP_WINDOW
+        existing = self._by_fingerprint.get(fingerprint)
+        if existing is not None and self._reusable(existing, reuse_window):
+            existing.attached += 1
+            self._stats["deduplicated"] += 1
+            return existing, False
+
+        self._ensure_workers()
+        full = self._queue.qsize() >= self.max_queued
+        job = Job(fingerprint, fn)
+        if self._store is not None:
+            # Another worker process may already be running the same job
+            row = self._store.claim(job, reuse_window, create=not full)
+            if row is not None:
+                existing = self._jobs.get(row[1]["job_id"]) or SharedJob(self._store, *row)
+                existing.attached += 1
+                self._stats["deduplicated"] += 1
+                return existing, False
+        if full:
+            self._stats["rejected"] += 1
+            raise JobQueueFull(f"The {self.name} queue is full; try again shortly.")
+        if self._store is not None:
+            job._store = self._store
+        self._jobs[job.id] = job
+        self._by_fingerprint[fingerprint] = job
+        self._queue.put_nowait(job)
+        self._stats["submitted"] += 1
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            row = self._store.get(job_id)
+            if row is not None:
+                return SharedJob(self._store, *row)
+        return job
+
+    @staticmethod
+    def _reusable(job: Job, reuse_window: float) -> bool:
+        if not job.done:
+            return True
+        return job.status == SUCCEEDED and time.time() - job.finished_at < reuse_window
+
+    def _purge(self) -> None:
+        """
+        Drops finished jobs past JOB_RESULT_TTL or beyond JOB_MAX_RETAINED,
+        oldest first. Stops at the oldest unfinished job, which is at most
+        one job's run time behind.
+        """
+        now = time.time()
+        expires_before = now - JOB_RESULT_TTL
+        if self._store is not None and now - self._store_purged_at > self.STORE_PURGE_INTERVAL:
+            self._store_purged_at = now
+            self._store.purge(expires_before)
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if not job.done or (job.finished_at > expires_before and len(self._jobs) <= JOB_MAX_RETAINED):
+                break
+            del self._jobs[job.id]
+            if self._by_fingerprint.get(job.fingerprint) is job:
+                del self._by_fingerprint[job.fingerprint]
+
+    def _ensure_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"{self.name}-worker-{index}")
+            for index in range(self.workers)
+        ]
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        job._start()
+        try:
+            job._succeed(await job._fn(job))
+            self._stats["succeeded"] += 1
+        except asyncio.CancelledError:
+            job._fail(503, "The server shut down before the job finished; submit it again.")
+            raise
+        except JobError as e:
+            job._fail(e.status_code, e.detail, e.retry_after)
+            self._stats["failed"] += 1
+        except Exception as e:
+            job._fail(500, f"An unexpected error occurred: {e}")
+            self._stats["failed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["running"] = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+        stats["retained"] = len(self._jobs)
+        return stats
+
+    async def shutdown(self) -> None:
+        """Stops the workers. Jobs still queued or running fail with a 503 so pollers stop waiting."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for job in self._jobs.values():
+            if not job.done:
+                job._fail(503, "The server shut down before the job finished; submit it again.")
+        self._tasks = []
+        self._queue = None
+        self._loop = None
@@ -0,0 +1,270 @@
+import time
+import bisect
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow LLM calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# A collector returns (name, type, help, [(labels, value), ...]) tuples at scrape time.
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base class for a metric with a fixed set of label names. Series are keyed
+    by the tuple of label values, so recording is one dict lookup. Metrics are
+    only updated from the event loop thread, which makes locking unnecessary.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def _labels(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, values))
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._render_series()
+
+    def _render_series(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing count, e.g. calls made or tokens used."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def _render_series(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. requests currently in flight."""
+
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "total")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets, plus their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.total += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series.counts) if series else 0
+
+    def _render_series(self) -> List[str]:
+        lines = []
+        for key, series in self._series.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series.total!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics a /metrics scrape reports: recorded metrics plus collectors read at scrape time."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Collector) -> None:
+        """Adds a callable whose samples are read on each scrape, for state that already keeps its own counts."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Metrics ---
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve an API request, by route template.", ("method", "route", "status"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "API requests currently being served.",
+))
+upstream_request_duration = registry.register(Histogram(
+    "upstream_request_duration_seconds", "Outbound calls to external providers, by status code or error.", ("upstream", "status"),
+))
+upstream_requests_in_flight = registry.register(Gauge(
+    "upstream_requests_in_flight", "Outbound calls currently waiting on an external provider.", ("upstream",),
+))
+gemini_tokens = registry.register(Counter(
+    "gemini_tokens_total", "Tokens Gemini reported using, by prompt or generated output.", ("kind",),
+))
+image_searches = registry.register(Counter(
+    "image_searches_total", "Uncached image searches by the provider that answered, or 'default' when none did.", ("source",),
+))
+image_fallbacks = registry.register(Counter(
+    "image_default_fallbacks_total", "Images replaced by DEFAULT_IMAGE_URL because a lookup failed or missed the deadline.", ("reason",),
+))
+stage_duration = registry.register(Histogram(
+    "stage_duration_seconds", "Time spent in each stage of request handling (gemini, images, parse, serialize, compress).", ("stage",),
+))
+compression_input_bytes = registry.register(Counter(
+    "http_response_compression_input_bytes_total", "Response body bytes before compression, by encoding.", ("encoding",),
+))
+compression_output_bytes = registry.register(Counter(
+    "http_response_compression_output_bytes_total", "Response body bytes sent after compression, by encoding.", ("encoding",),
+))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times the enclosed block into stage_duration_seconds{stage=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - started, name)
+
+
+def timed_stage(name: str) -> Callable[[Callable], Callable]:
+    """Decorator form of `stage` for plain functions."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_duration.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorate
+
+
+def record_gemini_usage(usage: Optional[Dict[str, Any]]) -> None:
+    """Counts the tokens in a Gemini response's usageMetadata, when present."""
+    if not usage:
+        return
+    gemini_tokens.inc("prompt", amount=usage.get("promptTokenCount", 0))
+    gemini_tokens.inc("output", amount=usage.get("candidatesTokenCount", 0))
+
+
+def cache_collector(caches: Dict[str, Any]) -> Collector:
+    """Exposes the hit/miss counts TTLCache already keeps, read only when scraped."""
+    def collect():
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        yield "cache_hits_total", "counter", "Cache lookups answered from the cache.", [
+            ({"cache": name}, s["hits"]) for name, s in stats.items()]
+        yield "cache_misses_total", "counter", "Cache lookups that missed.", [
+            ({"cache": name}, s["misses"]) for name, s in stats.items()]
+        yield "cache_hit_ratio", "gauge", "Share of lookups answered from the cache since startup.", [
+            ({"cache": name}, s["hit_ratio"]) for name, s in stats.items()]
+        yield "cache_entries", "gauge", "Entries held in memory.", [
+            ({"cache": name}, s["size"]) for name, s in stats.items()]
+    return collect
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording http_request_duration_seconds and the in-flight
+    gauge. Requests are labelled by route template (e.g. /save/saved-recipes/{username})
+    rather than raw path, so path parameters don't create a series each;
+    requests that match no route share the "unmatched" label.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            http_requests_in_flight.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route, status)
@@ -0,0 +1,294 @@
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.metrics import timed_stage
+
+# Matches ```json ... ``` style markdown fences around generated output.
+_CODE_FENCE = re.compile(r"```[a-zA-Z]*\s*")
+# A comma directly before a closing bracket, which json.loads rejects.
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class ParseResult:
+    """
+    Outcome of a tolerant parse: the recovered items plus how much of the
+    output could be used. `complete` is False when the output was cut off
+    (e.g. Gemini hit its token limit) and `failed` counts malformed items
+    that had to be dropped.
+    """
+
+    def __init__(self, items: List[Any], failed: int = 0, complete: bool = True):
+        self.items = items
+        self.failed = failed
+        self.complete = complete
+
+    @property
+    def recovered(self) -> int:
+        return len(self.items)
+
+    @property
+    def partial(self) -> bool:
+        return self.failed > 0 or not self.complete
+
+    def __repr__(self) -> str:
+        return f"ParseResult(recovered={self.recovered}, failed={self.failed}, complete={self.complete})"
+
+
+def strip_code_fences(text: str) -> str:
+    """Removes markdown code fences such as ```json that models wrap output in."""
+    return _CODE_FENCE.sub("", text).strip()
+
+
+def loads_lenient(text: str) -> Any:
+    """
+    json.loads that also accepts the mistakes LLMs commonly make: // comments
+    and trailing commas. Raises json.JSONDecodeError if the text still isn't JSON.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        cleaned = _TRAILING_COMMA.sub(r"\1", _strip_line_comments(text))
+        return json.loads(cleaned)
+
+
+def _strip_line_comments(text: str) -> str:
+    result = []
+    in_string = escaped = False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "/" and text.startswith("//", index):
+            newline = text.find("\n", index)
+            index = len(text) if newline == -1 else newline
+            continue
+        result.append(char)
+        index += 1
+    return "".join(result)
+
+
+def _scan_value(text: str, start: int) -> Tuple[Optional[int], List[Tuple[int, List[str]]], List[str], bool]:
+    """
+    Scans the JSON object or array starting at `start`. Returns the index just
+    past its end (None if the text was cut off first), the position and open
+    bracket stack at every structural comma, the stack left open at the end and
+    whether the text ended inside a string.
+    """
+    stack: List[str] = []
+    commas: List[Tuple[int, List[str]]] = []
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return index + 1, commas, stack, False
+        elif char == ",":
+            commas.append((index, list(stack)))
+    return None, commas, stack, in_string
+
+
+def _close(fragment: str, stack: List[str]) -> str:
+    return fragment + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def _recover_truncated(text: str, start: int) -> Optional[Any]:
+    """
+    Best-effort recovery of a value whose end was cut off: closes the open
+    string and brackets, and if that is not valid JSON, cuts back to earlier
+    commas until it is. Keeps every field that was fully generated.
+    """
+    _, commas, stack, in_string = _scan_value(text, start)
+    candidates = [_close(text[start:] + ('"' if in_string else ""), stack)]
+    candidates += [_close(text[start:position], open_stack) for position, open_stack in reversed(commas)]
+    for candidate in candidates:
+        try:
+            return loads_lenient(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+@timed_stage("parse")
+def extract_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Finds the first JSON object in model output and decodes it. Unlike a
+    greedy r"\\{.*\\}" search it stops at the object's real closing brace, so
+    trailing chatter or a second object doesn't break decoding, and an object
+    cut off mid-way is recovered up to its last complete field.
+    """
+    text = strip_code_fences(text)
+    start = text.find("{")
+    while start != -1:
+        end, _, _, _ = _scan_value(text, start)
+        if end is None:
+            recovered = _recover_truncated(text, start)
+            return recovered if isinstance(recovered, dict) else None
+        try:
+            value = loads_lenient(text[start:end])
+            if isinstance(value, dict):
+                return value
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+@timed_stage("parse")
+def parse_json_array(text: str) -> ParseResult:
+    """
+    Parses a JSON array of objects from model output, keeping every complete
+    object even when others are malformed or the array was cut off. A single
+    bare object is returned as a one-item result.
+    """
+    text = strip_code_fences(text)
+    array_start = text.find("[")
+    object_start = text.find("{")
+    if array_start == -1 or (object_start != -1 and object_start < array_start):
+        # Undecorated, so this parse isn't timed twice
+        value = extract_json_object.__wrapped__(text)
+        return ParseResult([value] if value is not None else [], complete=value is not None)
+
+    parser = JsonArrayStreamParser()
+    items = parser.feed(text[array_start:])
+    return ParseResult(items, failed=parser.objects_failed, complete=parser.complete)
+
+
+# --- Line-based "Key: Value" records ---
+@timed_stage("parse")
+def parse_key_value_records(text: str, fields: Dict[str, str], required: List[str]) -> ParseResult:
+    """
+    Parses blocks of "Key: Value" lines, such as
+
+        Recipe# 1
+        Recipe Name: Chicken Adobo
+        Time to Cook: 45 minutes
+
+    by key rather than by line position. `fields` maps lower-cased labels to
+    output field names. A new record starts when a label repeats or a
+    "Recipe#" header appears. Markdown bullets, numbering and bold markers
+    are ignored.
+    Records missing a `required` field are counted as failed.
+    """
+    records: List[Dict[str, str]] = []
+    current: Dict[str, str] = {}
+
+    def _flush() -> None:
+        if current:
+            records.append(dict(current))
+            current.clear()
+
+    for raw_line in strip_code_fences(text).splitlines():
+        line = raw_line.replace("**", "").strip().lstrip("-*• ").strip()
+        line = re.sub(r"^\d+[.)]\s+", "", line)
+        if not line:
+            continue
+        header = re.match(r"recipe\s*#\s*(\d+)", line, re.IGNORECASE)
+        if header:
+            _flush()
+            if "recipe#" in fields:
+                current[fields["recipe#"]] = header.group(1)
+            continue
+        if ":" not in line:
+            continue
+        label, value = line.split(":", 1)
+        field = fields.get(" ".join(label.lower().split()))
+        if field is None:
+            continue
+        if field in current:
+            _flush()
+        current[field] = value.strip()
+    _flush()
+
+    complete_records = [record for record in records if all(record.get(name) for name in required)]
+    return ParseResult(complete_records, failed=len(records) - len(complete_records))
+
+
+class JsonArrayStreamParser:
+    """
+    Incrementally parses a JSON array of objects that arrives in chunks, e.g.
+    a streamed Gemini response. Each call to `feed` returns the objects that
+    were completed by that chunk, so callers can act on them before the rest
+    of the array has been generated. Text before the opening "[" (such as a
+    ```json fence) is ignored, and malformed objects are skipped and counted.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.complete = False
+        self.objects_parsed = 0
+        self.objects_failed = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        completed = []
+        for char in chunk:
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                continue
+            if self.complete:
+                break
+
+            if self._depth > 0:
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._buffer = [char]
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the outer array.
+                    self.complete = True
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._decode("".join(self._buffer)))
+                    self._buffer = []
+        return completed
+
+    def _decode(self, text: str) -> List[Any]:
+        try:
+            value = loads_lenient(text)
+        except json.JSONDecodeError:
+            self.objects_failed += 1
+            return []
+        self.objects_parsed += 1
+        return [value]
@@ -0,0 +1,87 @@
+import os
+import hmac
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# --- Hashing Settings (overridable from the .env file) ---
+# scrypt cost parameters. Raising them makes new hashes slower to brute-force;
+# existing hashes are upgraded the next time their user logs in.
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", 8))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", 1))
+# Threads hashing at once. scrypt releases the GIL, so this bounds CPU used by
+# login storms while the event loop keeps serving other requests.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+
+_SCHEME = "scrypt"
+_SALT_BYTES = 16
+_KEY_BYTES = 32
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=_KEY_BYTES, maxmem=256 * 1024 * 1024)
+
+
+def hash_password_sync(password: str) -> str:
+    """Hashes a password as "scrypt$n$r$p$salt$key". Blocks for the full cost; prefer hash_password."""
+    salt = os.urandom(_SALT_BYTES)
+    key = _derive(password, salt, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return f"{_SCHEME}${PASSWORD_SCRYPT_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def verify_password_sync(password: str, stored_hash: str) -> bool:
+    """Checks a password against a stored hash in constant time. Malformed hashes never match."""
+    try:
+        scheme, n, r, p, salt, key = stored_hash.split("$")
+        if scheme != _SCHEME:
+            return False
+        derived = _derive(password, _b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, _b64decode(key))
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    """True when the hash was made with cost parameters other than the current ones."""
+    parts = stored_hash.split("$")
+    return len(parts) != 6 or parts[0] != _SCHEME or parts[1:4] != [
+        str(PASSWORD_SCRYPT_N), str(PASSWORD_SCRYPT_R), str(PASSWORD_SCRYPT_P),
+    ]
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _pool
+
+
+async def hash_password(password: str) -> str:
+    """Hashes on the bounded worker pool, so the event loop is never blocked."""
+    return await asyncio.get_running_loop().run_in_executor(_get_pool(), hash_password_sync, password)
+
+
+async def verify_password(password: str, stored_hash: str) -> bool:
+    """Verifies on the bounded worker pool, so the event loop is never blocked."""
+    return await asyncio.get_running_loop().run_in_executor(_get_pool(), verify_password_sync, password, stored_hash)
+
+
+def shutdown() -> None:
+    """Stops the worker pool. Called from the app's lifespan hook."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
@@ -0,0 +1,71 @@
+import time
+import heapq
+from typing import Dict, Iterable, List, Tuple
+
+
+class PopularityTracker:
+    """
+    Ranks keys by how often and how recently they were seen. Each sighting
+    counts 1, halving in weight every `half_life` seconds, so a key seen often
+    last week ranks below one seen a few times today.
+
+    Uses forward decay: a sighting at time t adds 2^((t - t0) / half_life)
+    instead of decaying every stored score, so recording is O(1) and scores
+    stay comparable. Scores are rescaled before they could overflow. At most
+    `max_keys` keys are kept; the lowest-ranked are dropped beyond that.
+    """
+
+    _RESCALE_ABOVE = 1e150
+
+    def __init__(self, name: str, half_life: float, max_keys: int):
+        self.name = name
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self._scores: Dict[str, float] = {}
+        self._origin = time.time()
+        self.recorded = 0
+
+    def _weight(self, at: float) -> float:
+        return 2 ** ((at - self._origin) / self.half_life)
+
+    def record(self, key: str) -> None:
+        """Counts one sighting of the key, now."""
+        self._add(key, 1.0, time.time())
+        self.recorded += 1
+
+    def _add(self, key: str, weight: float, at: float) -> None:
+        increment = weight * self._weight(at)
+        if increment > self._RESCALE_ABOVE:
+            self._rescale()
+            increment = weight * self._weight(at)
+        self._scores[key] = self._scores.get(key, 0.0) + increment
+        if len(self._scores) > self.max_keys * 1.1:
+            # Trim in batches, so the sort is paid once per max_keys / 10 new keys
+            self._scores = dict(heapq.nlargest(self.max_keys, self._scores.items(), key=lambda item: item[1]))
+
+    def _rescale(self) -> None:
+        """Moves the origin to now, dividing every score by the same factor."""
+        now = time.time()
+        factor = 2 ** ((now - self._origin) / self.half_life)
+        self._scores = {key: score / factor for key, score in self._scores.items()}
+        self._origin = now
+
+    def score(self, key: str) -> float:
+        """The key's decayed count as of now."""
+        return self._scores.get(key, 0.0) / self._weight(time.time())
+
+    def top(self, count: int) -> List[Tuple[str, float]]:
+        """The `count` highest-ranked keys with their decayed counts, best first."""
+        now_weight = self._weight(time.time())
+        return [
+            (key, score / now_weight)
+            for key, score in heapq.nlargest(count, self._scores.items(), key=lambda item: item[1])
+        ]
+
+    def load(self, scores: Iterable[Tuple[str, float]], at: float) -> None:
+        """Restores decayed counts as they were at time `at`, e.g. from a snapshot."""
+        for key, score in scores:
+            self._add(key, score, at)
+
+    def __len__(self) -> int:
+        return len(self._scores)
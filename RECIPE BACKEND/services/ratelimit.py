@@ -0,0 +1,157 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from services.errors import UpstreamUnavailable
+
+# --- Request Priorities ---
+# Lower numbers are served first. Interactive single-recipe calls outrank bulk
+# meal-plan work; routers doing bulk work set the context variable below.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+upstream_priority: ContextVar[int] = ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+# Share of each bucket that bulk work may not use, kept free for interactive calls.
+BULK_RESERVE_RATIO = float(os.getenv("RATE_LIMIT_BULK_RESERVE", 0.2))
+# Worker processes serving the app. Budgets are per account, so each worker
+# gets an equal slice and together they stay within the provider's limit.
+RATE_LIMIT_WORKERS = max(1, int(os.getenv("WORKERS", 1)))
+
+
+class RateLimitExceeded(UpstreamUnavailable):
+    """Raised when a provider's budget stays exhausted for longer than the caller can wait."""
+    status_code = 429
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(provider, retry_after, f"Rate limit for {provider} exhausted; retry in {retry_after:.1f}s.")
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` calls per `per` seconds, refilled continuously.
+    `try_acquire` never waits; `acquire` queues the caller by priority until a
+    token is free, so interactive calls are granted before queued bulk calls.
+    """
+
+    def __init__(self, name: str, rate: float, per: float):
+        self.name = name
+        self.capacity = float(rate)
+        self.refill_per_second = rate / per
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.rejected = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def _floor(self, priority: int) -> float:
+        """Tokens that must remain after a grant at this priority."""
+        return self.capacity * BULK_RESERVE_RATIO if priority > PRIORITY_INTERACTIVE else 0.0
+
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def try_acquire(self, priority: Optional[int] = None) -> bool:
+        """Takes a token if one is free right now (bulk callers leave the reserve untouched)."""
+        priority = upstream_priority.get() if priority is None else priority
+        self._refill()
+        if not self._waiters and self._tokens - 1 >= self._floor(priority):
+            self._tokens -= 1
+            self.granted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    async def acquire(self, priority: Optional[int] = None, max_wait: Optional[float] = None) -> None:
+        """
+        Waits for a token, served in priority order. Raises RateLimitExceeded
+        if none is granted within `max_wait` seconds.
+        """
+        priority = upstream_priority.get() if priority is None else priority
+        self._refill()
+        if not self._waiters and self._tokens - 1 >= self._floor(priority):
+            self._tokens -= 1
+            self.granted += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RateLimitExceeded(self.name, self.seconds_until_available())
+
+    async def _dispatch(self) -> None:
+        """Grants tokens to queued callers, highest priority first, as they refill."""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self._tokens - 1 >= self._floor(priority):
+                heapq.heappop(self._waiters)
+                self._tokens -= 1
+                self.granted += 1
+                future.set_result(None)
+                continue
+            needed = 1 + self._floor(priority) - self._tokens
+            await asyncio.sleep(needed / self.refill_per_second)
+
+    def seconds_until_available(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        self._refill()
+        needed = 1 + self._floor(priority) - self._tokens
+        return max(0.0, needed / self.refill_per_second)
+
+    def usage(self) -> Dict[str, float]:
+        self._refill()
+        return {
+            "capacity": self.capacity,
+            "available": round(self._tokens, 2),
+            "used_ratio": round(1 - self._tokens / self.capacity, 4),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "queued": sum(1 for _, _, future in self._waiters if not future.done()),
+        }
+
+
+def _bucket_from_env(name: str, env_var: str, default: str) -> TokenBucket:
+    """
+    Builds this worker's bucket from a "<calls>/<seconds>" setting, e.g.
+    PIXABAY_RATE_LIMIT=100/60, split evenly across RATE_LIMIT_WORKERS.
+    """
+    rate, per = os.getenv(env_var, default).split("/")
+    return TokenBucket(name, float(rate) / RATE_LIMIT_WORKERS, float(per))
+
+
+# --- Per-provider Budgets (overridable from the .env file) ---
+RATE_LIMITS: Dict[str, TokenBucket] = {
+    "gemini": _bucket_from_env("gemini", "GEMINI_RATE_LIMIT", "60/60"),
+    "pixabay": _bucket_from_env("pixabay", "PIXABAY_RATE_LIMIT", "100/60"),
+    "pexels": _bucket_from_env("pexels", "PEXELS_RATE_LIMIT", "200/3600"),
+    "unsplash": _bucket_from_env("unsplash", "UNSPLASH_RATE_LIMIT", "50/3600"),
+}
+
+
+def get_limiter(provider: str) -> Optional[TokenBucket]:
+    return RATE_LIMITS.get(provider)
+
+
+def usage() -> Dict[str, Dict[str, float]]:
+    """Budget usage for every provider, for monitoring."""
+    return {name: bucket.usage() for name, bucket in RATE_LIMITS.items()}
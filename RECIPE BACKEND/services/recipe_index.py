@@ -0,0 +1,225 @@
+import os
+import gzip
+import json
+import math
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from services.allergens import get_matcher, taxonomy_matcher
+from services.ingredients import ingredient_terms, normalize_name
+
+# --- Index Settings (overridable from the .env file) ---
+# Gzipped snapshot the index is loaded from on startup and saved to on shutdown.
+# Leave unset to keep the index in memory only. With several worker processes
+# each keeps its own index, and the last one to shut down writes the snapshot.
+RECIPE_INDEX_PATH = os.getenv("RECIPE_INDEX_PATH") or None
+# /recommend answers locally only when at least this many recipes match...
+RECIPE_INDEX_MIN_RESULTS = int(os.getenv("RECIPE_INDEX_MIN_RESULTS", 3))
+# ...each using at least this share of the requested ingredients.
+RECIPE_INDEX_MIN_COVERAGE = float(os.getenv("RECIPE_INDEX_MIN_COVERAGE", 0.6))
+RECIPE_INDEX_MAX_RESULTS = int(os.getenv("RECIPE_INDEX_MAX_RESULTS", 8))
+
+# BM25 parameters. Ingredient lists are sets, so only length normalization matters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SNAPSHOT_VERSION = 2
+
+
+class IndexedRecipe:
+    """
+    One recipe in the local corpus: display fields, its ingredient terms and
+    the allergen categories it contains, as a services.allergens bitset.
+    """
+
+    __slots__ = ("name", "cook_time", "difficulty", "image_url", "terms", "allergens")
+
+    def __init__(self, name: str, cook_time: str, difficulty: str, image_url: str, terms: Set[str], allergens: int):
+        self.name = name
+        self.cook_time = cook_time
+        self.difficulty = difficulty
+        self.image_url = image_url
+        self.terms = terms
+        self.allergens = allergens
+
+
+class RecipeIndex:
+    """
+    Inverted index from normalized ingredient terms to recipes, built from
+    every recipe the service generates or saves. `search` ranks recipes by
+    BM25 over the requested ingredients, so rare ingredients weigh more than
+    salt and oil, and drops any recipe containing a requested allergen.
+    """
+
+    def __init__(self):
+        self.recipes: Dict[str, IndexedRecipe] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self._total_terms = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.recipes)
+
+    def add(self, name: str, ingredients: Iterable[str], cook_time: str = "", difficulty: str = "", image_url: str = "") -> None:
+        """Adds a recipe, replacing an earlier entry with the same name."""
+        recipe_id = normalize_name(name or "")
+        if isinstance(ingredients, str):
+            ingredients = [ingredients]
+        ingredients = [ingredient for ingredient in ingredients or () if isinstance(ingredient, str)]
+        terms = {term for ingredient in ingredients for term in ingredient_terms(ingredient)}
+        if not recipe_id or not terms:
+            return
+        self.remove(recipe_id)
+        allergens = taxonomy_matcher.scan([name, *ingredients])
+        self.recipes[recipe_id] = IndexedRecipe(name, str(cook_time or ""), difficulty or "", image_url or "", terms, allergens)
+        self._total_terms += len(terms)
+        for term in terms:
+            self.postings.setdefault(term, set()).add(recipe_id)
+
+    def remove(self, recipe_id: str) -> None:
+        recipe = self.recipes.pop(recipe_id, None)
+        if recipe is None:
+            return
+        self._total_terms -= len(recipe.terms)
+        for term in recipe.terms:
+            ids = self.postings.get(term)
+            if ids is not None:
+                ids.discard(recipe_id)
+                if not ids:
+                    del self.postings[term]
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.recipes) - df + 0.5) / (df + 0.5))
+
+    def search(
+        self,
+        ingredients: List[str],
+        allergies: List[str] = (),
+        min_coverage: float = 0.0,
+        limit: int = RECIPE_INDEX_MAX_RESULTS,
+    ) -> List[IndexedRecipe]:
+        """
+        Recipes best matching the ingredients, highest BM25 score first.
+        Coverage is the share of requested ingredients whose every term the
+        recipe uses; recipes below `min_coverage` or containing an allergy
+        are left out.
+        """
+        wanted = [terms for terms in (set(ingredient_terms(ingredient)) for ingredient in ingredients) if terms]
+        query_terms = set().union(*wanted) if wanted else set()
+        if not query_terms or not self.recipes:
+            return []
+        matcher = get_matcher(allergies)
+        avoided = [set(term) for term in matcher.custom_terms]
+
+        candidates: Set[str] = set()
+        for term in query_terms:
+            candidates |= self.postings.get(term, set())
+
+        average_length = self._total_terms / len(self.recipes)
+        idf = {term: self._idf(term) for term in query_terms}
+        scored = []
+        for recipe_id in candidates:
+            recipe = self.recipes[recipe_id]
+            coverage = sum(1 for terms in wanted if terms <= recipe.terms) / len(wanted)
+            if coverage < min_coverage:
+                continue
+            if recipe.allergens & matcher.category_mask:
+                continue
+            if avoided:
+                name_terms = set(ingredient_terms(recipe.name))
+                if any(terms <= recipe.terms or terms <= name_terms for terms in avoided):
+                    continue
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(recipe.terms) / average_length)
+            score = sum(idf[term] * (BM25_K1 + 1) / (1 + length_norm) for term in query_terms & recipe.terms)
+            scored.append((score, recipe_id))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.recipes[recipe_id] for _, recipe_id in scored[:limit]]
+
+    def recommend(self, ingredients: List[str], allergies: List[str]) -> Optional[List[IndexedRecipe]]:
+        """
+        Local answer for /recommend, or None when the index doesn't cover the
+        request well enough and the caller should ask Gemini instead.
+        """
+        matches = self.search(ingredients, allergies, min_coverage=RECIPE_INDEX_MIN_COVERAGE)
+        if len(matches) < RECIPE_INDEX_MIN_RESULTS:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return matches
+
+    # --- Snapshots ---
+    def save(self, path: str) -> None:
+        """
+        Writes the index as gzipped JSON. Terms are stored once in a vocabulary
+        and recipes refer to them by position, which keeps the file small.
+        The file is replaced atomically so a crash never leaves half a snapshot.
+        """
+        vocabulary = sorted(self.postings)
+        positions = {term: position for position, term in enumerate(vocabulary)}
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "terms": vocabulary,
+            "recipes": [
+                [
+                    recipe.name, recipe.cook_time, recipe.difficulty, recipe.image_url,
+                    sorted(positions[term] for term in recipe.terms), recipe.allergens,
+                ]
+                for recipe in self.recipes.values()
+            ],
+        }
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temporary_path, "wt", encoding="utf-8") as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(",", ":"))
+        os.replace(temporary_path, path)
+
+    def load(self, path: str) -> int:
+        """Replaces the index with a snapshot written by `save`. Returns the number of recipes loaded."""
+        with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported recipe index snapshot version: {snapshot.get('version')}")
+
+        self.recipes.clear()
+        self.postings.clear()
+        self._total_terms = 0
+        vocabulary = snapshot["terms"]
+        for name, cook_time, difficulty, image_url, term_ids, allergens in snapshot["recipes"]:
+            recipe_id = normalize_name(name)
+            terms = {vocabulary[term_id] for term_id in term_ids}
+            self.recipes[recipe_id] = IndexedRecipe(name, cook_time, difficulty, image_url, terms, allergens)
+            self._total_terms += len(terms)
+            for term in terms:
+                self.postings.setdefault(term, set()).add(recipe_id)
+        return len(self.recipes)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "recipes": len(self.recipes),
+            "terms": len(self.postings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# The shared corpus used by every router.
+recipe_index = RecipeIndex()
+
+
+def load_snapshot() -> None:
+    """Loads RECIPE_INDEX_PATH, if set and present. Called from the app's lifespan hook."""
+    if RECIPE_INDEX_PATH and os.path.exists(RECIPE_INDEX_PATH):
+        try:
+            count = recipe_index.load(RECIPE_INDEX_PATH)
+            print(f"Loaded {count} recipes into the local recipe index.")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load the recipe index snapshot: {e}")
+
+
+def save_snapshot() -> None:
+    """Saves the index to RECIPE_INDEX_PATH, if set."""
+    if RECIPE_INDEX_PATH:
+        recipe_index.save(RECIPE_INDEX_PATH)
@@ -0,0 +1,30 @@
+import os
+from typing import List
+
+from services.cache import TTLCache
+from services.ingredients import canonical_ingredients, normalize_name
+
+# --- Cache Settings (overridable from the .env file) ---
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+# SQLite file for the on-disk tier. Leave unset to keep the cache in memory only.
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH") or None
+
+# Cached /recipes/recommend results, keyed by recommend_key().
+recommend_cache = TTLCache("recommend", RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, disk_path=RESPONSE_CACHE_PATH)
+# Cached Gemini-generated recipe details, keyed by details_key().
+details_cache = TTLCache("recipe_details", RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, disk_path=RESPONSE_CACHE_PATH)
+
+
+def recommend_key(ingredients: List[str], allergies: List[str]) -> str:
+    """
+    Canonical key for a recommend request. Ingredients and allergies are
+    normalized, de-pluralized and sorted, so "Eggs, Tomato" and "tomatoes, egg"
+    share one entry.
+    """
+    return "ingredients=" + ",".join(canonical_ingredients(ingredients)) + "|allergies=" + ",".join(canonical_ingredients(allergies))
+
+
+def details_key(recipe_name: str) -> str:
+    """Canonical key for a recipe-details request."""
+    return normalize_name(recipe_name)
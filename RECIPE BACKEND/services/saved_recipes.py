@@ -0,0 +1,350 @@
+import os
+import json
+import uuid
+import bisect
+import sqlite3
+import itertools
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from services.ingredients import normalize_name
+
+# SQLite file saved recipes are kept in. Leave unset to keep them in memory only.
+SAVED_RECIPES_PATH = os.getenv("SAVED_RECIPES_PATH") or None
+
+
+class SavedRecipe:
+    """
+    One saved recipe. Slotted, with tuples for the lists, to keep per-recipe
+    memory small. `id` is assigned by the store on save, increases with every
+    save and is what pagination cursors point at.
+    """
+
+    FIELDS = (
+        "recipe_name", "description", "ingredients", "instructions",
+        "servings", "difficulty", "cook_time", "image_url",
+    )
+    __slots__ = FIELDS + ("id",)
+
+    def __init__(
+        self,
+        recipe_name: str,
+        description: str,
+        ingredients: Iterable[str],
+        instructions: Iterable[str],
+        servings: str,
+        difficulty: str,
+        cook_time: str,
+        image_url: str,
+    ):
+        self.recipe_name = recipe_name
+        self.description = description
+        self.ingredients = tuple(ingredients)
+        self.instructions = tuple(instructions)
+        self.servings = servings
+        self.difficulty = difficulty
+        self.cook_time = cook_time
+        self.image_url = image_url
+        self.id = 0
+
+    @property
+    def key(self) -> str:
+        return recipe_key(self.recipe_name)
+
+    def to_row(self) -> List[Any]:
+        """Compact positional form used by the SQLite store."""
+        return [getattr(self, field) for field in self.FIELDS]
+
+    @classmethod
+    def from_row(cls, row: List[Any], recipe_id: int = 0) -> "SavedRecipe":
+        recipe = cls(*row)
+        recipe.id = recipe_id
+        return recipe
+
+    def to_summary(self) -> Dict[str, Any]:
+        """The lightweight projection used by list views, without ingredients or instructions."""
+        return {
+            "recipe_name": self.recipe_name,
+            "image_url": self.image_url,
+            "cook_time": self.cook_time,
+            "difficulty": self.difficulty,
+        }
+
+    def to_dict(self, username: str) -> Dict[str, Any]:
+        """The response shape the frontend expects, matching SaveRecipeRequest."""
+        return {
+            "username": username,
+            "recipe_name": self.recipe_name,
+            "description": self.description,
+            "ingredients": list(self.ingredients),
+            "instructions": list(self.instructions),
+            "servings": self.servings,
+            "difficulty": self.difficulty,
+            "cook_time": self.cook_time,
+            "image_url": self.image_url,
+        }
+
+
+def recipe_key(recipe_name: str) -> str:
+    """Saved recipes are unique per user by name, ignoring case and punctuation."""
+    return normalize_name(recipe_name)
+
+
+class SavedRecipeStore:
+    """
+    Storage backend for saved recipes, keyed by lower-cased username and the
+    normalized recipe name. Implementations must make `add` and `remove`
+    atomic, so concurrent saves of the same recipe store it once, and bump
+    the user's version on every change so clients can revalidate cheaply.
+    `generation` identifies the store's lifetime: versions of an in-memory
+    store restart from zero, so they are only comparable within one generation.
+    """
+
+    generation = ""
+
+    def add(self, username: str, recipe: SavedRecipe) -> bool:
+        """Saves the recipe. Returns False if the user already saved one with this name."""
+        raise NotImplementedError
+
+    def remove(self, username: str, recipe_name: str) -> bool:
+        """Deletes the recipe. Returns False if the user has no recipe with this name."""
+        raise NotImplementedError
+
+    def add_many(self, username: str, recipes: List[SavedRecipe]) -> List[bool]:
+        """
+        Saves every recipe in one atomic step, bumping the version once.
+        Returns whether each one was added; repeats within the batch count as duplicates.
+        """
+        raise NotImplementedError
+
+    def remove_many(self, username: str, recipe_names: List[str]) -> List[bool]:
+        """Deletes every named recipe in one atomic step. Returns whether each one was found."""
+        raise NotImplementedError
+
+    def list(self, username: str) -> List[SavedRecipe]:
+        """The user's saved recipes, oldest first."""
+        return self.page(username)
+
+    def page(self, username: str, after_id: int = 0, limit: Optional[int] = None) -> List[SavedRecipe]:
+        """Up to `limit` of the user's recipes saved after the one with `after_id`, oldest first."""
+        raise NotImplementedError
+
+    def version(self, username: str) -> int:
+        """Counter that changes whenever the user's saved recipes change."""
+        raise NotImplementedError
+
+    def get(self, username: str, recipe_name: str) -> Optional[SavedRecipe]:
+        raise NotImplementedError
+
+    def count(self, username: str) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _UserRecipes:
+    """One user's recipes in the memory store: a name index plus ids in save order for paging."""
+
+    __slots__ = ("by_key", "ids", "by_id", "version")
+
+    def __init__(self):
+        self.by_key: Dict[str, SavedRecipe] = {}
+        self.ids: List[int] = []
+        self.by_id: Dict[int, SavedRecipe] = {}
+        self.version = 0
+
+
+class MemorySavedRecipeStore(SavedRecipeStore):
+    """
+    In-process store. Each user's recipes are indexed by normalized name,
+    which makes duplicate checks O(1), and by id in save order, so a page is
+    found by bisecting to the cursor instead of scanning from the start.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, _UserRecipes] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.generation = uuid.uuid4().hex[:8]
+
+    def add(self, username: str, recipe: SavedRecipe) -> bool:
+        return self.add_many(username, [recipe])[0]
+
+    def remove(self, username: str, recipe_name: str) -> bool:
+        return self.remove_many(username, [recipe_name])[0]
+
+    def add_many(self, username: str, recipes: List[SavedRecipe]) -> List[bool]:
+        with self._lock:
+            user = self._users.setdefault(username, _UserRecipes())
+            added = []
+            for recipe in recipes:
+                if recipe.key in user.by_key:
+                    added.append(False)
+                    continue
+                recipe.id = next(self._ids)
+                user.by_key[recipe.key] = recipe
+                user.by_id[recipe.id] = recipe
+                user.ids.append(recipe.id)
+                added.append(True)
+            if any(added):
+                user.version += 1
+            return added
+
+    def remove_many(self, username: str, recipe_names: List[str]) -> List[bool]:
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                return [False] * len(recipe_names)
+            removed_ids = set()
+            removed = []
+            for recipe_name in recipe_names:
+                recipe = user.by_key.pop(recipe_key(recipe_name), None)
+                removed.append(recipe is not None)
+                if recipe is not None:
+                    del user.by_id[recipe.id]
+                    removed_ids.add(recipe.id)
+            if removed_ids:
+                # One pass over the ids instead of a bisect-and-shift per deleted recipe
+                user.ids = [recipe_id for recipe_id in user.ids if recipe_id not in removed_ids]
+                user.version += 1
+            return removed
+
+    def page(self, username: str, after_id: int = 0, limit: Optional[int] = None) -> List[SavedRecipe]:
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                return []
+            start = bisect.bisect_right(user.ids, after_id)
+            end = len(user.ids) if limit is None else start + limit
+            return [user.by_id[recipe_id] for recipe_id in user.ids[start:end]]
+
+    def get(self, username: str, recipe_name: str) -> Optional[SavedRecipe]:
+        with self._lock:
+            user = self._users.get(username)
+            return user.by_key.get(recipe_key(recipe_name)) if user else None
+
+    def count(self, username: str) -> int:
+        with self._lock:
+            user = self._users.get(username)
+            return len(user.by_key) if user else 0
+
+    def version(self, username: str) -> int:
+        with self._lock:
+            user = self._users.get(username)
+            return user.version if user else 0
+
+
+class SqliteSavedRecipeStore(SavedRecipeStore):
+    """
+    Persistent store in a single SQLite file (WAL mode), so saved recipes
+    survive restarts. The unique (username, recipe_key) index is the per-user
+    index, and INSERT OR IGNORE makes duplicate checks atomic. Versions are
+    stored alongside and bumped in the same transaction as the change.
+    """
+
+    generation = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS saved_recipes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " username TEXT NOT NULL,"
+            " recipe_key TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " UNIQUE (username, recipe_key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS saved_recipe_versions ("
+            " username TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL)"
+        )
+
+    def _bump_version(self, username: str) -> None:
+        self._conn.execute(
+            "INSERT INTO saved_recipe_versions (username, version) VALUES (?, 1)"
+            " ON CONFLICT (username) DO UPDATE SET version = version + 1",
+            (username,),
+        )
+
+    def _write(self, username: str, sql: str, params_list: List[tuple]) -> List[bool]:
+        """
+        Runs an insert or delete per parameter tuple in one transaction and,
+        if any changed a row, bumps the user's version in the same transaction.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                changed = [self._conn.execute(sql, params).rowcount == 1 for params in params_list]
+                if any(changed):
+                    self._bump_version(username)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def add(self, username: str, recipe: SavedRecipe) -> bool:
+        return self.add_many(username, [recipe])[0]
+
+    def remove(self, username: str, recipe_name: str) -> bool:
+        return self.remove_many(username, [recipe_name])[0]
+
+    def add_many(self, username: str, recipes: List[SavedRecipe]) -> List[bool]:
+        return self._write(
+            username,
+            "INSERT OR IGNORE INTO saved_recipes (username, recipe_key, data) VALUES (?, ?, ?)",
+            [(username, recipe.key, json.dumps(recipe.to_row(), separators=(",", ":"))) for recipe in recipes],
+        )
+
+    def remove_many(self, username: str, recipe_names: List[str]) -> List[bool]:
+        return self._write(
+            username,
+            "DELETE FROM saved_recipes WHERE username = ? AND recipe_key = ?",
+            [(username, recipe_key(recipe_name)) for recipe_name in recipe_names],
+        )
+
+    def page(self, username: str, after_id: int = 0, limit: Optional[int] = None) -> List[SavedRecipe]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, data FROM saved_recipes WHERE username = ? AND id > ? ORDER BY id LIMIT ?",
+                (username, after_id, -1 if limit is None else limit),
+            ).fetchall()
+        return [SavedRecipe.from_row(json.loads(data), recipe_id) for recipe_id, data in rows]
+
+    def get(self, username: str, recipe_name: str) -> Optional[SavedRecipe]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, data FROM saved_recipes WHERE username = ? AND recipe_key = ?",
+                (username, recipe_key(recipe_name)),
+            ).fetchone()
+        return SavedRecipe.from_row(json.loads(row[1]), row[0]) if row else None
+
+    def count(self, username: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM saved_recipes WHERE username = ?", (username,)
+            ).fetchone()[0]
+
+    def version(self, username: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM saved_recipe_versions WHERE username = ?", (username,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _build_store() -> SavedRecipeStore:
+    return SqliteSavedRecipeStore(SAVED_RECIPES_PATH) if SAVED_RECIPES_PATH else MemorySavedRecipeStore()
+
+
+# The store used by the save router.
+saved_recipe_store: SavedRecipeStore = _build_store()
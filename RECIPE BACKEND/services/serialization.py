@@ -0,0 +1,16 @@
+from typing import Any
+
+import orjson
+
+from services import metrics
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def dumps(content: Any) -> bytes:
+    """
+    JSON-encodes a response body with orjson, timed as the "serialize" stage.
+    Non-string dict keys are converted like the standard library does.
+    """
+    with metrics.stage("serialize"):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
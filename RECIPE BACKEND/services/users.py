@@ -0,0 +1,191 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from services.cache import TTLCache
+
+# Verified access tokens kept so repeated requests from a session skip signature checks.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+# SQLite file users are kept in, so password and profile changes survive
+# restarts and are seen by every worker process. Leave unset to keep users in memory only.
+USERS_PATH = os.getenv("USERS_PATH") or None
+
+
+class UserConflict(Exception):
+    """Raised when a username or email is already used by another user."""
+
+
+class UserDirectory:
+    """
+    Users indexed by lower-cased username and by lower-cased email, so both
+    lookups are O(1). `update` changes a user's username or email and moves
+    both index entries together, refusing values another user already has.
+    Users are any objects with `username` and `email` attributes.
+    """
+
+    def __init__(self, users: Iterable[Any] = ()):
+        self._by_username: Dict[str, Any] = {}
+        self._by_email: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        for user in users:
+            self.add(user)
+
+    def __len__(self) -> int:
+        return len(self._by_username)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._by_username.values()))
+
+    def add(self, user: Any) -> None:
+        with self._lock:
+            self._check_free(user, user.username, user.email)
+            self._by_username[user.username.lower()] = user
+            self._by_email[user.email.lower()] = user
+
+    def get_by_username(self, username: str) -> Optional[Any]:
+        return self._by_username.get(username.lower())
+
+    def get_by_email(self, email: str) -> Optional[Any]:
+        return self._by_email.get(email.lower())
+
+    def update(self, user: Any, username: Optional[str] = None, email: Optional[str] = None) -> None:
+        """Changes the user's username and/or email, keeping both indexes consistent."""
+        with self._lock:
+            new_username = user.username if username is None else username
+            new_email = user.email if email is None else email
+            self._check_free(user, new_username, new_email)
+
+            del self._by_username[user.username.lower()]
+            del self._by_email[user.email.lower()]
+            user.username = new_username
+            user.email = new_email
+            self._by_username[new_username.lower()] = user
+            self._by_email[new_email.lower()] = user
+
+    def save(self, user: Any) -> None:
+        """Stores changes made to the user's other fields. Users in memory are changed in place already."""
+
+    def _check_free(self, user: Any, username: str, email: str) -> None:
+        owner = self._by_username.get(username.lower())
+        if owner is not None and owner is not user:
+            raise UserConflict(f"Username '{username}' is already taken.")
+        owner = self._by_email.get(email.lower())
+        if owner is not None and owner is not user:
+            raise UserConflict(f"Email '{email}' is already in use.")
+
+
+class SqliteUserDirectory(UserDirectory):
+    """
+    UserDirectory in a SQLite file (WAL mode) that several worker processes
+    can share. The username and email indexes are the table's unique keys,
+    and every lookup reads the current row, so a password or profile change
+    made through one worker is seen by the next request on any other. Users
+    are pydantic models rebuilt with `user_type`; call `save` after changing
+    a field other than username or email.
+    """
+
+    def __init__(self, path: str, user_type: Callable[..., Any], users: Iterable[Any] = ()):
+        self.path = path
+        self.user_type = user_type
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " username_key TEXT PRIMARY KEY,"
+            " email_key TEXT NOT NULL UNIQUE,"
+            " data TEXT NOT NULL)"
+        )
+        # Seed users are only inserted once, so changes made since aren't overwritten on restart
+        for user in users:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO users (username_key, email_key, data) VALUES (?, ?, ?)",
+                (user.username.lower(), user.email.lower(), self._dump(user)),
+            )
+
+    @staticmethod
+    def _dump(user: Any) -> str:
+        return json.dumps(user.model_dump(), separators=(",", ":"))
+
+    def _fetch(self, sql: str, params: tuple) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return self.user_type(**json.loads(row[0])) if row else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM users").fetchall()
+        return iter([self.user_type(**json.loads(data)) for data, in rows])
+
+    def add(self, user: Any) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_free_row(None, user.username, user.email)
+                self._conn.execute(
+                    "INSERT INTO users (username_key, email_key, data) VALUES (?, ?, ?)",
+                    (user.username.lower(), user.email.lower(), self._dump(user)),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_by_username(self, username: str) -> Optional[Any]:
+        return self._fetch("SELECT data FROM users WHERE username_key = ?", (username.lower(),))
+
+    def get_by_email(self, email: str) -> Optional[Any]:
+        return self._fetch("SELECT data FROM users WHERE email_key = ?", (email.lower(),))
+
+    def update(self, user: Any, username: Optional[str] = None, email: Optional[str] = None) -> None:
+        """Changes the user's username and/or email in one transaction, refusing values another user has."""
+        new_username = user.username if username is None else username
+        new_email = user.email if email is None else email
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_free_row(user.username.lower(), new_username, new_email)
+                user_data = json.loads(self._dump(user))
+                user_data.update(username=new_username, email=new_email)
+                self._conn.execute(
+                    "UPDATE users SET username_key = ?, email_key = ?, data = ? WHERE username_key = ?",
+                    (new_username.lower(), new_email.lower(), json.dumps(user_data, separators=(",", ":")), user.username.lower()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        user.username = new_username
+        user.email = new_email
+
+    def save(self, user: Any) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE users SET data = ? WHERE username_key = ?", (self._dump(user), user.username.lower()))
+
+    def _check_free_row(self, own_key: Optional[str], username: str, email: str) -> None:
+        row = self._conn.execute("SELECT username_key FROM users WHERE username_key = ?", (username.lower(),)).fetchone()
+        if row is not None and row[0] != own_key:
+            raise UserConflict(f"Username '{username}' is already taken.")
+        row = self._conn.execute("SELECT username_key FROM users WHERE email_key = ?", (email.lower(),)).fetchone()
+        if row is not None and row[0] != own_key:
+            raise UserConflict(f"Email '{email}' is already in use.")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_user_directory(user_type: Callable[..., Any], users: Iterable[Any] = ()) -> UserDirectory:
+    """The directory for the given seed users: in USERS_PATH when set, otherwise in memory."""
+    return SqliteUserDirectory(USERS_PATH, user_type, users) if USERS_PATH else UserDirectory(users)
+
+
+# Verified access tokens, keyed by the token's SHA-256 and holding the username
+# it was issued for. Each entry expires with the token's own `exp`.
+verified_tokens = TTLCache("verified_tokens", AUTH_TOKEN_CACHE_SIZE, ttl=0)
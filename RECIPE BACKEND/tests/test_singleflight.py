@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from services.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(3)))
+        self.assertEqual(results, ["value"] * 3)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    async def test_call_after_last_waiter_cancelled_starts_fresh(self):
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiter = asyncio.create_task(flight.do("k", slow))
+        await started.wait()
+        waiter.cancel()
+        # One step lets the waiter cancel the shared call, which has not finished cancelling yet
+        await asyncio.sleep(0)
+
+        async def fast():
+            return "fresh"
+
+        self.assertEqual(await flight.do("k", fast), "fresh")
+        self.assertEqual(flight.started, 2)
+        self.assertTrue(waiter.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()